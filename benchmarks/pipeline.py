@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+"""
+Measures how the pipelines scale with the size of the data.
+
+Synthetic data sets of the requested size, i.e., the number of EOM states,
+basis sets, geometries, and correction files, are written to a temporary
+directory and pushed through
+    find_cbs            load, sort, fit, plot, serialize
+    pprint_final        main (-x)
+    pprint_dT           main (-x)
+    merge               main
+    scan                load, fit, serialize
+The wall time of every stage is the median of the repeated runs; the peak
+memory is traced with `tracemalloc` in an extra run (the plot workers are
+separate processes and are not traced).
+
+The results are compared with a baseline JSON file written by `--save`. A
+stage that is slower than the baseline by more than the tolerance is marked
+as such. The baseline holds only for the same sizes and a similar machine.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO, 'dT'))
+sys.path.insert(0, os.path.join(REPO, 'cbs_fit'))
+sys.path.insert(0, REPO)
+import numpy as np  # noqa: E402
+from columnar import ColumnarDataset, load_dataset  # noqa: E402
+from core import ha2eV  # noqa: E402
+import events  # noqa: E402
+import find_cbs  # noqa: E402
+import merge  # noqa: E402
+import plots  # noqa: E402
+import pprint_dT  # noqa: E402
+import pprint_final_energies  # noqa: E402
+import records  # noqa: E402
+import scan_cbs  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'baseline.json')
+BASIS_FAMILY = ('aug-pwCVDZ', 'aug-pwCVTZ', 'aug-pwCVQZ', 'aug-pwCV5Z')
+IRREPS = ('A1', 'A2', 'B1', 'B2')
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip(),
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        '-s', '--states', type=int, default=400,
+        help="Number of EOM states. Default: %(default)s.")
+    parser.add_argument(
+        '-b', '--basis', type=int, default=4,
+        help=f"Number of basis sets, 3 to {len(BASIS_FAMILY)}. Default:"
+        " %(default)s.")
+    parser.add_argument(
+        '-g', '--geometries', type=int, default=50,
+        help="Number of geometries of the scan. Default: %(default)s.")
+    parser.add_argument(
+        '-f', '--files', type=int, default=8,
+        help="Number of correction files merged. Default: %(default)s.")
+    parser.add_argument(
+        '-p', '--plots', type=int, default=4,
+        help="Number of fits plotted to png files; 0 skips the plot stage."
+        " Default: %(default)s.")
+    parser.add_argument(
+        '-n', '--repeat', type=int, default=5,
+        help="Number of timed runs. Default: %(default)s.")
+    parser.add_argument(
+        '--baseline', default=DEFAULT_BASELINE,
+        help="Baseline JSON file. Default: %(default)s.")
+    parser.add_argument(
+        '--save', default=False, action='store_true',
+        help="Save the results as the new baseline.")
+    parser.add_argument(
+        '-t', '--tolerance', type=float, default=1.25,
+        help="Mark the stages slower than tolerance × baseline. Default:"
+        " %(default)s.")
+    args = parser.parse_args()
+    if not 3 <= args.basis <= len(BASIS_FAMILY):
+        parser.error(f"--basis has to be between 3 and {len(BASIS_FAMILY)}.")
+    return args
+
+
+def synthetic_calculations(nstates: int, bases, calclevel: str = 'CCSD',
+                           seed: int = 0):
+    """
+    Returns the ab initio data set of `nstates` EOM states computed with the
+    `bases`. The energies follow the exponential SCF and the inverse cube
+    correlation models with random parameters.
+    """
+    rng = np.random.default_rng(seed)
+    scf_cbs = -224.37 + 0.01 * rng.standard_normal()
+    correlation_cbs = -1.10 + 0.01 * rng.standard_normal()
+    excitation = rng.uniform(0.15, 0.35, nstates)
+    state_slope = rng.uniform(-0.05, 0.05, nstates)
+
+    calculations = list()
+    for basis in bases:
+        n = BASIS_FAMILY.index(basis) + 2
+        scf = scf_cbs + 0.5 * np.exp(-1.6 * n)
+        cc_energy = scf + correlation_cbs + 0.6 / n**3
+        energies = cc_energy + excitation + state_slope / n**3
+        calculations += [{
+            'basis': basis,
+            'calclevel': calclevel,
+            'scf': float(scf),
+            'cc_energy': float(cc_energy),
+            'EOM': [
+                {
+                    'irrep': {'energy #': state // len(IRREPS) + 1,
+                              'name': IRREPS[state % len(IRREPS)]},
+                    'model': 'EOMEE-' + calclevel,
+                    'energy': energy,
+                }
+                for state, energy in enumerate(energies.tolist())
+            ],
+        }]
+    return calculations
+
+
+def synthetic_xsim(nstates: int, model: str, mean: float, seed: int = 0):
+    """ The xsim's 'better energies' scattered around the `mean` in a.u. """
+    rng = np.random.default_rng(seed)
+    return [
+        {
+            'irrep': {'energy #': state // len(IRREPS) + 1,
+                      'name': IRREPS[state % len(IRREPS)]},
+            'model': model,
+            'energy': {'transition': {'au': au, 'eV': au * ha2eV}},
+        }
+        for state, au in enumerate(
+            (mean + 0.001 * rng.standard_normal(nstates)).tolist())
+    ]
+
+
+def write_json(file_name, document):
+    with open(file_name, 'w') as output:
+        json.dump(document, output)
+    return file_name
+
+
+def run_main(module, argv, output):
+    """ Runs the tool's main in this process with its output in a file. """
+    saved_argv = sys.argv
+    sys.argv = [module.__name__] + list(argv)
+    try:
+        with open(output, 'w') as file, contextlib.redirect_stdout(file):
+            module.main()
+    finally:
+        sys.argv = saved_argv
+
+
+class Workspace:
+    """ The synthetic input files of all the pipelines. """
+
+    def __init__(self, directory, nstates: int, nbasis: int,
+                 ngeometries: int, nfiles: int):
+        self.directory = directory
+        bases = BASIS_FAMILY[:nbasis]
+        largest = bases[-1:]
+        self.ab_initio = write_json(
+            self.path('ab_initio.json'),
+            synthetic_calculations(nstates, bases))
+        self.better = write_json(
+            self.path('better.json'),
+            synthetic_calculations(nstates, largest, 'CCSDT', seed=1)[0])
+        self.worse = write_json(
+            self.path('worse.json'),
+            synthetic_calculations(nstates, largest, 'CCSD', seed=1)[0])
+        self.first = write_json(
+            self.path('first.json'),
+            synthetic_xsim(nstates, 'EOMEE-CCSD', 0.25))
+        self.corrections = [
+            write_json(self.path(f'correction_{index}.json'),
+                       synthetic_xsim(nstates, f'Δ{index}', 0.0, index + 1))
+            for index in range(nfiles)
+        ]
+        os.makedirs(self.path('scan'))
+        self.geometries = [
+            write_json(self.path('scan', f'{geometry:04d}.json'),
+                       synthetic_calculations(nstates, bases, seed=geometry))
+            for geometry in range(ngeometries)
+        ]
+        # Written by the find_cbs pipeline, read by pprint_final
+        self.cbs = self.path('cbs.json')
+
+    def path(self, *names):
+        return os.path.join(self.directory, *names)
+
+
+def find_cbs_stages(workspace: Workspace, nplots: int):
+    state = dict()
+
+    def load():
+        state['records'] = list(records.iter_records(workspace.ab_initio))
+
+    def sort():
+        state['dataset'] = ColumnarDataset.from_records(state['records'])
+
+    def fit():
+        state['plot_jobs'] = list()
+        with events.threshold(events.WARNING):
+            state['cbs'] = find_cbs.find_cbs(
+                state['dataset'], plot_jobs=state['plot_jobs'])
+
+    def plot():
+        rendering = plots.start_rendering(
+            state['plot_jobs'][:nplots], 'png', workspace.path('plots'))
+        plots.finish_rendering(rendering)
+
+    def serialize():
+        with open(workspace.cbs, 'w') as output:
+            records.write_group(*state['cbs'], file=output)
+
+    stages = [('load', load), ('sort', sort), ('fit', fit)]
+    if nplots > 0:
+        stages += [('plot', plot)]
+    return stages + [('serialize', serialize)]
+
+
+def main_stage(module, argv, output):
+    def run():
+        run_main(module, argv, output)
+    return [('main', run)]
+
+
+def scan_stages(workspace: Workspace):
+    state = dict()
+
+    def load():
+        datasets = [load_dataset(name) for name in workspace.geometries]
+        state['scan'] = scan_cbs.stack_scan(datasets, workspace.geometries)
+
+    def fit():
+        state['cbs'] = scan_cbs.extrapolate_scan(state['scan'])
+
+    def serialize():
+        scan_cbs.save_scan(workspace.path('cbs_scan'), state['scan'],
+                           state['cbs'], use_best=True)
+
+    return [('load', load), ('fit', fit), ('serialize', serialize)]
+
+
+def pipelines(workspace: Workspace, nplots: int):
+    """ The list of (pipeline, stages) in the order they have to run. """
+    return [
+        ('find_cbs', find_cbs_stages(workspace, nplots)),
+        ('pprint_final', main_stage(
+            pprint_final_energies, [workspace.ab_initio, workspace.cbs, '-x'],
+            workspace.path('final.json'))),
+        ('pprint_dT', main_stage(
+            pprint_dT, [workspace.better, workspace.worse, '-x'],
+            workspace.path('dT.json'))),
+        ('merge', main_stage(
+            merge, [workspace.first] + workspace.corrections,
+            workspace.path('merged.json'))),
+        ('scan', scan_stages(workspace)),
+    ]
+
+
+def measure(workspace: Workspace, nplots: int, repeat: int):
+    """
+    Runs all the pipelines `repeat` times and once more with `tracemalloc`.
+    Returns {'pipeline/stage': {'seconds': median, 'peak MiB': peak}}.
+    """
+    timings = dict()
+    for _ in range(repeat):
+        for pipeline, stages in pipelines(workspace, nplots):
+            for stage, run in stages:
+                start = time.perf_counter()
+                run()
+                timings.setdefault(f'{pipeline}/{stage}', []).append(
+                    time.perf_counter() - start)
+
+    peaks = dict()
+    tracemalloc.start()
+    try:
+        for pipeline, stages in pipelines(workspace, nplots):
+            for stage, run in stages:
+                tracemalloc.reset_peak()
+                current, _ = tracemalloc.get_traced_memory()
+                run()
+                _, peak = tracemalloc.get_traced_memory()
+                peaks[f'{pipeline}/{stage}'] = (peak - current) / 2**20
+    finally:
+        tracemalloc.stop()
+
+    return {
+        name: {'seconds': statistics.median(values), 'peak MiB': peaks[name]}
+        for name, values in timings.items()
+    }
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def load_baseline(file_name, sizes):
+    """ Returns the baseline results, or None if they do not apply. """
+    if not os.path.exists(file_name):
+        return None
+    with open(file_name) as baseline_json:
+        baseline = json.load(baseline_json)
+    if baseline['sizes'] != sizes:
+        print(f"Warning! The baseline in {file_name} was measured for"
+              f" {baseline['sizes']}; skipping the comparison.",
+              file=sys.stderr)
+        return None
+    return baseline['results']
+
+
+def main():
+    args = get_args()
+    sizes = {
+        'states': args.states,
+        'basis': args.basis,
+        'geometries': args.geometries,
+        'files': args.files,
+        'plots': args.plots,
+    }
+    baseline = None if args.save else load_baseline(args.baseline, sizes)
+
+    with tempfile.TemporaryDirectory() as directory:
+        workspace = Workspace(directory, args.states, args.basis,
+                              args.geometries, args.files)
+        results = measure(workspace, args.plots, args.repeat)
+
+    print(f"{'Stage':24} {'median, ms':>10} {'peak, MiB':>10}"
+          f" {'baseline, ms':>12} {'ratio':>6}")
+    regressions = list()
+    for name, result in results.items():
+        line = (f"{name:24} {result['seconds'] * 1e3:10.1f}"
+                f" {result['peak MiB']:10.2f}")
+        if baseline is not None and name in baseline:
+            reference = baseline[name]['seconds']
+            ratio = result['seconds'] / reference
+            line += f" {reference * 1e3:12.1f} {ratio:6.2f}"
+            if ratio > args.tolerance:
+                line += "  slower"
+                regressions += [name]
+        print(line)
+
+    if args.save:
+        with open(args.baseline, 'w') as baseline_json:
+            json.dump({'environment': environment(), 'sizes': sizes,
+                       'results': results}, baseline_json, indent=2)
+        print(f"Saved the baseline to {args.baseline}.")
+
+    if len(regressions) != 0:
+        print(f"Warning! Slower than the baseline: {', '.join(regressions)}.",
+              file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    main()
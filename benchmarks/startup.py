@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Measures the start up time of every entry point.
+
+Each script is run with `--help`, which exercises the imports and the
+argument parser but no computations. The median of the repeated runs is
+reported together with the heavy libraries loaded by the script.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ENTRY_POINTS = [
+    'cbs_fit/find_cbs.py',
+    'cbs_fit/pprint_final_energies.py',
+    'cbs_fit/turn_cbs_into_xsim_input.py',
+    'dT/pprint_dT.py',
+    'merge.py',
+]
+
+HEAVY_MODULES = ('numpy', 'scipy', 'matplotlib')
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument(
+        '-n', '--repeat', type=int, default=10,
+        help="Number of runs of each script. Default: %(default)s."
+    )
+    args = parser.parse_args()
+    return args
+
+
+def time_startup(script, repeat):
+    command = [sys.executable, os.path.join(REPO, script), '--help']
+    timings = list()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+        timings += [time.perf_counter() - start]
+    return statistics.median(timings)
+
+
+def heavy_imports(script):
+    """ Lists the heavy libraries that the script imports on start up. """
+    command = [sys.executable, '-X', 'importtime',
+               os.path.join(REPO, script), '--help']
+    run = subprocess.run(command, check=True, stdout=subprocess.DEVNULL,
+                         stderr=subprocess.PIPE, text=True)
+    loaded = set()
+    for line in run.stderr.splitlines():
+        module = line.rsplit('|', 1)[-1].strip()
+        top = module.split('.')[0]
+        if top in HEAVY_MODULES:
+            loaded.add(top)
+    return sorted(loaded)
+
+
+def main():
+    args = get_args()
+    command = [sys.executable, '-c', 'pass']
+    timings = list()
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        subprocess.run(command, check=True)
+        timings += [time.perf_counter() - start]
+    baseline = statistics.median(timings)
+
+    print(f"{'Script':36} {'median, ms':>10}  heavy imports")
+    print(f"{'python -c pass':36} {baseline * 1e3:10.1f}")
+    for script in ENTRY_POINTS:
+        median = time_startup(script, args.repeat)
+        heavy = ', '.join(heavy_imports(script)) or '-'
+        print(f"{script:36} {median * 1e3:10.1f}  {heavy}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    main()
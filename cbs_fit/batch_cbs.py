@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Runs `find_cbs.py` for many systems in parallel.
+
+Each data set, e.g., `molecule/geometry/ccsd+pwCVnZ.json`, is extrapolated
+in a separate process and the result is saved next to it with the "+cbs"
+suffix, i.e., `ccsd+pwCVnZ+cbs.json`. A failure of one system is recorded in
+the summary and does not stop the others.
+"""
+
+import argparse
+import fnmatch
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from columnar import load_dataset
+import events
+from find_cbs import find_cbs
+from fit_cache import FitCache, DEFAULT_DIRECTORY as DEFAULT_CACHE_DIRECTORY
+import profiling
+import records
+
+CBS_SUFFIX = '+cbs'
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument(
+        'directories', nargs='*', default=[],
+        help="Ab initio data sets or directory trees searched for them."
+    )
+    parser.add_argument(
+        '-m', '--manifest', default=None,
+        help="Text file listing the data sets, one path per line. Empty"
+        " lines and lines starting with # are skipped."
+    )
+    parser.add_argument(
+        '-p', '--pattern', default='*.json',
+        help="File name pattern of the data sets in the directories."
+        " Default: %(default)s."
+    )
+    parser.add_argument(
+        "-a", "--use_all", default=False, action="store_true",
+        help="Fit using all data points. Default: Fit using minimal number of"
+        " points, i.e., only the largest basis sets."
+    )
+    parser.add_argument(
+        '-j', '--workers', default=None, type=int,
+        help="Number of systems extrapolated at the same time. Default: the"
+        " number of CPUs."
+    )
+    parser.add_argument(
+        '--cache', default=False, action='store_true',
+        help="Reuse the results of unchanged data sets from the cache. See"
+        " fit_cache.py."
+    )
+    parser.add_argument(
+        '--cache-dir', default=DEFAULT_CACHE_DIRECTORY,
+        help="Cache directory. Default: %(default)s."
+    )
+    parser.add_argument(
+        '-s', '--summary', default='cbs_summary.json',
+        help="Consolidated summary of all systems. Default: %(default)s."
+    )
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    return args
+
+
+def output_name(dataset_path: str):
+    stem, extension = os.path.splitext(dataset_path)
+    return stem + CBS_SUFFIX + extension
+
+
+def find_datasets(directories, pattern: str, manifest: str | None = None):
+    """
+    Lists the data sets from the manifest, the files, and the directory
+    trees. In the trees, the results of earlier runs, i.e., files with the
+    "+cbs" suffix, are skipped.
+    """
+    datasets = list()
+    if manifest is not None:
+        with open(manifest) as listing:
+            for line in listing:
+                line = line.strip()
+                if line == "" or line.startswith('#'):
+                    continue
+                datasets += [line]
+
+    for directory in directories:
+        if not os.path.isdir(directory):
+            datasets += [directory]
+            continue
+        for root, directories, files in os.walk(directory):
+            # Sorted walk: the order of the data sets is reproducible
+            directories.sort()
+            for name in sorted(files):
+                stem, _ = os.path.splitext(name)
+                if not fnmatch.fnmatch(name, pattern) or \
+                        stem.endswith(CBS_SUFFIX):
+                    continue
+                datasets += [os.path.join(root, name)]
+
+    return datasets
+
+
+def run_system(dataset_path: str, use_best: bool = True,
+               cache_directory: str | None = None):
+    """
+    Extrapolates a single system and writes its "+cbs" file. Returns the
+    summary entry; errors are caught and reported in the entry.
+    """
+    start = time.perf_counter()
+    entry = {'input': dataset_path}
+    cache = None
+    if cache_directory is not None:
+        cache = FitCache(cache_directory)
+    try:
+        # The fitting messages of many systems would only interleave
+        with events.threshold(events.WARNING):
+            dataset = load_dataset(dataset_path)
+            cbs_header, cbs_eom = find_cbs(
+                dataset, use_best=use_best, plot_jobs=False,
+                cache=cache)
+
+        output = output_name(dataset_path)
+        with open(output, 'w') as cbs_json:
+            records.write_group(cbs_header, cbs_eom, file=cbs_json)
+    except Exception as error:
+        entry['status'] = 'failed'
+        entry['error'] = f"{type(error).__name__}: {error}"
+    else:
+        entry['status'] = 'ok'
+        entry['output'] = output
+        entry.update(cbs_header)
+        entry['EOM states'] = len(cbs_eom)
+    entry['seconds'] = time.perf_counter() - start
+    return entry
+
+
+@profiling.profiled('batch_cbs')
+def main():
+    args = get_args()
+    datasets = find_datasets(args.directories, args.pattern, args.manifest)
+    summary_path = os.path.abspath(args.summary)
+    datasets = [path for path in datasets
+                if os.path.abspath(path) != summary_path]
+    if len(datasets) == 0:
+        print("Error! No data sets found.", file=sys.stderr)
+        return 1
+
+    use_best = not args.use_all
+    cache_directory = args.cache_dir if args.cache is True else None
+    with profiling.stage('fit'), \
+            ProcessPoolExecutor(max_workers=args.workers) as executor:
+        summary = list(executor.map(
+            run_system, datasets, [use_best] * len(datasets),
+            [cache_directory] * len(datasets)))
+
+    with profiling.stage('serialize'), open(args.summary, 'w') as summary_json:
+        json.dump(summary, summary_json, indent=2)
+
+    failed = [entry for entry in summary if entry['status'] != 'ok']
+    print(f"Extrapolated {len(summary) - len(failed)} of {len(summary)}"
+          f" systems. Summary saved in {args.summary}.")
+    for entry in failed:
+        print(f"Failed {entry['input']}: {entry['error']}", file=sys.stderr)
+
+    return 0 if len(failed) == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
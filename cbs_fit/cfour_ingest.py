@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Reads the CBS input directly from CFOUR outputs.
+
+Replaces the chain `cfour_parser`, `print_roots.py -c`, and `jq` for the
+energies needed by `find_cbs.py`. Each output file is memory-mapped and
+scanned with a few regular expressions; nothing but the matches is
+decoded. Every output becomes one basis-set record
+    {'basis': str(), 'calclevel': str(), 'scf': float(),
+     'cc_energy': float(), 'EOM': [{'irrep': {'energy #': int(),
+                                               'name': str()},
+                                     'model': str(), 'energy': float()}]}
+
+The EOM roots are numbered in the order in which CFOUR prints them within
+each symmetry block. The irrep names follow CFOUR's (Cotton) ordering of the
+irreps of the computational point group. The patterns follow the CFOUR
+output as read by the cfour_parser; adjust `PATTERNS` if your CFOUR version
+prints differently.
+"""
+
+import argparse
+import mmap
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from core import basis2n
+import profiling
+import records
+
+PATTERNS = {
+    'basis': re.compile(rb'^\s*BASIS\s+IBASIS\s+(\S+)', re.MULTILINE),
+    'calclevel': re.compile(rb'^\s*CALCLEVEL\s+ICLLVL\s+(\S+)', re.MULTILINE),
+    'point group': re.compile(rb'Computational point group:\s*(\S+)'),
+    'scf': re.compile(rb'E\(SCF\)=\s*(-?\d+\.\d+)'),
+    'cc_energy': re.compile(
+        rb'The final electronic energy is\s+(-?\d+\.\d+)'),
+    'symmetry block': re.compile(rb'Beginning symmetry block\s+(\d+)'),
+    'eom': re.compile(
+        rb'Total (EOM\S*) electronic energy\s+(-?\d+\.\d+)'),
+}
+
+IRREPS = {
+    'C1': ['A'],
+    'Ci': ['Ag', 'Au'],
+    'C2': ['A', 'B'],
+    'Cs': ["A'", 'A"'],
+    'C2v': ['A1', 'A2', 'B1', 'B2'],
+    'C2h': ['Ag', 'Bg', 'Au', 'Bu'],
+    'D2': ['A', 'B1', 'B2', 'B3'],
+    'D2h': ['Ag', 'B1g', 'B2g', 'B3g', 'Au', 'B1u', 'B2u', 'B3u'],
+}
+
+DEFAULT_OUTPUT_NAME = 'output.c4'
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="Prints the CBS input (the ab initio data set) read"
+        " directly from CFOUR outputs.")
+    parser.add_argument(
+        'outputs', nargs='+',
+        help="CFOUR output files or directories searched for"
+        f" '{DEFAULT_OUTPUT_NAME}' files.")
+    parser.add_argument(
+        '-n', '--name', default=DEFAULT_OUTPUT_NAME,
+        help="File name of the outputs in directories. Default: %(default)s.")
+    parser.add_argument(
+        '-j', '--workers', default=None, type=int,
+        help="Number of processes reading the outputs. Default: the number"
+        " of CPUs.")
+    parser.add_argument(
+        '--ndjson', default=False, action='store_true',
+        help="Print one basis set per line (NDJSON).")
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    return args
+
+
+def normalize_basis(name: str):
+    """ Maps CFOUR's upper case basis name onto the `basis2n` spelling. """
+    for known in basis2n:
+        if known.upper() == name.upper():
+            return known
+    return name
+
+
+def _irrep_name(point_group, block: int):
+    for group, irreps in IRREPS.items():
+        if group.upper() == point_group.upper() and block <= len(irreps):
+            return irreps[block - 1]
+    return str(block)
+
+
+def _last(pattern, text):
+    match = None
+    for match in pattern.finditer(text):
+        pass
+    return match
+
+
+def scan_output(text):
+    """
+    Extracts the basis-set record from the CFOUR output `text` (bytes or
+    a memory map).
+    """
+    values = dict()
+    for key in ('basis', 'calclevel', 'point group', 'scf', 'cc_energy'):
+        match = _last(PATTERNS[key], text)
+        if match is not None:
+            values[key] = match.group(1).decode()
+
+    if 'scf' not in values:
+        raise RuntimeError("No SCF energy found.")
+
+    record = {
+        'basis': normalize_basis(values.get('basis', '')),
+        'calclevel': values.get('calclevel', ''),
+        'scf': float(values['scf']),
+    }
+    if 'cc_energy' in values:
+        record['cc_energy'] = float(values['cc_energy'])
+
+    point_group = values.get('point group', 'C1')
+    blocks = [(match.start(), int(match.group(1)))
+              for match in PATTERNS['symmetry block'].finditer(text)]
+    eom_states = list()
+    roots_per_block = dict()
+    block_no = 0
+    for match in PATTERNS['eom'].finditer(text):
+        while block_no < len(blocks) and blocks[block_no][0] < match.start():
+            block_no += 1
+        block = blocks[block_no - 1][1] if block_no > 0 else 1
+        roots_per_block[block] = roots_per_block.get(block, 0) + 1
+        eom_states += [{
+            'irrep': {
+                'energy #': roots_per_block[block],
+                'name': _irrep_name(point_group, block),
+            },
+            'model': match.group(1).decode(),
+            'energy': float(match.group(2)),
+        }]
+    record['EOM'] = eom_states
+
+    return record
+
+
+def ingest_file(file_name):
+    """ Memory-maps the CFOUR output and scans it. """
+    with open(file_name, 'rb') as output:
+        if os.fstat(output.fileno()).st_size == 0:
+            raise RuntimeError(f"{file_name} is empty.")
+        with mmap.mmap(output.fileno(), 0, access=mmap.ACCESS_READ) as text:
+            try:
+                return scan_output(text)
+            except RuntimeError as error:
+                raise RuntimeError(f"{file_name}: {error}") from None
+
+
+def find_outputs(paths, name: str = DEFAULT_OUTPUT_NAME):
+    """ Expands directories into the output files they contain. """
+    found = list()
+    for path in paths:
+        if not os.path.isdir(path):
+            found += [path]
+            continue
+        for root, _, files in os.walk(path):
+            if name in files:
+                found += [os.path.join(root, name)]
+    return sorted(found)
+
+
+def ingest(paths, name: str = DEFAULT_OUTPUT_NAME, workers=None):
+    """
+    Reads all the outputs in parallel and returns the data set sorted by
+    the basis-set size. Outputs that cannot be read are reported and
+    skipped.
+    """
+    outputs = find_outputs(paths, name)
+    dataset = list()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(ingest_file, output) for output in outputs]
+        for output, future in zip(outputs, futures):
+            try:
+                dataset += [future.result()]
+            except RuntimeError as error:
+                print(f"Warning! Skipping {error}", file=sys.stderr)
+            except (OSError, ValueError) as error:
+                # E.g., a dangling link or a file that cannot be mapped
+                print(f"Warning! Skipping {output}: {error}",
+                      file=sys.stderr)
+
+    dataset.sort(key=lambda x: basis2n.get(x['basis'], 0))
+    return dataset
+
+
+@profiling.profiled('cfour_ingest')
+def main():
+    args = get_args()
+    with profiling.stage('ingest'):
+        dataset = ingest(args.outputs, args.name, args.workers)
+    with profiling.stage('serialize'):
+        records.write_list(dataset, ndjson=args.ndjson)
+    return 0
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+"""
+Columnar (states × basis) representation of the energies.
+
+The JSON documents list the states one dictionary at a time. Here the
+energies are kept in NumPy arrays indexed by basis set (rows) and state
+(columns). The states themselves are a structured array of integers:
+    (energy #, irrep, model)
+where irrep and model index the interned tables of names. Correlation and
+transition energies are whole-array subtractions. The JSON shapes are built
+only at the edges, by the `to_*` methods.
+
+A state missing at some basis set has NaN energy there.
+"""
+
+from dataclasses import dataclass, field
+import numpy as np
+from core import basis2n, ha2eV, iter_dataset_records
+import profiling
+
+STATE_DTYPE = np.dtype([
+    ('number', np.int32),
+    ('irrep', np.int32),
+    ('model', np.int32),
+])
+
+
+class StringTable:
+    """ Interned strings: each distinct value is stored once. """
+
+    def __init__(self, values=()):
+        self.values = list()
+        self.index = dict()
+        for value in values:
+            self.intern(value)
+
+    def intern(self, value: str):
+        if value not in self.index:
+            self.index[value] = len(self.values)
+            self.values += [value]
+        return self.index[value]
+
+    def __getitem__(self, position):
+        return self.values[position]
+
+    def __len__(self):
+        return len(self.values)
+
+
+@dataclass
+class States:
+    table: np.ndarray = field(
+        default_factory=lambda: np.empty(0, dtype=STATE_DTYPE))
+    irreps: StringTable = field(default_factory=StringTable)
+    models: StringTable = field(default_factory=StringTable)
+
+    @classmethod
+    def from_dicts(cls, states, model_key: str = 'model'):
+        irreps = StringTable()
+        models = StringTable()
+        table = np.array([
+            (state['irrep']['energy #'],
+             irreps.intern(state['irrep']['name']),
+             models.intern(state[model_key]))
+            for state in states
+        ], dtype=STATE_DTYPE)
+        return cls(table, irreps, models)
+
+    def __len__(self):
+        return len(self.table)
+
+    def take(self, selection):
+        """ The selected states; the string tables are shared. """
+        return States(self.table[selection], self.irreps, self.models)
+
+    def keys(self, with_model: bool = True):
+        """
+        The `state_index.state_key`s of the states; without the model, as
+        with `model_key=None`, if `with_model` is False.
+        """
+        return [
+            (int(number), self.irreps[irrep],
+             self.models[model] if with_model else None)
+            for number, irrep, model in self.table.tolist()
+        ]
+
+    def to_dicts(self, model_key: str = 'model'):
+        return [
+            {
+                'irrep': {'energy #': number, 'name': irrep},
+                model_key: model,
+            }
+            for number, irrep, model in self.keys()
+        ]
+
+
+@dataclass
+class ColumnarDataset:
+    """
+    The ab initio data set: one row per basis set sorted by zeta, one
+    column per EOM state. `cc_energy` is NaN for the SCF-only basis sets.
+    """
+    basis: list
+    zetas: np.ndarray
+    scf: np.ndarray
+    cc_energy: np.ndarray
+    eom: np.ndarray
+    states: States
+    calclevel: str | None = None
+
+    @classmethod
+    def from_records(cls, records):
+        """
+        Builds the columns from the basis-set records of the ab initio JSON
+        file. The states are ordered as they first appear.
+        """
+        records = sorted(records, key=lambda x: basis2n[x['basis']])
+
+        calclevel = None
+        for data in records:
+            if 'calclevel' not in data:
+                continue
+            if calclevel is None:
+                calclevel = data['calclevel']
+            elif calclevel != data['calclevel']:
+                raise RuntimeError("Data set contains varying CC level: "
+                                   f"{calclevel}, and {data['calclevel']}")
+
+        irreps = StringTable()
+        models = StringTable()
+        columns = dict()
+        entries = list()
+        for row, data in enumerate(records):
+            seen = set()
+            for state in data['EOM']:
+                key = (state['irrep']['energy #'],
+                       irreps.intern(state['irrep']['name']),
+                       models.intern(state['model']))
+                if key in seen:
+                    raise RuntimeError(
+                        f"The {data['basis']} basis has a duplicated state:"
+                        f" {key[0]}{state['irrep']['name']}.")
+                seen.add(key)
+                column = columns.setdefault(key, len(columns))
+                entries += [(row, column, state['energy'])]
+
+        eom = np.full((len(records), len(columns)), np.nan)
+        if len(entries) != 0:
+            rows, cols, energies = zip(*entries)
+            eom[list(rows), list(cols)] = energies
+
+        return cls(
+            basis=[data['basis'] for data in records],
+            zetas=np.array([basis2n[data['basis']] for data in records],
+                           dtype=float),
+            scf=np.array([data['scf'] for data in records], dtype=float),
+            cc_energy=np.array([data.get('cc_energy', np.nan)
+                                for data in records], dtype=float),
+            eom=eom,
+            states=States(np.array(list(columns), dtype=STATE_DTYPE),
+                          irreps, models),
+            calclevel=calclevel,
+        )
+
+    @property
+    def has_cc(self):
+        return ~np.isnan(self.cc_energy)
+
+    @property
+    def cc_correlation(self):
+        return self.cc_energy - self.scf
+
+    @property
+    def eom_correlation(self):
+        return self.eom - self.scf[:, np.newaxis]
+
+    @property
+    def transition(self):
+        """ EOM excitation energies in a.u. """
+        return self.eom - self.cc_energy[:, np.newaxis]
+
+    def rows(self, selection):
+        """ A data set with only the selected basis sets. """
+        return ColumnarDataset(
+            basis=[name for name, keep in zip(self.basis, selection)
+                   if keep],
+            zetas=self.zetas[selection],
+            scf=self.scf[selection],
+            cc_energy=self.cc_energy[selection],
+            eom=self.eom[selection],
+            states=self.states,
+            calclevel=self.calclevel,
+        )
+
+    def missing_states(self, row: int):
+        """ Keys of the states absent from the basis set `row`. """
+        keys = self.states.keys()
+        return [keys[column]
+                for column in np.flatnonzero(np.isnan(self.eom[row]))]
+
+
+def load_dataset(file_name):
+    """ `core.get_dataset` that returns a `ColumnarDataset`. """
+    with profiling.stage('load'):
+        data = list(iter_dataset_records(file_name))
+    with profiling.stage('sort'):
+        return ColumnarDataset.from_records(data)
+
+
+def to_xsim(states: States, transition_au, model_key: str = 'model'):
+    """
+    The xsim's 'better energies' list of the states with the given
+    transition energies (a.u.).
+    """
+    transition_au = np.asarray(transition_au, dtype=float)
+    transition_ev = transition_au * ha2eV
+    xsim = states.to_dicts(model_key)
+    for state, au, ev in zip(xsim, transition_au.tolist(),
+                             transition_ev.tolist()):
+        state['energy'] = {'transition': {'eV': ev, 'au': au}}
+    return xsim
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Compares the CBS limits of several extrapolation schemes.
+
+Every selected scheme (see `schemes.py`) extrapolates the SCF energy, the CC
+correlation energy, and the correlation energies of all the EOM states of
+the ab initio data set. The EOM transition energies of each correlation
+scheme are listed side by side; the spread is the difference between the
+largest and the smallest value of a row.
+"""
+
+import argparse
+import json
+import numpy as np
+from columnar import load_dataset
+from core import conversion_factors
+import events
+from find_cbs import collect_eom_correlation
+import profiling
+import schemes
+import state_index as si
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument(
+        'ab_initio', help="JSON or NDJSON file with ab initio energies for"
+        " each basis set."
+    )
+    parser.add_argument(
+        '-s', '--scf', nargs='+', default=schemes.SCHEME_NAMES[schemes.SCF],
+        choices=schemes.SCHEME_NAMES[schemes.SCF],
+        help="SCF schemes. Default: all of them."
+    )
+    parser.add_argument(
+        '-c', '--correlation', nargs='+',
+        default=schemes.SCHEME_NAMES[schemes.CORRELATION],
+        choices=schemes.SCHEME_NAMES[schemes.CORRELATION],
+        help="Correlation schemes. Default: all of them."
+    )
+    parser.add_argument(
+        '--alpha', nargs='+', default=[2.5], type=float,
+        help="Exponents of the power schemes, one column each. Default:"
+        " %(default)s."
+    )
+    parser.add_argument(
+        '--schwenke-factor', default=None, type=float,
+        help="The F of the Schwenke scheme for your basis set family and"
+        " method. Default: the n^-3 equivalent F."
+    )
+    parser.add_argument(
+        "-a", "--use_all", default=False, action="store_true",
+        help="Fit using all data points. Default: Fit using minimal number of"
+        " points, i.e., only the largest basis sets."
+    )
+    parser.add_argument(
+        '-u', '--units', default='eV', choices=conversion_factors.keys(),
+        help="Units of the transition energies. Default: %(default)s."
+    )
+    parser.add_argument(
+        '--json', default=False, action='store_true',
+        help="Print the comparison as JSON instead of the table."
+    )
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    return args
+
+
+def spread(values):
+    """ Largest minus smallest value of every row of the (row × scheme). """
+    if values.shape[1] == 0:
+        return np.full(values.shape[0], np.nan)
+    return np.nanmax(values, axis=1) - np.nanmin(values, axis=1)
+
+
+def compare(dataset, scf_schemes, correlation_schemes, use_best: bool = True):
+    """
+    Extrapolates the `columnar.ColumnarDataset` with all the schemes. The
+    CC correlation is the column 0 of the correlation series and the EOM
+    states are the rest, so each scheme takes a single pass over all of
+    them.
+    """
+    scf, scf_skipped = schemes.evaluate(
+        scf_schemes, dataset.zetas, dataset.scf[:, np.newaxis], use_best)
+
+    cc_dataset = dataset.rows(dataset.has_cc)
+    eom_correlation, eom_states = collect_eom_correlation(cc_dataset)
+    correlation = np.column_stack(
+        [cc_dataset.cc_correlation, eom_correlation])
+    cbs, correlation_skipped = schemes.evaluate(
+        correlation_schemes, cc_dataset.zetas, correlation, use_best)
+
+    names = list(cbs)
+    cbs_matrix = np.column_stack([cbs[name] for name in names]) \
+        if len(names) != 0 else np.empty((correlation.shape[1], 0))
+    return {
+        'scf': {name: float(values[0]) for name, values in scf.items()},
+        'correlation schemes': names,
+        'cc_correlation': cbs_matrix[0],
+        'transition': cbs_matrix[1:] - cbs_matrix[:1],
+        'states': eom_states,
+        'skipped': {**scf_skipped, **correlation_skipped},
+    }
+
+
+def format_table(comparison, formulas, units: str):
+    conversion = conversion_factors[units]
+    names = comparison['correlation schemes']
+    width = max([10] + [len(name) for name in names])
+    lines = ["SCF energy, a.u."]
+    scf = comparison['scf']
+    for name, value in scf.items():
+        lines += [f"  {name:14} {value:14.6f}  {formulas[name]}"]
+    if len(scf) > 1:
+        values = np.array(list(scf.values()))
+        lines += [f"  {'spread':14} {values.max() - values.min():14.6f}"]
+
+    lines += [
+        "",
+        "Correlation schemes: " + "; ".join(
+            f"{name} {formulas[name]}" for name in names),
+        "",
+        f"{'':12}" + "".join(f" {name:>{width}}" for name in names)
+        + f" {'spread':>{width}}",
+    ]
+    cc = comparison['cc_correlation']
+    lines += [f"{'CC, a.u.':12}" + "".join(
+        f" {value:{width}.6f}" for value in cc.tolist())
+        + f" {spread(cc[np.newaxis])[0]:{width}.6f}"]
+
+    transition = comparison['transition'] * conversion
+    spreads = spread(transition)
+    lines += [f"EOM transition energies in {units}"]
+    for state, row, row_spread in zip(comparison['states'],
+                                      transition.tolist(), spreads.tolist()):
+        key = si.key_to_str(si.state_key(state))
+        lines += [f"{key:12}" + "".join(f" {value:{width}.4f}"
+                                        for value in row)
+                  + f" {row_spread:{width}.4f}"]
+    return "\n".join(lines)
+
+
+def to_json(comparison, formulas, units: str):
+    conversion = conversion_factors[units]
+    names = comparison['correlation schemes']
+    transition = comparison['transition'] * conversion
+    scf_values = list(comparison['scf'].values())
+    states = list()
+    for state, row, row_spread in zip(comparison['states'],
+                                      transition.tolist(),
+                                      spread(transition).tolist()):
+        states += [{
+            'irrep': state['irrep'],
+            'model': state['model'],
+            'transition': dict(zip(names, row)),
+            'spread': row_spread,
+        }]
+    return {
+        'units': units,
+        'schemes': formulas,
+        'scf': dict(comparison['scf'], spread=max(scf_values)
+                    - min(scf_values) if len(scf_values) != 0 else None),
+        'cc_correlation': dict(
+            zip(names, comparison['cc_correlation'].tolist()),
+            spread=float(spread(comparison['cc_correlation'][np.newaxis])[0])),
+        'EOM': states,
+        'skipped': comparison['skipped'],
+    }
+
+
+@profiling.profiled('compare_cbs')
+def main():
+    args = get_args()
+    scf_schemes = schemes.select(args.scf)
+    correlation_schemes = schemes.select(
+        args.correlation, args.alpha, args.schwenke_factor)
+    formulas = {scheme.name: scheme.formula
+                for scheme in scf_schemes + correlation_schemes}
+
+    with profiling.stage('load'):
+        dataset = load_dataset(args.ab_initio)
+    with profiling.stage('fit'):
+        comparison = compare(dataset, scf_schemes, correlation_schemes,
+                             use_best=not args.use_all)
+    for name, reason in comparison['skipped'].items():
+        events.warning('scheme skipped', "Skipping the {name} scheme:"
+                       " {reason}.", name=name, reason=reason)
+
+    with profiling.stage('serialize'):
+        if args.json is True:
+            print(json.dumps(to_json(comparison, formulas, args.units)))
+        else:
+            print(format_table(comparison, formulas, args.units))
+
+    events.flush()
+    return 0
+
+
+if __name__ == "__main__":
+    main()
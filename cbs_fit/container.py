@@ -0,0 +1,212 @@
+"""
+Binary container for the CBS results, the corrections, and the xsim inputs.
+
+The layout of a container file:
+    magic   8 bytes, `records.CONTAINER_MAGIC`
+    size    8 bytes, little endian length of the JSON header
+    header  JSON, padded with spaces so that the arrays start at a
+            multiple of 64 bytes
+    arrays  raw little endian data, each array aligned to 64 bytes
+The JSON header holds the group header (e.g., the CBS 'basis', 'scf', ...)
+or null for a bare list of states, the interned irrep and model names, the
+name of the model field, and the offset, dtype, and shape of every array.
+The states are an array of `columnar.STATE_DTYPE`. Every numeric field of
+the states, e.g., 'energy/transition/eV', is a float64 array with one value
+per state.
+
+`load` maps the file and returns the arrays as read-only views of the map;
+no float is parsed or copied. `records.iter_records` recognizes containers,
+so every tool reads them like the JSON files.
+"""
+
+import json
+import mmap
+import os
+from dataclasses import dataclass, field
+import numpy as np
+from columnar import States, StringTable
+from core import ha2eV
+from records import CONTAINER_MAGIC
+
+EXTENSION = '.amb'
+ALIGNMENT = 64
+SEPARATOR = '/'
+# The model names of the xsim states and of `pprint_final_energies.py`
+MODEL_KEYS = ('model', 'eom model')
+
+
+def _padded(size: int):
+    return -(-size // ALIGNMENT) * ALIGNMENT
+
+
+def _flatten(value, path=(), strict: bool = True):
+    """
+    Yields (path, number) of the numeric leaves of a nested dict. Other
+    leaves raise, or are skipped if not `strict`.
+    """
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from _flatten(item, path + (key,), strict)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        yield SEPARATOR.join(path), float(value)
+    elif strict is True:
+        raise RuntimeError(
+            f"Cannot store the field '{SEPARATOR.join(path)}' of the value"
+            f" {value!r} in a container.")
+
+
+def _nest(state, name, value):
+    *parents, leaf = name.split(SEPARATOR)
+    for parent in parents:
+        state = state.setdefault(parent, dict())
+    state[leaf] = value
+
+
+def _model_key(state):
+    for key in MODEL_KEYS:
+        if key in state:
+            return key
+    raise RuntimeError(f"No model name in the state {state}; expected one of"
+                       f" {', '.join(MODEL_KEYS)}.")
+
+
+def transition_fields(transition_au):
+    """ The numeric fields of the xsim states with the given energies. """
+    transition_au = np.asarray(transition_au, dtype=float)
+    return {
+        'energy/transition/eV': transition_au * ha2eV,
+        'energy/transition/au': transition_au,
+    }
+
+
+@dataclass
+class Container:
+    header: dict | None
+    states: States = field(default_factory=States)
+    fields: dict = field(default_factory=dict)
+    model_key: str = 'model'
+
+    @classmethod
+    def from_dicts(cls, header, states, common: bool = False):
+        """
+        Packs the header and the EOM states, e.g., as returned by
+        `records.read_group`. With `common`, only the numeric fields that
+        all the states have are packed and the others are left out instead
+        of raising.
+        """
+        states = list(states)
+        if len(states) == 0:
+            return cls(header)
+
+        model_key = _model_key(states[0])
+        rows = [dict(_flatten(
+            {key: value for key, value in state.items()
+             if key not in ('irrep', model_key)}, strict=not common))
+            for state in states]
+        names = [name for name in rows[0]
+                 if all(name in numbers for numbers in rows[1:])]
+        if common is False:
+            for numbers in rows[1:]:
+                if numbers.keys() != rows[0].keys():
+                    raise RuntimeError(
+                        "All states of a container need the same fields:"
+                        f" {list(rows[0])} and {list(numbers)}.")
+        columns = {name: [numbers[name] for numbers in rows]
+                   for name in names}
+
+        return cls(
+            header=header,
+            states=States.from_dicts(states, model_key),
+            fields={name: np.array(values, dtype=float)
+                    for name, values in columns.items()},
+            model_key=model_key,
+        )
+
+    def iter_states(self):
+        """ Yields the states as the JSON dictionaries. """
+        values = [(name, array.tolist())
+                  for name, array in self.fields.items()]
+        for row, state in enumerate(self.states.to_dicts(self.model_key)):
+            for name, array in values:
+                _nest(state, name, array[row])
+            yield state
+
+    def iter_records(self):
+        """ The header, if any, followed by the states. """
+        if self.header is not None:
+            yield dict(self.header)
+        yield from self.iter_states()
+
+
+def save(file_name, container: Container):
+    """ Writes the container; the file is replaced atomically. """
+    arrays = [('states', container.states.table)]
+    arrays += list(container.fields.items())
+
+    layout = dict()
+    offset = 0
+    data = list()
+    for name, array in arrays:
+        array = np.ascontiguousarray(
+            array, dtype=array.dtype.newbyteorder('<'))
+        layout[name] = {
+            'offset': offset,
+            'dtype': np.lib.format.dtype_to_descr(array.dtype),
+            'shape': list(array.shape),
+        }
+        data += [(offset, array)]
+        offset += _padded(array.nbytes)
+    data_size = offset
+
+    meta = json.dumps({
+        'header': container.header,
+        'irreps': container.states.irreps.values,
+        'models': container.states.models.values,
+        'model key': container.model_key,
+        'arrays': layout,
+    }).encode()
+    prefix = len(CONTAINER_MAGIC) + 8
+    meta += b' ' * (_padded(prefix + len(meta)) - prefix - len(meta))
+
+    temporary = f'{file_name}.{os.getpid()}.tmp'
+    with open(temporary, 'wb') as output:
+        output.write(CONTAINER_MAGIC)
+        output.write(len(meta).to_bytes(8, 'little'))
+        output.write(meta)
+        start = output.tell()
+        for offset, array in data:
+            output.seek(start + offset)
+            output.write(array.tobytes())
+        output.truncate(start + data_size)
+    os.replace(temporary, file_name)
+
+
+def save_group(file_name, header, states):
+    """ `records.write_group` or `write_list` (header None) to a file. """
+    save(file_name, Container.from_dicts(header, states))
+
+
+def load(file_name):
+    """ Maps the container file; the arrays are views of the map. """
+    with open(file_name, 'rb') as input_file:
+        mapped = mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic_size = len(CONTAINER_MAGIC)
+    if mapped[:magic_size] != CONTAINER_MAGIC:
+        raise RuntimeError(f"{file_name} is not a container file.")
+    size = int.from_bytes(mapped[magic_size:magic_size + 8], 'little')
+    start = magic_size + 8
+    meta = json.loads(mapped[start:start + size])
+    start += size
+
+    arrays = dict()
+    for name, spec in meta['arrays'].items():
+        dtype = np.lib.format.descr_to_dtype(spec['dtype'])
+        shape = tuple(spec['shape'])
+        arrays[name] = np.frombuffer(
+            mapped, dtype=dtype, count=int(np.prod(shape)),
+            offset=start + spec['offset']).reshape(shape)
+
+    states = States(arrays.pop('states'), StringTable(meta['irreps']),
+                    StringTable(meta['models']))
+    return Container(meta['header'], states, arrays, meta['model key'])
@@ -0,0 +1,152 @@
+"""
+Constants and the data model shared by all the tools.
+
+This module depends on the standard library only, so the constants and
+the record readers do not pull in any heavy library by themselves. All the
+entry points still import numpy through `columnar`, which holds the
+energies as arrays; `benchmarks/startup.py` lists what each of them loads.
+Use `worker_server.py` to skip that import time for many small runs.
+"""
+
+import os
+import re
+from typing import TypedDict
+import records
+
+ha2eV = 27.211386245988
+eV2cm = 8065.543937
+ha2cm = ha2eV * eV2cm
+
+conversion_factors = {
+    "au": 1.0,
+    "eV": ha2eV,
+    "cm": ha2cm,
+}
+
+basis2n = {
+    'ANO0': 1,
+    'ANO1': 2,
+    'ANO2': 3,
+    'PWCVDZ': 2,
+    'PWCVTZ': 3,
+    'PWCVQZ': 4,
+    'PWCV5Z': 5,
+    'aug-pwCVDZ': 2,
+    'aug-pwCVTZ': 3,
+    'aug-pwCVQZ': 4,
+    'aug-pwCV5Z': 5,
+}
+
+
+def basis_family(basis: str) -> str:
+    """ The family of a basis set, e.g., aug-pwCVnZ for aug-pwCVTZ or ANOn
+    for ANO1. Only the bases of one family can be extrapolated together. """
+    match = re.fullmatch(r'(.*?)([DTQ]|\d+)(Z?)', basis)
+    if match is None:
+        return basis
+    return f'{match[1]}n{match[3]}'
+
+# The JSON documents passed between the tools.
+Irrep = TypedDict('Irrep', {'energy #': int, 'name': str})
+
+
+class AbInitioState(TypedDict, total=False):
+    """ An EOM state; 'correlation' is added by `add_correlation_energies`."""
+    irrep: Irrep
+    model: str
+    energy: float
+    correlation: float
+
+
+class BasisData(TypedDict, total=False):
+    """ Output of `print_roots.py -c`: energies at a single basis set. """
+    basis: str
+    calclevel: str
+    scf: float
+    cc_energy: float
+    cc_correlation: float
+    EOM: list[AbInitioState]
+
+
+CBSState = TypedDict('CBSState', {
+    'irrep': Irrep,
+    'model': str,
+    'correlation': float,
+    'correlation error est': float,
+})
+
+
+class CBSResult(TypedDict):
+    """ Output of `find_cbs.py`. """
+    basis: str
+    scf: float
+    calclevel: str
+    cc_correlation: float
+    EOM: list[CBSState]
+
+
+class Energy(TypedDict):
+    au: float
+    eV: float
+
+
+class Transition(TypedDict):
+    transition: Energy
+
+
+class XsimState(TypedDict):
+    """ One state of the xsim's 'better energies' file. """
+    irrep: Irrep
+    model: str
+    energy: Transition
+
+
+def add_correlation_energies(dataset: list[BasisData]):
+    for data in dataset:
+        scf = data['scf']
+
+        if 'cc_energy' in data:
+            cc = data['cc_energy']
+            data['cc_correlation'] = cc - scf
+
+        for eom in data['EOM']:
+            ee = eom['energy']
+            eom['correlation'] = ee - scf
+
+
+def iter_dataset_records(file_name):
+    """
+    Yields the basis-set records of the ab initio data set from a JSON list
+    or NDJSON with one basis set per line. A directory is searched for CFOUR
+    outputs, see `cfour_ingest.py`.
+    """
+    if os.path.isdir(file_name):
+        import cfour_ingest
+        yield from cfour_ingest.ingest([file_name])
+    else:
+        yield from records.iter_records(file_name)
+
+
+def get_dataset(file_name):
+    """
+    Reads the ab initio data set as a list of basis-set records sorted by
+    the basis-set size. See `columnar.load_dataset` for the array form.
+    """
+    data = list(iter_dataset_records(file_name))
+
+    data.sort(key=lambda x: basis2n[x['basis']])
+    add_correlation_energies(data)
+
+    cc_level = None
+    for basis in data:
+        if 'calclevel' in basis:
+            loc_cc_level = basis['calclevel']
+            if cc_level is None:
+                cc_level = loc_cc_level
+                continue
+
+            if cc_level != loc_cc_level:
+                raise RuntimeError("Data set contains varying CC level: "
+                                   f"{cc_level}, and {loc_cc_level}")
+
+    return data, cc_level
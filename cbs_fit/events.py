@@ -0,0 +1,179 @@
+"""
+Leveled, structured messages of the tools.
+
+The progress of the fits, e.g., the fitted parameters of every state, is
+reported as events
+    events.info('fit parameters', "{header} values: E cbs = {cbs:.6f}",
+                header=name, cbs=parameters[0])
+that go to stderr or to a log file, so that stdout carries only the result.
+An event below the verbosity level returns before its text is formatted;
+loops over many states check `events.enabled(events.INFO)` first.
+
+The sink writes either the text lines, with warnings and errors prefixed by
+'Warning! ' and 'Error! ', or one JSON object per line with the level, the
+event name, and its fields. The lines are buffered; warnings and errors, the
+exit, and a fork flush the buffer. The tools flush it at the end of their
+`main` too, and the worker server closes the sink after every request: its
+children leave through `os._exit`, which skips the exit handlers.
+
+The tools add the options with `add_arguments` and apply them with
+`configure_from`:
+    -v, -q          more or less verbose; the default is 'info', -q shows
+                    only warnings and errors, -qq only errors,
+    --log FILE      write the messages to FILE instead of stderr,
+    --log-format    text or json.
+
+Only the standard library is imported here.
+"""
+
+import argparse
+import atexit
+import contextlib
+import json
+import os
+import sys
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVEL_NAMES = {DEBUG: 'debug', INFO: 'info', WARNING: 'warning',
+               ERROR: 'error'}
+PREFIXES = {WARNING: 'Warning! ', ERROR: 'Error! '}
+FORMATS = ('text', 'json')
+BUFFER_LINES = 512
+
+
+def _jsonable(value):
+    """ NumPy scalars and arrays in the JSON events. """
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    return str(value)
+
+
+class Sink:
+    def __init__(self, level: int = INFO, file=None, format: str = 'text'):
+        if format not in FORMATS:
+            raise RuntimeError(f"Unknown log format {format}. Choose from:"
+                               f" {FORMATS}.")
+        self.level = level
+        # None follows sys.stderr, which the worker server redirects
+        self.file = file
+        self.format = format
+        self.lines = list()
+
+    def emit(self, level: int, event: str, text: str, fields):
+        if self.format == 'json':
+            record = {'level': LEVEL_NAMES.get(level, level), 'event': event}
+            record.update(fields)
+            line = json.dumps(record, default=_jsonable)
+        else:
+            line = PREFIXES.get(level, '') + text.format(**fields)
+        self.lines.append(line)
+        if level >= WARNING or len(self.lines) >= BUFFER_LINES:
+            self.flush()
+
+    def flush(self):
+        if len(self.lines) == 0:
+            return
+        output = sys.stderr if self.file is None else self.file
+        output.write("\n".join(self.lines) + "\n")
+        output.flush()
+        self.lines.clear()
+
+    def close(self):
+        self.flush()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+_sink = Sink()
+
+
+def flush():
+    _sink.flush()
+
+
+def close():
+    """ Flushes the messages and closes the log file; the later messages
+    go to stderr. """
+    _sink.close()
+
+
+atexit.register(close)
+# A forked child would write the parent's buffered lines again
+os.register_at_fork(before=flush)
+
+
+def configure(level: int = INFO, file_name: str | None = None,
+              format: str = 'text'):
+    """ Replaces the sink; `file_name` None means stderr. """
+    global _sink
+    _sink.close()
+    file = None if file_name is None else open(file_name, 'w')
+    _sink = Sink(level, file, format)
+
+
+def enabled(level: int):
+    return level >= _sink.level
+
+
+def emit(level: int, event: str, text: str, **fields):
+    """
+    Records the event. The `text` is a `str.format` template of the fields,
+    used by the text format only.
+    """
+    if level < _sink.level:
+        return
+    _sink.emit(level, event, text, fields)
+
+
+def debug(event: str, text: str, **fields):
+    emit(DEBUG, event, text, **fields)
+
+
+def info(event: str, text: str, **fields):
+    emit(INFO, event, text, **fields)
+
+
+def warning(event: str, text: str, **fields):
+    emit(WARNING, event, text, **fields)
+
+
+def error(event: str, text: str, **fields):
+    emit(ERROR, event, text, **fields)
+
+
+@contextlib.contextmanager
+def threshold(level: int):
+    """ Drops the events below the level within the block. """
+    saved = _sink.level
+    _sink.level = max(saved, level)
+    try:
+        yield
+    finally:
+        _sink.level = saved
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    group = parser.add_argument_group('messages')
+    group.add_argument(
+        '-v', '--verbose', default=0, action='count',
+        help="Print more messages to stderr, e.g., the debug ones.")
+    group.add_argument(
+        '-q', '--quiet', default=0, action='count',
+        help="Print fewer messages: -q only warnings and errors, -qq only"
+        " errors.")
+    group.add_argument(
+        '--log', default=None, metavar='FILE',
+        help="Write the messages to FILE instead of stderr.")
+    group.add_argument(
+        '--log-format', default='text', choices=FORMATS,
+        help="Plain text or one JSON event per line. Default: %(default)s.")
+
+
+def configure_from(args):
+    """ Applies the options added by `add_arguments`. """
+    level = INFO + 10 * (args.quiet - args.verbose)
+    configure(min(max(level, DEBUG), ERROR), args.log, args.log_format)
@@ -0,0 +1,342 @@
+r"""
+Exact solvers of the CBS extrapolation models.
+
+The correlation model
+    E = E _\infty - b / n ** 3
+is linear in its parameters and is solved in closed form. The SCF model
+    E = E _\infty - b e ^{-c n}
+is linear in (E _\infty, b) for a fixed c. It is solved by variable
+projection: for every c the linear parameters are eliminated in closed form
+and Gauss-Newton iterations with the analytic Jacobian refine c alone.
+
+Every solver works on a (point × series) matrix of energies and fits all
+the columns at once. A one-dimensional series of energies gives results
+without the series dimension. The covariances follow the convention of
+scipy's `curve_fit`: the inverse of J^T J scaled by the residual variance.
+Without extra degrees of freedom, i.e., for an exact fit, the covariances
+are infinite.
+
+`solve_exponential_three_point` gives the exact SCF solution through three
+points with arbitrary zeta spacing and serves as the starting point of
+`fit_exponential`.
+"""
+
+import numpy as np
+import profiling
+
+
+def _as_columns(data_n, data_e):
+    data_n = np.asarray(data_n, dtype=float)
+    data_e = np.asarray(data_e, dtype=float)
+    is_single = data_e.ndim == 1
+    if is_single:
+        data_e = data_e[:, np.newaxis]
+
+    if data_e.shape[0] != data_n.shape[0]:
+        raise RuntimeError("Fit failed: data of different lengths.")
+
+    return data_n, data_e, is_single
+
+
+def _fit_line(x, y):
+    """
+    Closed-form least squares of y = alpha + beta * x for every column.
+    `x` is either a vector shared by all columns or a (point × series)
+    matrix. Returns alpha, beta, and the inverse of the normal matrix as a
+    (series × 2 × 2) array.
+    """
+    npoints = y.shape[0]
+    if x.ndim == 1:
+        x = x[:, np.newaxis]
+    sx = np.sum(x, axis=0) * np.ones(y.shape[1])
+    sxx = np.sum(x * x, axis=0) * np.ones(y.shape[1])
+    sy = np.sum(y, axis=0)
+    sxy = np.sum(x * y, axis=0)
+
+    det = npoints * sxx - sx * sx
+    beta = (npoints * sxy - sx * sy) / det
+    alpha = (sy - beta * sx) / npoints
+
+    inverse = np.empty((y.shape[1], 2, 2))
+    inverse[:, 0, 0] = sxx / det
+    inverse[:, 0, 1] = -sx / det
+    inverse[:, 1, 0] = -sx / det
+    inverse[:, 1, 1] = npoints / det
+    return alpha, beta, inverse
+
+
+def _scale_covariance(inverse, residuals, nparameters):
+    """ Residual variance times inverse of J^T J; infinite if exact. """
+    dof = residuals.shape[0] - nparameters
+    if dof <= 0:
+        return np.full_like(inverse, np.inf)
+    variance = np.sum(residuals ** 2, axis=0) / dof
+    return inverse * variance[:, np.newaxis, np.newaxis]
+
+
+@profiling.timed('inverse cube fit')
+def fit_inverse_cube(data_n, data_e):
+    r"""
+    Fits every column of `data_e` to
+        E = E _\infty - b / n ** 3
+
+    Returns the parameters as a (2 × series) array with rows (E _\infty, b)
+    and their covariances as a (series × 2 × 2) array.
+    """
+    data_n = np.asarray(data_n, dtype=float)
+    return fit_linear_decay(1.0 / data_n ** 3, data_e)
+
+
+def fit_linear_decay(decay, data_e):
+    r"""
+    Fits every column of `data_e` to
+        E = E _\infty - b f(n)
+    where `decay` holds the values of f at the points: a vector shared by
+    all the columns or a (point × series) matrix, e.g., different models
+    side by side.
+
+    Returns the parameters and the covariances as `fit_inverse_cube`.
+    """
+    decay = np.asarray(decay, dtype=float)
+    data_n, data_e, is_single = _as_columns(decay[:, 0] if decay.ndim == 2
+                                            else decay, data_e)
+    if data_n.shape[0] < 2:
+        raise RuntimeError("Fit failed: less than two entries availabe.")
+
+    x = -decay if decay.ndim == 2 else -decay[:, np.newaxis]
+    cbs_energy, b, inverse = _fit_line(x, data_e)
+    residuals = data_e - (cbs_energy + b * x)
+    covariance = _scale_covariance(inverse, residuals, 2)
+
+    parameters = np.array([cbs_energy, b])
+    if is_single:
+        return parameters[:, 0], covariance[0]
+    return parameters, covariance
+
+
+def _project_exponential(data_n, data_e, c):
+    r"""
+    Solves for (E _\infty, b) at fixed c. Returns them together with the
+    residuals and the exponentials e ^{-c n}.
+    """
+    decay = np.exp(-c[np.newaxis, :] * data_n[:, np.newaxis])
+    cbs_energy, b, _ = _fit_line(-decay, data_e)
+    residuals = data_e - (cbs_energy - b * decay)
+    return cbs_energy, b, residuals, decay
+
+
+@profiling.timed('exponential fit')
+def fit_exponential(data_n, data_e, guess_c, max_iterations: int = 100,
+                    tolerance: float = 1e-12):
+    r"""
+    Fits every column of `data_e` to
+        E = E _\infty - b e ^{-c n}
+    starting from the values of c in `guess_c` (one per series).
+
+    Returns the parameters as a (3 × series) array with rows
+    (E _\infty, b, c) and their covariances as a (series × 3 × 3) array.
+    A series whose cost no step can lower before it converges, e.g., a NaN
+    cost, has failed: its parameters and covariances are NaNs.
+    """
+    data_n, data_e, is_single = _as_columns(data_n, data_e)
+    if data_n.shape[0] < 3:
+        raise RuntimeError("Fit failed: less than three entries availabe.")
+
+    c = np.array(guess_c, dtype=float).reshape(-1) * np.ones(data_e.shape[1])
+    cbs_energy, b, residuals, decay = _project_exponential(data_n, data_e, c)
+    cost = np.sum(residuals ** 2, axis=0)
+    failed = np.zeros(data_e.shape[1], dtype=bool)
+
+    for _ in range(max_iterations):
+        # Kaufman's approximation: d(residual)/dc = -(1 - P) dmodel/dc,
+        # where P projects on the span of the linear basis {1, e ^{-c n}}
+        derivative = b * data_n[:, np.newaxis] * decay
+        alpha, beta, _ = _fit_line(-decay, derivative)
+        derivative -= alpha - beta * decay
+        curvature = np.sum(derivative * derivative, axis=0)
+        gradient = np.sum(derivative * residuals, axis=0)
+        step = np.where(curvature > 0, gradient / curvature, 0.0)
+        step = np.where(failed, 0.0, step)
+        full_step = step
+
+        # Halve the step of the series for which the cost went up
+        for _ in range(30):
+            trial = _project_exponential(data_n, data_e, c + step)
+            trial_cost = np.sum(trial[2] ** 2, axis=0)
+            worse = ~(trial_cost <= cost)
+            if not np.any(worse):
+                break
+            step = np.where(worse, 0.5 * step, step)
+
+        # The series that no halving improved stay where they are; unless
+        # they had converged already, they failed
+        stuck = ~(trial_cost <= cost)
+        converged = np.abs(full_step) <= tolerance * (1.0 + np.abs(c))
+        failed |= stuck & ~(converged & np.isfinite(cost))
+        step = np.where(stuck, 0.0, step)
+        c = c + step
+        cbs_energy, b, residuals, decay = (
+            np.where(stuck, old, new) for old, new in zip(
+                (cbs_energy, b, residuals, decay), trial))
+        cost = np.where(stuck, cost, trial_cost)
+        if np.all(np.abs(step) <= tolerance * (1.0 + np.abs(c))):
+            break
+
+    # Full Jacobian of the model with respect to (E _\infty, b, c)
+    jacobian = np.stack(
+        (np.ones_like(decay), -decay, b * data_n[:, np.newaxis] * decay),
+        axis=-1)
+    normal = np.einsum('psi,psj->sij', jacobian, jacobian)
+    inverse = np.full_like(normal, np.nan)
+    finite = np.all(np.isfinite(normal), axis=(1, 2))
+    inverse[finite] = np.linalg.pinv(normal[finite])
+    covariance = _scale_covariance(inverse, residuals, 3)
+
+    parameters = np.array([cbs_energy, b, c])
+    parameters[:, failed] = np.nan
+    covariance[failed] = np.nan
+    if is_single:
+        return parameters[:, 0], covariance[0]
+    return parameters, covariance
+
+
+def _log_decay_ratio(c, h1, h2):
+    r"""
+    log[(e ^{c h1} - 1) / (1 - e ^{-c h2})] for c > 0, written without
+    overflow. The ratio grows monotonically from h1/h2 at c = 0.
+    """
+    return (c * h1 + np.log1p(-np.exp(-c * h1))
+            - np.log1p(-np.exp(-c * h2)))
+
+
+def _log_decay_ratio_derivative(c, h1, h2):
+    return h1 / (1.0 - np.exp(-c * h1)) - h2 / np.expm1(c * h2)
+
+
+@profiling.timed('three-point exponential')
+def solve_exponential_three_point(data_n, data_e, max_iterations: int = 100,
+                                  tolerance: float = 1e-14):
+    r"""
+    Solves
+        E(n) = E _\infty - b e ^{-c n}
+    exactly through the last three points of every series. The zetas need
+    not be equally spaced.
+
+    With the spacings h1 = n2 - n1 and h2 = n3 - n2, the ratio of the energy
+    decrements fixes c:
+        (E1 - E2) / (E2 - E3) = (e ^{c h1} - 1) / (1 - e ^{-c h2})
+    The equation is solved with Newton steps safeguarded by bisection,
+    simultaneously for all the series.
+
+    `data_n` is a vector of zetas shared by all series or a
+    (point × series) matrix; `data_e` is a (point × series) matrix.
+
+    Returns a tuple `(parameters, failures)`. The parameters are a
+    (3 × series) array with rows (E _\infty, b, c); the series that cannot
+    be solved hold NaNs and `failures` maps their column index to the
+    reason.
+    """
+    data_n = np.asarray(data_n, dtype=float)
+    data_e = np.asarray(data_e, dtype=float)
+    is_single = data_e.ndim == 1
+    if is_single:
+        data_e = data_e[:, np.newaxis]
+    if data_n.ndim == 1:
+        data_n = data_n[:, np.newaxis] * np.ones(data_e.shape[1])
+
+    if data_n.shape != data_e.shape:
+        raise RuntimeError("Fit failed: data of different lengths.")
+
+    if data_e.shape[0] < 3:
+        raise RuntimeError("Fit failed: less than three entries availabe.")
+
+    n1, n2, n3 = data_n[-3:]
+    e1, e2, e3 = data_e[-3:]
+    h1 = n2 - n1
+    h2 = n3 - n2
+
+    failures = dict()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = (e1 - e2) / (e2 - e3)
+        log_ratio = np.log(ratio)
+
+    for column in range(data_e.shape[1]):
+        if not (h1[column] > 0 and h2[column] > 0):
+            failures[column] = "zetas are not increasing"
+        elif not np.isfinite(ratio[column]) or ratio[column] <= 0:
+            failures[column] = "energies do not change monotonically"
+        elif ratio[column] <= h1[column] / h2[column]:
+            failures[column] = "energies do not converge exponentially"
+
+    good = np.ones(data_e.shape[1], dtype=bool)
+    good[list(failures)] = False
+    # Dummy values keep the arithmetic of the failed series finite
+    h1 = np.where(good, h1, 1.0)
+    h2 = np.where(good, h2, 1.0)
+    log_ratio = np.where(good, log_ratio, 1.0)
+
+    # The ratio is below the data at c = 0 and above it at c = high
+    low = np.zeros_like(log_ratio)
+    high = (np.maximum(log_ratio, 0.0) + 1.0) / h1
+    c = 0.5 * (low + high)
+    for _ in range(max_iterations):
+        residual = _log_decay_ratio(c, h1, h2) - log_ratio
+        low = np.where(residual < 0, c, low)
+        high = np.where(residual > 0, c, high)
+
+        newton = c - residual / _log_decay_ratio_derivative(c, h1, h2)
+        inside = (newton > low) & (newton < high)
+        step = np.where(inside, newton, 0.5 * (low + high))
+        done = np.abs(step - c) <= tolerance * (1.0 + c)
+        c = step
+        if np.all(done):
+            break
+
+    b = (e2 - e3) / (np.exp(-c * n3) - np.exp(-c * n2))
+    cbs_energy = e3 + b * np.exp(-c * n3)
+
+    parameters = np.array([cbs_energy, b, c])
+    parameters[:, ~good] = np.nan
+    if is_single:
+        return parameters[:, 0], failures
+    return parameters, failures
+
+
+def inverse_cube_statistics(data_n, data_e):
+    """
+    Sufficient statistics of the `fit_inverse_cube` fit: the number of
+    points and the sums of x, x^2, y, and x y with x = -1/n^3. The sums of
+    y and x y are per series. Statistics of two data sets add up.
+    """
+    data_n, data_e, is_single = _as_columns(data_n, data_e)
+    x = -1.0 / data_n ** 3
+    statistics = {
+        'count': data_n.shape[0],
+        'sx': float(np.sum(x)),
+        'sxx': float(np.sum(x * x)),
+        'sy': np.sum(data_e, axis=0),
+        'sxy': np.sum(x[:, np.newaxis] * data_e, axis=0),
+    }
+    if is_single:
+        statistics['sy'] = statistics['sy'][0]
+        statistics['sxy'] = statistics['sxy'][0]
+    return statistics
+
+
+def fit_inverse_cube_from_statistics(statistics):
+    r"""
+    The least-squares parameters (E _\infty, b) of `fit_inverse_cube`
+    recovered from the output of `inverse_cube_statistics`.
+    """
+    npoints = statistics['count']
+    if npoints < 2:
+        raise RuntimeError("Fit failed: less than two entries availabe.")
+
+    sx = statistics['sx']
+    sxx = statistics['sxx']
+    sy = np.asarray(statistics['sy'], dtype=float)
+    sxy = np.asarray(statistics['sxy'], dtype=float)
+    det = npoints * sxx - sx * sx
+    b = (npoints * sxy - sx * sy) / det
+    cbs_energy = (sy - b * sx) / npoints
+    return np.array([cbs_energy, b])
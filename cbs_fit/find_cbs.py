@@ -1,35 +1,35 @@
 #!/usr/bin/env python3
 
 import argparse
-import json
-import numpy as np
-import fit_correlation as fc
-import fit_scf as fscf
-
-ha2eV = 27.211386245988
-eV2cm = 8065.543937
-ha2cm = ha2eV * eV2cm
-
-basis2n = {
-    'ANO0': 1,
-    'ANO1': 2,
-    'ANO2': 3,
-    'PWCVDZ': 2,
-    'PWCVTZ': 3,
-    'PWCVQZ': 4,
-    'PWCV5Z': 5,
-    'aug-pwCVDZ': 2,
-    'aug-pwCVTZ': 3,
-    'aug-pwCVQZ': 4,
-    'aug-pwCV5Z': 5,
-}
+import sys
+import worker_client
+if __name__ == "__main__":
+    # Forward to the warm server before the heavy imports
+    worker_client.forward('find_cbs')
+import numpy as np  # noqa: E402
+from core import (  # noqa: E402,F401 re-exported for the older scripts
+    ha2eV, eV2cm, ha2cm, basis2n, add_correlation_energies, get_dataset,
+)
+from columnar import ColumnarDataset, load_dataset  # noqa: E402
+import fit_correlation as fc  # noqa: E402
+import fit_scf as fscf  # noqa: E402
+from fit_cache import (  # noqa: E402
+    FitCache, DEFAULT_DIRECTORY as DEFAULT_CACHE_DIRECTORY,
+)
+import container  # noqa: E402
+import events  # noqa: E402
+import plots  # noqa: E402
+import profiling  # noqa: E402
+import records  # noqa: E402
+import state_index as si  # noqa: E402
+import uncertainty  # noqa: E402
 
 
 def get_args():
     parser = argparse.ArgumentParser()
     parser.add_argument(
         'ab_initio', help="JSON file with ab initio energies for each "
-        "basis set."
+        "basis set. NDJSON with one basis set per line works too."
     )
     parser.add_argument(
         '-b', '--basis', default="",
@@ -40,78 +40,99 @@ def get_args():
         help="Fit using all data points. Default: Fit using minimal number of"
         " points, i.e., only the largest basis sets."
     )
+    parser.add_argument(
+        "-p", "--plots", default="show", choices=plots.PLOT_MODES,
+        help="How to present the fitting plots: show them in windows (the"
+        " default), save each to a png or pdf file, save all of them to a"
+        " single multipage pdf, or skip them (none)."
+    )
+    parser.add_argument(
+        "--no-plots", dest="plots", action="store_const", const="none",
+        help="Skip the plots altogether; the same as `--plots none`."
+    )
+    parser.add_argument(
+        "--plot-dir", default="plots",
+        help="Directory for the plot files. Default: %(default)s."
+    )
+    parser.add_argument(
+        "--plot-workers", default=None, type=int,
+        help="Number of processes rendering the plot files. Default: the"
+        " number of CPUs."
+    )
+    parser.add_argument(
+        "--cache", default=False, action="store_true",
+        help="Reuse the result of an unchanged data set from the cache; a"
+        " cached result is not plotted. See fit_cache.py."
+    )
+    parser.add_argument(
+        "--cache-dir", default=DEFAULT_CACHE_DIRECTORY,
+        help="Cache directory. Default: %(default)s."
+    )
+    parser.add_argument(
+        "--ndjson", default=False, action="store_true",
+        help="Print the CBS header and then one EOM state per line (NDJSON)."
+    )
+    parser.add_argument(
+        "-o", "--binary", default=None, metavar="FILE",
+        help="Save the result to FILE in the binary container format (see"
+        " container.py) instead of printing the JSON."
+    )
+    uncertainty.add_arguments(parser, cbs=True)
+    events.add_arguments(parser)
+    profiling.add_arguments(parser)
     args = parser.parse_args()
     return args
 
 
-def add_correlation_energies(dataset):
-    for data in dataset:
-        scf = data['scf']
-
-        if 'cc_energy' in data:
-            cc = data['cc_energy']
-            data['cc_correlation'] = cc - scf
-
-        for eom in data['EOM']:
-            ee = eom['energy']
-            eom['correlation'] = ee - scf
-
-
-def get_dataset(file_name):
-    with open(file_name) as input:
-        data = json.load(input)
-
-    data.sort(key=lambda x: basis2n[x['basis']])
-    add_correlation_energies(data)
-
-    cc_level = None
-    for basis in data:
-        if 'calclevel' in basis:
-            loc_cc_level = basis['calclevel']
-            if cc_level is None:
-                cc_level = loc_cc_level
-                continue
-
-            if cc_level != loc_cc_level:
-                raise RuntimeError("Data set contains varying CC level: "
-                                   f"{cc_level}, and {loc_cc_level}")
-
-    return data, cc_level
-
-
-def fit_scf(dataset, use_best: bool = False, basis_str: str = ""):
+@profiling.timed('fit scf')
+def fit_scf(dataset: ColumnarDataset, use_best: bool = False,
+            basis_str: str = "", plot_jobs: list | bool | None = None):
     """
     If use_best is set to True, the fit will use only the three points from
     the largest basis sets.
+
+    If plot_jobs is a list, the plot is appended to it as a job for
+    `plots.py` instead of being shown. If it is False, no plot is made.
     """
-    print("\n\nFitting SCF energy to the exponential model.")
-    zetas = [basis2n[data['basis']] for data in dataset]
-    scf_energies = [data['scf'] for data in dataset]
+    events.info('fit', "\n\nFitting {name} energy to the {model} model.",
+                name='SCF', model='exponential')
+    zetas = dataset.zetas
+    scf_energies = dataset.scf
     exp_model_scf_fit_parameters = fscf.fit_scf_to_exp_model(
         zetas, scf_energies, use_best=use_best)
-    fscf.show_SCF_fitting_result(
-        zetas, scf_energies, exp_model_scf_fit_parameters, basis_str)
+    if plot_jobs is None:
+        fscf.show_SCF_fitting_result(
+            zetas, scf_energies, exp_model_scf_fit_parameters, basis_str)
+    elif plot_jobs is not False:
+        plot_jobs += [plots.scf_job(
+            zetas, scf_energies, exp_model_scf_fit_parameters, basis_str)]
     scf_cbs = exp_model_scf_fit_parameters[0]
     return scf_cbs
 
 
-def fit_cc(dataset, name, key, use_best: bool = False, basis_str: str = ""):
+@profiling.timed('fit cc')
+def fit_cc(dataset: ColumnarDataset, name, use_best: bool = False,
+           basis_str: str = "", plot_jobs: list | bool | None = None):
     r"""
     Fit using only the last two points if use_best is set.
     Energy assumption:
         E = E _\infty - b / n ** 3
+
+    See `fit_scf` for the meaning of plot_jobs.
     """
-    print(
-        "\n\n"
-        f"Fitting {name} correlation energy to the 1/n^3 model."
-    )
-    zetas = [basis2n[data['basis']] for data in dataset]
-    correlation_energies = [data[key] for data in dataset]
+    events.info('fit', "\n\nFitting {name} correlation energy to the"
+                " {model} model.", name=name, model='1/n^3')
+    zetas = dataset.zetas
+    correlation_energies = dataset.cc_correlation
     cc_parameters = fc.fit_to_cubic_model(
         zetas, correlation_energies, use_best=use_best)
 
-    fc.show_fit_results(zetas, correlation_energies,
-                        cc_parameters, name, basis_str)
+    if plot_jobs is None:
+        fc.show_fit_results(zetas, correlation_energies,
+                            cc_parameters, name, basis_str)
+    elif plot_jobs is not False:
+        plot_jobs += [plots.correlation_job(
+            zetas, correlation_energies, cc_parameters, name, basis_str)]
     correlation_cbs = cc_parameters[0]
     correlation_cbs_error_est = 0.5 * np.abs(
         correlation_cbs - correlation_energies[-1])
@@ -119,84 +140,185 @@ def fit_cc(dataset, name, key, use_best: bool = False, basis_str: str = ""):
     return correlation_cbs, correlation_cbs_error_est
 
 
-def fit_eom(dataset, use_best):
+def collect_eom_correlation(dataset: ColumnarDataset):
     """
-    For each data in the EOM section find extrapolated energy.
+    Returns the (basis × state) matrix of the EOM correlation energies and
+    the list of the states (columns). The states are the ones computed with
+    the smallest basis set; every larger basis set has to include them.
     """
-    print(
-        "\n\n"
-        "Fitting EOM correlation energy to the 1/n^3 model."
-    )
-    zetas = [basis2n[data['basis']] for data in dataset]
-
-    eom_model = dataset[0]['EOM'][0]['model']
-    eom_cbs = []
-    for eom_state in dataset[0]['EOM']:
-        eom_cbs += [{
-            'irrep': eom_state['irrep'],
-            'model': eom_model,
-        }]
-
-    for desired_eom_state in eom_cbs:
-        # For each state in the EOM list run extrapolation
-        correlation_energies = list()
-
-        # Collect the desired_eom_state's energies from every basis size
-        for one_basis_data in dataset:
-            for eom_state in one_basis_data['EOM']:
-                if eom_state['irrep'] != desired_eom_state['irrep']:
-                    continue
-
-                if eom_state['model'] != eom_model:
-                    raise RuntimeError(f"Warning! Varying EOM models:"
-                                       f"{eom_model} and {eom_state['model']}")
+    if len(dataset.states.models) > 1:
+        raise RuntimeError(f"Warning! Varying EOM models:"
+                           f"{dataset.states.models[0]} and"
+                           f" {dataset.states.models[1]}")
+
+    correlation_energies = dataset.eom_correlation
+    present = ~np.isnan(correlation_energies[0])
+    correlation_energies = correlation_energies[:, present]
+    keys = [key for key, keep in zip(dataset.states.keys(), present) if keep]
+    for row, basis in enumerate(dataset.basis):
+        missing = np.flatnonzero(np.isnan(correlation_energies[row]))
+        if len(missing) != 0:
+            raise RuntimeError(
+                f"The {basis} basis is missing states: "
+                f"{[si.key_to_str(keys[column]) for column in missing]}."
+            )
+
+    eom_states = [
+        {'irrep': {'energy #': number, 'name': irrep}, 'model': model}
+        for number, irrep, model in keys
+    ]
+    return correlation_energies, eom_states
+
+
+@profiling.timed('fit eom')
+def fit_eom(dataset: ColumnarDataset, use_best,
+            plot_jobs: list | bool | None = None):
+    """
+    For each data in the EOM section find extrapolated energy.
 
-                correlation_energies += [eom_state['correlation']]
+    All states are extrapolated at once: their correlation energies are
+    collected into a (basis × state) matrix and fitted with a single
+    least-squares solve.
 
-        cc_parameters = fc.fit_to_cubic_model(
-            zetas, correlation_energies, use_best=use_best)
+    See `fit_scf` for the meaning of plot_jobs.
+    """
+    events.info('fit', "\n\nFitting {name} correlation energy to the"
+                " {model} model.", name='EOM', model='1/n^3')
+    zetas = dataset.zetas
+    correlation_energies, eom_cbs = collect_eom_correlation(dataset)
+    cc_parameters = fc.fit_many_to_cubic_model(
+        zetas, correlation_energies, use_best=use_best)
+    correlation_cbs = cc_parameters[0]
+    correlation_cbs_error_est = 0.5 * np.abs(
+        correlation_cbs - correlation_energies[-1])
 
+    # With thousands of states even the skipped events add up
+    verbose = events.enabled(events.INFO)
+    for column, desired_eom_state in enumerate(eom_cbs):
         irrep_no = desired_eom_state['irrep']['energy #']
         irrep_name = desired_eom_state['irrep']['name']
-        name = eom_model + f" {irrep_no}{irrep_name}"
-        fc.show_fit_results(zetas, correlation_energies, cc_parameters, name)
-        correlation_cbs = cc_parameters[0]
-        correlation_cbs_error_est = 0.5 * abs(
-            correlation_cbs - correlation_energies[-1])
-
-        desired_eom_state['correlation'] = correlation_cbs
-        desired_eom_state['correlation error est'] = correlation_cbs_error_est
+        name = desired_eom_state['model'] + f" {irrep_no}{irrep_name}"
+        if verbose:
+            fc.print_model_paramerters(cc_parameters[:, column], name)
+        if plot_jobs is None:
+            fc.show_fit_results(zetas, correlation_energies[:, column],
+                                cc_parameters[:, column], name)
+        elif plot_jobs is not False:
+            plot_jobs += [plots.correlation_job(
+                zetas, correlation_energies[:, column],
+                cc_parameters[:, column], name)]
+
+        desired_eom_state['correlation'] = float(correlation_cbs[column])
+        desired_eom_state['correlation error est'] = float(
+            correlation_cbs_error_est[column])
 
     return eom_cbs
 
 
-def main():
-    args = get_args()
-    basis_str = args.basis
-    dataset, cc_level = get_dataset(args.ab_initio)
+def find_cbs(dataset: ColumnarDataset, use_best: bool = True,
+             basis_str: str = "", plot_jobs: list | bool | None = None,
+             cache: FitCache | None = None):
+    """
+    Runs the SCF, CC, and EOM extrapolations of the data set returned by
+    `columnar.load_dataset`. Returns the CBS header and the list of the CBS EOM
+    states. See `fit_scf` for the meaning of plot_jobs.
 
-    use_best = not args.use_all
-    scf_cbs = fit_scf(dataset, use_best=use_best, basis_str=basis_str)
+    With a cache, the result of the same data set and fit mode is read from
+    it instead of being fitted again; such a result has no plots.
+    """
+    cache_key = None
+    if cache is not None:
+        cache_key = cache.key(dataset, use_best)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            events.info('cached', "\n\nReusing the cached CBS result {key}.",
+                        key=cache_key)
+            return cached
+
+    scf_cbs = fit_scf(dataset, use_best=use_best, basis_str=basis_str,
+                      plot_jobs=plot_jobs)
 
     # Allow for a case where for the largest basis sets only SCF is available,
     # e.g. aug-pwCVDZ, aug-pwCVTZ, but for QZ only SCF is possible, and it is
     # needed because SCF if fitted to three points at least
 
-    cc_dataset = [data for data in dataset if 'cc_correlation' in data]
+    cc_dataset = dataset.rows(dataset.has_cc)
+    cc_level = dataset.calclevel
 
     cc_correlation_CBS, cc_corr_error_est = fit_cc(
-        cc_dataset, name=cc_level, key='cc_correlation', use_best=use_best,
-        basis_str=basis_str)
+        cc_dataset, name=cc_level, use_best=use_best,
+        basis_str=basis_str, plot_jobs=plot_jobs)
 
-    cbs_eom = fit_eom(cc_dataset, use_best=use_best)
-    cbs = {
+    cbs_eom = fit_eom(cc_dataset, use_best=use_best, plot_jobs=plot_jobs)
+    cbs_header = {
         'basis': 'CBS',
-        'scf': scf_cbs,
+        'scf': float(scf_cbs),
         'calclevel': cc_level,
-        'cc_correlation': cc_correlation_CBS,
-        'EOM': cbs_eom,
+        'cc_correlation': float(cc_correlation_CBS),
     }
-    print(json.dumps(cbs))
+    if cache is not None:
+        cache.put(cache_key, cbs_header, cbs_eom)
+    return cbs_header, cbs_eom
+
+
+@profiling.timed('uncertainty')
+def add_intervals(dataset: ColumnarDataset, cbs_header, cbs_eom, args):
+    """
+    Saves the Monte Carlo confidence intervals of the CBS limits in the
+    results of `find_cbs`; see `uncertainty.py`.
+    """
+    cc_dataset = dataset.rows(dataset.has_cc)
+    eom_correlation, _ = collect_eom_correlation(cc_dataset)
+    correlation = np.column_stack(
+        [cc_dataset.cc_correlation, eom_correlation])
+    intervals = uncertainty.cbs_intervals(
+        dataset.zetas, dataset.scf, cc_dataset.zetas, correlation,
+        samples=args.mc, level=args.ci, alpha=args.mc_alpha,
+        noise=args.mc_noise, use_best=not args.use_all, seed=args.seed)
+    failed = intervals['settings']['failed SCF samples']
+    if failed != 0:
+        events.warning('failed samples', "{failed} of {samples} SCF samples"
+                       " did not converge.", failed=failed, samples=args.mc)
+    uncertainty.attach_cbs_intervals(cbs_header, cbs_eom, intervals)
+
+
+@profiling.profiled('find_cbs')
+def main():
+    args = get_args()
+    events.configure_from(args)
+    basis_str = args.basis
+    dataset = load_dataset(args.ab_initio)
+
+    use_best = not args.use_all
+    # Interactive plots are shown as the fits go; the other modes collect
+    # the plots and render them once the results are printed; without plots
+    # the jobs are not even built
+    plot_jobs = {'show': None, 'none': False}.get(args.plots, [])
+    cache = FitCache(args.cache_dir) if args.cache is True else None
+    cbs_header, cbs_eom = find_cbs(
+        dataset, use_best=use_best, basis_str=basis_str,
+        plot_jobs=plot_jobs, cache=cache)
+    if args.mc > 0:
+        add_intervals(dataset, cbs_header, cbs_eom, args)
+
+    rendering = None
+    if args.plots not in ('show', 'none'):
+        with profiling.stage('plot'):
+            rendering = plots.start_rendering(
+                plot_jobs, args.plots, args.plot_dir, args.plot_workers)
+
+    with profiling.stage('serialize'):
+        if args.binary is not None:
+            container.save_group(args.binary, cbs_header, cbs_eom)
+        else:
+            records.write_group(cbs_header, cbs_eom, ndjson=args.ndjson)
+            sys.stdout.flush()
+
+    if rendering is not None:
+        with profiling.stage('plot'):
+            plots.finish_rendering(rendering)
+
+    events.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Content-addressed cache of the CBS results.
+
+A result is identified by the hash of the whole data set, i.e., the zetas,
+the SCF, CC, and EOM energies, the CC level, the states, and the fit mode
+(the largest basis sets only or all points). The cache stores the CBS
+header and the EOM states of `find_cbs.find_cbs` in a JSON file named after
+that hash, so an unchanged system costs a single file read.
+
+The tools never prune the cache by themselves; run this script to inspect,
+prune, or clear it. Pruning evicts the least recently used entries above
+the size limit.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import profiling
+
+DEFAULT_DIRECTORY = os.path.join(
+    os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+    'additive_models')
+DEFAULT_MAX_BYTES = 64 * 2**20
+
+
+class FitCache:
+    def __init__(self, directory: str = DEFAULT_DIRECTORY,
+                 max_bytes: int = DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(dataset, use_best: bool):
+        """ Hash of the `columnar.ColumnarDataset` and the fit mode. """
+        digest = hashlib.sha256(json.dumps({
+            'mode': 'best' if use_best else 'all',
+            'calclevel': dataset.calclevel,
+            'states': dataset.states.keys(),
+        }).encode())
+        for column in (dataset.zetas, dataset.scf, dataset.cc_energy,
+                       dataset.eom):
+            digest.update(column.astype('float64').tobytes())
+        return digest.hexdigest()
+
+    def _path(self, key: str):
+        return os.path.join(self.directory, key[:2], key + '.json')
+
+    def get(self, key: str):
+        """ Returns the stored CBS header and EOM states or None. """
+        path = self._path(key)
+        try:
+            with open(path) as entry:
+                result = json.load(entry)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+        # The modification time marks the last use for the LRU eviction
+        os.utime(path)
+        return result['header'], result['EOM']
+
+    def put(self, key: str, cbs_header, cbs_eom):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = path + f'.{os.getpid()}.tmp'
+        with open(temporary, 'w') as entry:
+            json.dump({'header': cbs_header, 'EOM': cbs_eom}, entry)
+        os.replace(temporary, path)
+
+    def entries(self):
+        """ Lists (last use, size, path) of all entries. """
+        found = list()
+        if not os.path.isdir(self.directory):
+            return found
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith('.json'):
+                    continue
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                found += [(stat.st_mtime, stat.st_size, path)]
+        return found
+
+    def prune(self):
+        """ Evicts the least recently used entries above the size limit. """
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+            evicted += 1
+        return evicted
+
+    def clear(self):
+        """ Removes all entries. """
+        entries = self.entries()
+        for _, _, path in entries:
+            os.remove(path)
+        return len(entries)
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="Manage the cache of the CBS extrapolation results.")
+    parser.add_argument(
+        'command', choices=('info', 'prune', 'clear'),
+        help="Show the cache size, evict entries above the size limit, or"
+        " invalidate the whole cache."
+    )
+    parser.add_argument(
+        '-d', '--directory', default=DEFAULT_DIRECTORY,
+        help="Cache directory. Default: %(default)s."
+    )
+    parser.add_argument(
+        '-m', '--max-mb', default=DEFAULT_MAX_BYTES / 2**20, type=float,
+        help="Size limit used by prune in MB. Default: %(default)s."
+    )
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    return args
+
+
+@profiling.profiled('fit_cache')
+def main():
+    args = get_args()
+    cache = FitCache(args.directory, int(args.max_mb * 2**20))
+
+    if args.command == 'info':
+        entries = cache.entries()
+        size = sum(size for _, size, _ in entries)
+        print(f"{cache.directory}: {len(entries)} entries,"
+              f" {size / 2**20:.2f} MB")
+    elif args.command == 'prune':
+        print(f"Evicted {cache.prune()} entries.")
+    elif args.command == 'clear':
+        print(f"Removed {cache.clear()} entries.")
+
+    return 0
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,9 @@
 #!/usr/bin/env python3
 
-import sys
 import numpy as np
-from scipy.optimize import curve_fit
-import matplotlib.pyplot as plt
+import events
+import extrapolation
+import profiling
 
 
 def cube_decay_model(n, cbs_energy, b):
@@ -13,14 +13,11 @@ def cube_decay_model(n, cbs_energy, b):
 
 def initial_guess(data_n, data_e):
     if len(data_n) != len(data_e):
-        print("Initial guess failed: data of different lengths.",
-              file=sys.stderr)
-        exit(1)
+        raise RuntimeError("Initial guess failed: data of different lengths.")
 
     if len(data_n) < 2:
-        print("Initial guess failed: less than two entries availabe to fit.",
-              file=sys.stderr)
-        exit(1)
+        raise RuntimeError(
+            "Initial guess failed: less than two entries availabe to fit.")
 
     e1 = data_e[-1]
     e2 = data_e[-2]
@@ -34,16 +31,16 @@ def initial_guess(data_n, data_e):
 
 
 def print_model_paramerters(parameters, header):
-    print(f"{header} values:")
-    print(f"  E cbs = {parameters[0]:.6f}")
-    print(f"  B = {parameters[1]:.6f}")
+    events.info('fit parameters',
+                "{header} values:\n  E cbs = {cbs:.6f}\n  B = {b:.6f}",
+                header=header, model='inverse cube', cbs=parameters[0],
+                b=parameters[1])
     return
 
 
 def get_correlation_CBS(data_n, data_e):
-    guess = initial_guess(data_n, data_e)
-    fit_parameters, covariance = curve_fit(
-        cube_decay_model, data_n, data_e, p0=guess)
+    fit_parameters, covariance = extrapolation.fit_inverse_cube(
+        data_n, data_e)
     return fit_parameters[0]
 
 
@@ -58,15 +55,50 @@ def fit_to_cubic_model(data_n, data_e, use_best: bool = False):
     if use_best is True:
         return guess
 
-    fit_parameters, covariance = curve_fit(
-        cube_decay_model, data_n, data_e, p0=guess)
+    fit_parameters, covariance = extrapolation.fit_inverse_cube(
+        data_n, data_e)
     print_model_paramerters(fit_parameters, "Fitting result")
     return fit_parameters
 
 
-def show_fit_results(data_n, data_e, fit_parameters, title_extra: str = "",
+def fit_many_to_cubic_model(data_n, data_e, use_best: bool = False):
+    r"""
+    Batched version of `fit_to_cubic_model`.
+
+    `data_e` is a (basis × series) matrix: each column holds one series of
+    correlation energies, e.g., one EOM state, evaluated at the zetas listed
+    in `data_n`. The model
+        E = E _\infty - b / n ** 3
+    is linear in its parameters, so a single least-squares solve fits all
+    columns at once. See `extrapolation.fit_inverse_cube` for the
+    covariances of the parameters.
+
+    If use_best is set to True, only the last two points are used and the
+    result is the exact solution, i.e., the `initial_guess` of every series.
+
+    Returns a (2 × series) array with rows (E _infty, b).
+    """
+    data_n = np.asarray(data_n, dtype=float)
+    data_e = np.asarray(data_e, dtype=float)
+    if data_e.ndim == 1:
+        data_e = data_e[:, np.newaxis]
+
+    if use_best is True:
+        data_n = data_n[-2:]
+        data_e = data_e[-2:]
+
+    fit_parameters, covariance = extrapolation.fit_inverse_cube(
+        data_n, data_e)
+    return fit_parameters
+
+
+@profiling.timed('plot')
+def plot_fit_results(data_n, data_e, fit_parameters, title_extra: str = "",
                      basis_str: str = ""):
-    plt.figure(figsize=(4, 3))
+    """ Draws the fit on a new figure and returns the figure. """
+    import matplotlib.pyplot as plt
+
+    figure = plt.figure(figsize=(4, 3))
     plt.plot(data_n, data_e, 'o', label="ab initio correlation", zorder=10)
     npts = 100
     first = 3
@@ -89,9 +121,19 @@ def show_fit_results(data_n, data_e, fit_parameters, title_extra: str = "",
     if title_extra != "":
         plt.title(title_extra)
     plt.tight_layout()
+    return figure
+
+
+def show_fit_results(data_n, data_e, fit_parameters, title_extra: str = "",
+                     basis_str: str = ""):
+    import matplotlib.pyplot as plt
+
+    plot_fit_results(data_n, data_e, fit_parameters, title_extra, basis_str)
+    events.flush()
     plt.show()
 
 
+@profiling.profiled('fit_correlation')
 def main():
     pwCVnZ = [3, 4]
     pwCVnZ_CCSDT_correlation = [-0.96318413, -1.02456663]
@@ -101,6 +143,7 @@ def main():
     fit_parameters = fit_to_cubic_model(data_n, data_e)
     show_fit_results(data_n, data_e, fit_parameters)
 
+    events.flush()
     return 0
 
 
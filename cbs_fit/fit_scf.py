@@ -1,8 +1,9 @@
 #!/usr/bin/env python3
 
 import numpy as np
-from scipy.optimize import curve_fit
-import matplotlib.pyplot as plt
+import events
+import extrapolation
+import profiling
 
 
 def exp_model(n, cbs_energy, b, c):
@@ -15,47 +16,40 @@ def initial_guess(data_n, data_e):
     The exponential fit takes three parameters. With three data points
     the equations can be solved for the unknown parameters. Solving the set
     of equations with the last three data points generates the intial guess.
+    The zetas do not have to be spaced by one.
 
     The energy dependence ansatz
     E(n) = E _\infty - b e ^{-c n}
     """
     if len(data_n) != len(data_e):
-        print("Initial guess failed: data of different lengths.")
-        exit(1)
+        raise RuntimeError("Initial guess failed: data of different lengths.")
 
     if len(data_n) < 3:
-        print("Initial guess failed: less than three entries availabe to fit.")
-        exit(1)
+        raise RuntimeError(
+            "Initial guess failed: less than three entries availabe to fit.")
 
-    e3 = data_e[-1]
-    e2 = data_e[-2]
-    e1 = data_e[-3]
-    n3 = data_n[-1]
-    n2 = data_n[-2]
-    n1 = data_n[-3]
-
-    # this works one if the ns are in  steps of 1
-    if n3-n2 != 1 or n2-n1 != 1:
-        print("Error the SCF fit requires data set in zeta steps of 1.")
-
-    c = np.log((e2 - e1) / (e3 - e2))
-    b = (e2 - e3) / (np.exp(- n3 * c) - np.exp(- n2 * c))
-    cbs_energy = e3 + b * np.exp(- n3 * c)
+    parameters, failures = extrapolation.solve_exponential_three_point(
+        data_n, data_e)
+    if len(failures) != 0:
+        raise RuntimeError(f"Initial guess failed: {failures[0]}.")
 
+    cbs_energy, b, c = parameters
     return cbs_energy, b, c
 
 
 def print_exp_model_paramerters(parameters, header):
-    print(f"{header} values:")
-    print(f"  E cbs = {parameters[0]:.6f}")
-    print(f"  B = {parameters[1]:.6f}")
-    print(f"  c = {parameters[2]:.6f}")
+    events.info('fit parameters',
+                "{header} values:\n  E cbs = {cbs:.6f}\n  B = {b:.6f}\n"
+                "  c = {c:.6f}",
+                header=header, model='exponential', cbs=parameters[0],
+                b=parameters[1], c=parameters[2])
     return
 
 
 def get_SCF_CBS_value(data_n, data_e):
     guess = initial_guess(data_n, data_e)
-    fit_parameters, covariance = curve_fit(exp_model, data_n, data_e, p0=guess)
+    fit_parameters, covariance = extrapolation.fit_exponential(
+        data_n, data_e, guess_c=guess[2])
     return fit_parameters[0]
 
 
@@ -74,14 +68,49 @@ def fit_scf_to_exp_model(data_n, data_e, use_best: bool = False):
     if use_best is True:
         return guess
 
-    fit_parameters, covariance = curve_fit(exp_model, data_n, data_e, p0=guess)
+    fit_parameters, covariance = extrapolation.fit_exponential(
+        data_n, data_e, guess_c=guess[2])
+    if np.isnan(fit_parameters[2]):
+        raise RuntimeError("Fit failed: the least-squares fit did not"
+                           " converge.")
     print_exp_model_paramerters(fit_parameters, "Fitting result")
     return fit_parameters
 
 
-def show_SCF_fitting_result(data_n, data_e, fit_parameters,
+def fit_many_scf_to_exp_model(data_n, data_e, use_best: bool = False):
+    r"""
+    Batched version of `fit_scf_to_exp_model` for many SCF series, e.g., one
+    per geometry. `data_e` is a (basis × series) matrix and `data_n` holds
+    the zetas of its rows.
+
+    Returns a tuple `(parameters, failures)`. The parameters are a
+    (3 × series) array with rows (E _\infty, b, c). A series that cannot be
+    extrapolated does not stop the others: its parameters are NaNs and
+    `failures` maps its column index to the reason.
+    """
+    parameters, failures = extrapolation.solve_exponential_three_point(
+        data_n, data_e)
+    if use_best is True or data_e.shape[0] == 3:
+        return parameters, failures
+
+    good = ~np.isnan(parameters[2])
+    if np.any(good):
+        fit_parameters, covariance = extrapolation.fit_exponential(
+            data_n, data_e[:, good], guess_c=parameters[2, good])
+        parameters[:, good] = fit_parameters
+        for column in np.flatnonzero(good)[np.isnan(fit_parameters[2])]:
+            failures[int(column)] = \
+                "the least-squares fit did not converge"
+    return parameters, failures
+
+
+@profiling.timed('plot')
+def plot_SCF_fitting_result(data_n, data_e, fit_parameters,
                             basis_str: str = ""):
-    plt.figure(figsize=(4, 3))
+    """ Draws the fit on a new figure and returns the figure. """
+    import matplotlib.pyplot as plt
+
+    figure = plt.figure(figsize=(4, 3))
     plt.plot(data_n, data_e, 'o', label="ab inito SCF", zorder=10)
     first = 3
     last = 7
@@ -101,9 +130,19 @@ def show_SCF_fitting_result(data_n, data_e, fit_parameters,
         plt.xlabel("n, " + basis_str)
     plt.title("SCF convergence")
     plt.tight_layout()
+    return figure
+
+
+def show_SCF_fitting_result(data_n, data_e, fit_parameters,
+                            basis_str: str = ""):
+    import matplotlib.pyplot as plt
+
+    plot_SCF_fitting_result(data_n, data_e, fit_parameters, basis_str)
+    events.flush()
     plt.show()
 
 
+@profiling.profiled('fit_scf')
 def main():
     pwCVnZ = [3, 4, 5]
     pwCVnZ_SCF = [-224.34218395, -224.35967856, -224.36413383]
@@ -113,6 +152,7 @@ def main():
     fit_parameters = fit_scf_to_exp_model(data_n, data_e)
     show_SCF_fitting_result(data_n, data_e, fit_parameters)
 
+    events.flush()
     return 0
 
 
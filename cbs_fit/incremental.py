@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+r"""
+Incremental CBS extrapolation.
+
+Instead of refitting the whole data set, the extrapolations are kept as a
+compact state saved in a JSON file:
+    - SCF: the points of the exponential fit, i.e., the three largest basis
+      sets, or every point if all points are fitted,
+    - correlation (CC and every EOM state): the sufficient statistics of the
+      linear fit to E _\infty - b / n ** 3 and the energies at the two
+      largest basis sets.
+A new basis-set entry is folded into the state and only the affected
+extrapolations are updated: an SCF-only entry changes only the SCF limit.
+The changes of the CBS values are printed as a JSON list.
+
+    ./incremental.py init ccsd+pwCVnZ.json -s ccsd+pwCVnZ+state.json
+    ./incremental.py add ccsd+pwCVnZ+state.json aug-pwCV5Z.json \
+        -o ccsd+pwCVnZ+cbs.json
+"""
+
+import argparse
+import json
+import numpy as np
+from core import basis2n, add_correlation_energies, get_dataset
+import extrapolation
+import profiling
+import records
+import state_index as si
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="Keeps the CBS extrapolations up to date as new basis"
+        " sets arrive.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    init = subparsers.add_parser(
+        'init', help="Build the state from an ab initio data set.")
+    init.add_argument(
+        'ab_initio', help="JSON or NDJSON file with ab initio energies for"
+        " each basis set.")
+    init.add_argument(
+        '-s', '--state', required=True, help="Output state file.")
+    init.add_argument(
+        "-a", "--use_all", default=False, action="store_true",
+        help="Fit using all data points. Default: Fit using minimal number of"
+        " points, i.e., only the largest basis sets.")
+    init.add_argument(
+        '-o', '--output', default=None,
+        help="Save the CBS result to this file.")
+
+    add = subparsers.add_parser(
+        'add', help="Fold new basis-set entries into the state.")
+    add.add_argument('state', help="State file; updated in place.")
+    add.add_argument(
+        'new', help="JSON or NDJSON file with the new basis-set entries.")
+    add.add_argument(
+        '-o', '--output', default=None,
+        help="Save the updated CBS result to this file.")
+
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    return args
+
+
+def new_state(use_best: bool):
+    return {
+        'use_best': use_best,
+        'calclevel': None,
+        'bases': [],
+        'scf': [],
+        'correlation': None,
+    }
+
+
+def _keep_largest(points, count):
+    """ Keeps the `count` points with the largest zetas, sorted by zeta. """
+    points = sorted(points, key=lambda point: point[0])
+    if count is None:
+        return points
+    return points[-count:]
+
+
+def _new_correlation(states):
+    return {
+        'count': 0,
+        'sx': 0.0,
+        'sxx': 0.0,
+        'last zetas': [],
+        'cc': {'sy': 0.0, 'sxy': 0.0, 'last': []},
+        'states': [
+            {'irrep': state['irrep'], 'model': state['model'],
+             'sy': 0.0, 'sxy': 0.0, 'last': []}
+            for state in states
+        ],
+    }
+
+
+def _fold_correlation(correlation, n, data):
+    """ Adds the CC and EOM correlation energies at zeta n. """
+    series = [correlation['cc']] + correlation['states']
+    index, duplicates = si.index_states(data['EOM'])
+    wanted = [si.state_key(state) for state in correlation['states']]
+    missing = si.missing_keys(wanted, index)
+    if len(duplicates) != 0 or len(missing) != 0:
+        raise RuntimeError(
+            f"The {data['basis']} basis has duplicated states: "
+            f"{[si.key_to_str(key) for key in duplicates]}, "
+            f"and is missing states: "
+            f"{[si.key_to_str(key) for key in missing]}.")
+    energies = [data['cc_correlation']] + [
+        index[key]['correlation'] for key in wanted]
+
+    statistics = extrapolation.inverse_cube_statistics(
+        [n], np.array([energies]))
+    correlation['count'] += statistics['count']
+    correlation['sx'] += statistics['sx']
+    correlation['sxx'] += statistics['sxx']
+
+    zetas = correlation['last zetas']
+    order = np.argsort(zetas + [n], kind='stable')[-2:]
+    correlation['last zetas'] = [(zetas + [n])[i] for i in order]
+    for one, energy, sy, sxy in zip(series, energies, statistics['sy'],
+                                    statistics['sxy']):
+        one['sy'] += float(sy)
+        one['sxy'] += float(sxy)
+        last = one['last'] + [energy]
+        one['last'] = [last[i] for i in order]
+
+
+def fold_in(state, data):
+    """
+    Folds a single basis-set entry into the state. Returns the names of the
+    updated extrapolations: 'scf' and/or 'correlation'.
+    """
+    basis = data['basis']
+    if basis in state['bases']:
+        raise RuntimeError(
+            f"The {basis} basis is already in the state; rebuild the state"
+            " with `init` to replace its energies.")
+
+    if 'calclevel' in data:
+        if state['calclevel'] is None:
+            state['calclevel'] = data['calclevel']
+        elif state['calclevel'] != data['calclevel']:
+            raise RuntimeError("Data set contains varying CC level: "
+                               f"{state['calclevel']}, and"
+                               f" {data['calclevel']}")
+
+    add_correlation_energies([data])
+    n = basis2n[basis]
+    state['bases'] += [basis]
+    scf_points = state['scf'] + [[n, data['scf']]]
+    state['scf'] = _keep_largest(
+        scf_points, 3 if state['use_best'] is True else None)
+    updated = ['scf']
+
+    if 'cc_correlation' in data:
+        if state['correlation'] is None:
+            state['correlation'] = _new_correlation(data['EOM'])
+        _fold_correlation(state['correlation'], n, data)
+        updated += ['correlation']
+
+    return updated
+
+
+def _correlation_parameters(correlation, series, use_best: bool):
+    if use_best is True:
+        data_n = correlation['last zetas']
+        data_e = np.array([one['last'] for one in series]).T
+        parameters, _ = extrapolation.fit_inverse_cube(data_n, data_e)
+        return parameters
+
+    statistics = {
+        'count': correlation['count'],
+        'sx': correlation['sx'],
+        'sxx': correlation['sxx'],
+        'sy': [one['sy'] for one in series],
+        'sxy': [one['sxy'] for one in series],
+    }
+    return extrapolation.fit_inverse_cube_from_statistics(statistics)
+
+
+def scf_limit(state):
+    data_n, data_e = np.array(state['scf']).T
+    parameters, failures = extrapolation.solve_exponential_three_point(
+        data_n, data_e)
+    if len(failures) != 0:
+        raise RuntimeError(f"SCF extrapolation failed: {failures[0]}.")
+
+    if state['use_best'] is False and len(data_n) > 3:
+        parameters, _ = extrapolation.fit_exponential(
+            data_n, data_e, guess_c=parameters[2])
+    return float(parameters[0])
+
+
+def correlation_limits(state):
+    """ Returns the CBS EOM states and the CC correlation limit. """
+    correlation = state['correlation']
+    series = [correlation['cc']] + correlation['states']
+    parameters = _correlation_parameters(
+        correlation, series, state['use_best'])
+    cbs = parameters[0]
+    last = np.array([one['last'][-1] for one in series])
+    error_est = 0.5 * np.abs(cbs - last)
+
+    eom_cbs = list()
+    for column, one in enumerate(correlation['states'], start=1):
+        eom_cbs += [{
+            'irrep': one['irrep'],
+            'model': one['model'],
+            'correlation': float(cbs[column]),
+            'correlation error est': float(error_est[column]),
+        }]
+    return eom_cbs, float(cbs[0])
+
+
+@profiling.timed('fit')
+def refresh(state, updated):
+    """
+    Recomputes the extrapolations listed in `updated` and stores them in
+    the state. Returns the CBS header and EOM states, as printed by
+    `find_cbs.py`.
+    """
+    cbs = state.setdefault('cbs', {
+        'header': {'basis': 'CBS', 'scf': None, 'calclevel': None,
+                   'cc_correlation': None},
+        'EOM': [],
+    })
+    cbs['header']['calclevel'] = state['calclevel']
+    if 'scf' in updated:
+        cbs['header']['scf'] = scf_limit(state)
+
+    if 'correlation' in updated:
+        eom_cbs, cc_correlation = correlation_limits(state)
+        cbs['header']['cc_correlation'] = cc_correlation
+        cbs['EOM'] = eom_cbs
+
+    return cbs['header'], cbs['EOM']
+
+
+def diff_cbs(old, new):
+    """ Lists the CBS values that changed between two `cbs_result`s. """
+    def values(result):
+        header, eom_cbs = result
+        flat = {'scf': header['scf'],
+                'cc_correlation': header['cc_correlation']}
+        flat = {name: value for name, value in flat.items()
+                if value is not None}
+        for state in eom_cbs:
+            key = si.key_to_str(si.state_key(state))
+            flat[key + ' correlation'] = state['correlation']
+        return flat
+
+    old_values = {} if old is None else values(old)
+    changes = list()
+    for name, value in values(new).items():
+        previous = old_values.get(name)
+        if previous == value:
+            continue
+        change = None if previous is None else value - previous
+        changes += [{'name': name, 'old': previous, 'new': value,
+                     'change': change}]
+    return changes
+
+
+def save_state(state, file_name):
+    with open(file_name, 'w') as state_json:
+        json.dump(state, state_json)
+
+
+@profiling.profiled('incremental')
+def main():
+    args = get_args()
+    if args.command == 'init':
+        dataset, _ = get_dataset(args.ab_initio)
+        state = new_state(use_best=not args.use_all)
+        old = None
+        for data in dataset:
+            fold_in(state, data)
+        new = refresh(state, ['scf', 'correlation'])
+    else:
+        with open(args.state) as state_json:
+            state = json.load(state_json)
+        header, eom_cbs = state['cbs']['header'], state['cbs']['EOM']
+        old = (dict(header), list(eom_cbs))
+        updated = set()
+        for data in records.iter_records(args.new):
+            updated.update(fold_in(state, data))
+        new = refresh(state, updated)
+
+    with profiling.stage('serialize'):
+        save_state(state, args.state)
+        if args.output is not None:
+            with open(args.output, 'w') as cbs_json:
+                records.write_group(*new, file=cbs_json)
+
+    print(json.dumps(diff_cbs(old, new)))
+    return 0
+
+
+if __name__ == "__main__":
+    main()
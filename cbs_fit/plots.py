@@ -0,0 +1,118 @@
+"""
+Non-interactive rendering of the fitting diagnostics.
+
+The fitting functions of `find_cbs.py` describe each plot as a job
+    (kind, name, arguments)
+where `kind` is 'scf' or 'correlation' and `arguments` are passed to
+`fit_scf.plot_SCF_fitting_result` or `fit_correlation.plot_fit_results`.
+The jobs are rendered to files with the Agg backend in a process pool.
+
+Matplotlib is imported only by the worker processes, so a run that skips the
+plots never loads it.
+"""
+
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+# 'show' opens the interactive windows; the remaining modes write files
+PLOT_MODES = ('show', 'png', 'pdf', 'multipage', 'none')
+MULTIPAGE_FILE = 'fits.pdf'
+
+
+def scf_job(data_n, data_e, fit_parameters, basis_str: str = ""):
+    arguments = (list(data_n), list(data_e), list(fit_parameters), basis_str)
+    return ('scf', 'scf', arguments)
+
+
+def correlation_job(data_n, data_e, fit_parameters, title_extra: str = "",
+                    basis_str: str = ""):
+    arguments = (list(data_n), list(data_e), list(fit_parameters),
+                 title_extra, basis_str)
+    name = 'correlation'
+    if title_extra != "":
+        name += '_' + title_extra
+    return ('correlation', name, arguments)
+
+
+def file_name(job, extension: str):
+    """ A file system-safe name of the plot. """
+    _, name, _ = job
+    return re.sub(r'[^A-Za-z0-9.+-]+', '_', name) + '.' + extension
+
+
+def _use_agg():
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+def _draw(job):
+    kind, _, arguments = job
+    if kind == 'scf':
+        import fit_scf
+        return fit_scf.plot_SCF_fitting_result(*arguments)
+
+    if kind == 'correlation':
+        import fit_correlation
+        return fit_correlation.plot_fit_results(*arguments)
+
+    raise RuntimeError(f"Unknown plot kind: {kind}")
+
+
+def _render_to_file(job, path: str):
+    import matplotlib.pyplot as plt
+
+    figure = _draw(job)
+    figure.savefig(path)
+    plt.close(figure)
+    return path
+
+
+def _render_multipage(jobs, path: str):
+    import matplotlib.pyplot as plt
+    from matplotlib.backends.backend_pdf import PdfPages
+
+    with PdfPages(path) as pdf:
+        for job in jobs:
+            figure = _draw(job)
+            pdf.savefig(figure)
+            plt.close(figure)
+    return path
+
+
+def start_rendering(jobs, mode: str, plot_dir: str, workers=None):
+    """
+    Submits the jobs to a process pool and returns immediately. Call
+    `finish_rendering` on the returned handle to wait for the files.
+
+    A single multi-page PDF cannot be written in parallel; in the
+    'multipage' mode one worker renders all the pages.
+    """
+    if mode not in ('png', 'pdf', 'multipage'):
+        raise RuntimeError(f"Plot mode {mode} does not write files.")
+
+    os.makedirs(plot_dir, exist_ok=True)
+    if mode == 'multipage':
+        workers = 1
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=_use_agg)
+
+    if mode == 'multipage':
+        path = os.path.join(plot_dir, MULTIPAGE_FILE)
+        futures = [executor.submit(_render_multipage, jobs, path)]
+    else:
+        futures = [
+            executor.submit(
+                _render_to_file, job,
+                os.path.join(plot_dir, file_name(job, mode)))
+            for job in jobs
+        ]
+
+    return executor, futures
+
+
+def finish_rendering(handle):
+    """ Waits for the rendering and returns the paths of the written files. """
+    executor, futures = handle
+    paths = [future.result() for future in futures]
+    executor.shutdown()
+    return paths
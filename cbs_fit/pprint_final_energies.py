@@ -1,13 +1,19 @@
 #!/usr/bin/env python3
 
 import argparse
-import json
-from turn_cbs_into_xsim_input import prepare_xsim_input
-from find_cbs import basis2n
-
-ha2eV = 27.211386245988
-eV2cm = 8065.543937
-ha2cm = ha2eV * eV2cm
+import sys
+import worker_client
+if __name__ == "__main__":
+    # Forward to the warm server before the heavy imports
+    worker_client.forward('pprint_final_energies')
+import numpy as np  # noqa: E402
+from columnar import ColumnarDataset, to_xsim  # noqa: E402
+import container  # noqa: E402
+import profiling  # noqa: E402
+import records  # noqa: E402
+import state_index as si  # noqa: E402
+from core import basis2n, ha2eV  # noqa: E402
+from turn_cbs_into_xsim_input import iter_xsim_states  # noqa: E402
 
 
 def get_args():
@@ -16,9 +22,9 @@ def get_args():
         "together with half of the CBS–last-ab-initio difference.")
 
     parser.add_argument(
-        'ab_initio', help="JSON file with ab initio energies for each "
-        "basis set.")
-    parser.add_argument('cbs', help="JSON file with CBS energies.")
+        'ab_initio', help="JSON or NDJSON file with ab initio energies for"
+        " each basis set.")
+    parser.add_argument('cbs', help="JSON or NDJSON file with CBS energies.")
     parser.add_argument(
         '-x', '--xsim',
         help="Print output as a `better energies` input for xsim.",
@@ -27,7 +33,16 @@ def get_args():
         '-s', '--summary',
         help="Print output to standard output.",
         action='store_true', default=False)
+    parser.add_argument(
+        '--ndjson',
+        help="Print the xsim output with one state per line (NDJSON).",
+        action='store_true', default=False)
+    parser.add_argument(
+        '-o', '--binary', default=None, metavar='FILE',
+        help="Save the xsim output to FILE in the binary container format"
+        " (see container.py) instead of printing it.")
 
+    profiling.add_arguments(parser)
     args = parser.parse_args()
     return args
 
@@ -54,95 +69,102 @@ def flip_data_to_xsim_like(dataset):
     ```
     """
 
+    dataset = ColumnarDataset.from_records(dataset)
+    if not np.all(dataset.has_cc):
+        raise RuntimeError(
+            "Some entries are missing the 'cc_energy' value. Most likely"
+            " you used the SCF at a basis where CC is not possible. Remove"
+            " the extra point from the ab initio json file."
+        )
+
+    transition = dataset.transition
     basis_data = list()
-    for data in dataset:
-        if 'cc_energy' not in data:
-            raise RuntimeError(
-                "Some entries are missing the 'cc_energy' value. Most likely"
-                " you used the SCF at a basis where CC is not possible. Remove"
-                " the extra point from the ab initio json file."
-            )
-        cc_energy = data['cc_energy']
-        eom_states = list()
-        for state in data['EOM']:
-            e_total_au = state['energy']
-            e_eom_au = e_total_au - cc_energy
-            ready_state = {
-                'irrep': state['irrep'],
-                'model': state['model'],
-                'energy': {
-                    'transition': {
-                        'au': e_eom_au,
-                        'eV': e_eom_au * ha2eV,
-                    },
-                },
-            }
-            eom_states += [ready_state]
+    for row, basis in enumerate(dataset.basis):
+        present = ~np.isnan(transition[row])
         outpack = {
-            'basis': data['basis'],
-            'cc_energy': cc_energy,
-            'EOM': eom_states,
+            'basis': basis,
+            'cc_energy': float(dataset.cc_energy[row]),
+            'EOM': to_xsim(dataset.states.take(present),
+                           transition[row, present]),
         }
         basis_data += [outpack]
 
     return basis_data
 
 
-def states_match(foo, bar):
+def get_best_basis_data(file_name):
     """
-    Compares if the two dictionaries talk about the same state.
+    Streams the ab initio data set and returns the `flip_data_to_xsim_like`
+    entry of the largest basis set. Only one basis set is kept in memory.
     """
-    if foo['irrep'] != bar['irrep']:
-        return False
+    best = None
+    for data in records.iter_records(file_name):
+        basis_data = flip_data_to_xsim_like([data])[0]
+        if best is None or basis2n[basis_data['basis']] >= \
+                basis2n[best['basis']]:
+            best = basis_data
 
-    if foo['model'] != bar['model']:
-        return False
-
-    return True
+    return best
 
 
+@profiling.profiled('pprint_final_energies')
 def main():
     args = get_args()
-    with open(args.ab_initio) as ai_json:
-        dataset = json.load(ai_json)
-
-    with open(args.cbs) as cbs_json:
-        cbs = json.load(cbs_json)
-
-    cbs_final = prepare_xsim_input(cbs)
-    basis_data = flip_data_to_xsim_like(dataset)
-    basis_data.sort(key=lambda x: basis2n[x['basis']])
-    best_ab_initio = basis_data[-1]['EOM']
-
+    with profiling.stage('load'):
+        best_ab_initio = get_best_basis_data(args.ab_initio)['EOM']
+
+        cbs_header, cbs_states = records.read_group(args.cbs)
+        cbs_final = iter_xsim_states(cbs_header, cbs_states)
+
+        cbs_index, duplicates = si.index_states(cbs_final)
+    for key in duplicates:
+        print(f"Warning! Duplicated CBS state {si.key_to_str(key)}.",
+              file=sys.stderr)
+    ai_keys = [si.state_key(ai_state) for ai_state in best_ab_initio]
+    for key in si.missing_keys(ai_keys, cbs_index):
+        print(f"Warning! No CBS data for the state {si.key_to_str(key)}.",
+              file=sys.stderr)
+
+    # Level of the Monte Carlo intervals, if any; see uncertainty.py
+    level = cbs_header.get('ci', {}).get('level', 0.0)
     better_energies = []
     string_out = ""
-    for ai_state in best_ab_initio:
-        for cbs_state in cbs_final:
-            if not states_match(ai_state, cbs_state):
-                continue
-            name = str(cbs_state['irrep']['energy #'])
-            name += cbs_state['irrep']['name']
-            ecbs = cbs_state['energy']['transition']['eV']
-            eai = ai_state['energy']['transition']['eV']
-            error_est = 0.5 * abs(eai - ecbs)
-            string_out += f"{name:4} = {ecbs:6.3f} ± {error_est:5.3f} eV\n"
-            state = {
-                "irrep": cbs_state['irrep'],
-                "eom model": cbs_state['model'],
-                "energy": {
-                    "transition": {
-                        "eV": ecbs,
-                        "au": ecbs / ha2eV,
-                    },
+    for key, ai_state in zip(ai_keys, best_ab_initio):
+        if key not in cbs_index:
+            continue
+        cbs_state = cbs_index[key]
+        name = str(cbs_state['irrep']['energy #'])
+        name += cbs_state['irrep']['name']
+        ecbs = cbs_state['energy']['transition']['eV']
+        eai = ai_state['energy']['transition']['eV']
+        error_est = 0.5 * abs(eai - ecbs)
+        string_out += f"{name:4} = {ecbs:6.3f} ± {error_est:5.3f} eV"
+        state = {
+            "irrep": cbs_state['irrep'],
+            "eom model": cbs_state['model'],
+            "energy": {
+                "transition": {
+                    "eV": ecbs,
+                    "au": ecbs / ha2eV,
                 },
-            }
-            better_energies += [state]
-
-    if args.summary is True:
-        print(string_out)
-
-    if args.xsim is True:
-        print(json.dumps(better_energies))
+            },
+        }
+        if 'ci' in cbs_state['energy']:
+            ci = cbs_state['energy']['ci']
+            string_out += f"  {level:.0%} CI [{ci['eV']['low']:6.3f},"\
+                f" {ci['eV']['high']:6.3f}]"
+            state['energy']['ci'] = ci
+        string_out += "\n"
+        better_energies += [state]
+
+    with profiling.stage('serialize'):
+        if args.summary is True:
+            print(string_out)
+
+        if args.binary is not None:
+            container.save_group(args.binary, None, better_energies)
+        elif args.xsim is True:
+            records.write_list(better_energies, ndjson=args.ndjson)
 
     return 0
 
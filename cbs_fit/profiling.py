@@ -0,0 +1,189 @@
+"""
+Stage-level profiling of the command line tools.
+
+Every tool accepts
+    --profile FILE      a JSON report of the run; '-' prints it to stderr,
+    --cprofile FILE     the cProfile statistics (`python -m pstats FILE`).
+The report lists every stage, e.g., load, sort, fit, plot, serialize, with
+the number of calls, the wall time, and the peak memory traced with
+`tracemalloc`. Stages nest: a fit inside the 'fit scf' stage is reported as
+'fit scf/exponential fit'. The work done by the process pools (plot files,
+`batch_cbs.py`) is measured only as the wall time of the waiting stage.
+
+The stages are marked with
+    with profiling.stage('load'):
+        ...
+or with the `timed` decorator. Without the options no profile is active and
+a stage costs one function call.
+
+Only the standard library is imported here.
+"""
+
+import argparse
+import contextlib
+import cProfile
+import functools
+import json
+import pstats
+import resource
+import sys
+import time
+import tracemalloc
+
+# The profile of the running tool; None when profiling is off
+_active = None
+_NULL_STAGE = contextlib.nullcontext()
+TOP_FUNCTIONS = 25
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """ Adds the --profile and --cprofile options to the tool's parser. """
+    group = parser.add_argument_group('profiling')
+    group.add_argument(
+        '--profile', default=None, metavar='FILE',
+        help="Save a JSON report with the time, calls, and peak memory of"
+        " every stage to FILE; '-' prints it to stderr.")
+    group.add_argument(
+        '--cprofile', default=None, metavar='FILE',
+        help="Run under cProfile and save its statistics to FILE.")
+
+
+def _options(argv):
+    parser = argparse.ArgumentParser(add_help=False, allow_abbrev=False)
+    add_arguments(parser)
+    options, _ = parser.parse_known_args(argv)
+    return options
+
+
+class Profile:
+    def __init__(self):
+        self.stages = dict()
+        self.stack = list()
+        self.start = time.perf_counter()
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        path = name if len(self.stack) == 0 else \
+            self.stack[-1]['path'] + '/' + name
+        current, peak = tracemalloc.get_traced_memory()
+        if len(self.stack) != 0:
+            # The parent's peak would be lost by the reset below
+            self.stack[-1]['peak'] = max(self.stack[-1]['peak'], peak)
+        tracemalloc.reset_peak()
+        frame = {'path': path, 'current': current, 'peak': current}
+        self.stack.append(frame)
+        # Created on entry, so the stages are listed in the order they start
+        entry = self.stages.setdefault(
+            path, {'calls': 0, 'seconds': 0.0, 'peak MiB': 0.0})
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.stack.pop()
+            peak = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+            if len(self.stack) != 0:
+                self.stack[-1]['peak'] = max(self.stack[-1]['peak'], peak)
+            entry['calls'] += 1
+            entry['seconds'] += seconds
+            entry['peak MiB'] = max(entry['peak MiB'],
+                                    (peak - frame['current']) / 2**20)
+
+    def report(self, tool: str, argv):
+        _, peak = tracemalloc.get_traced_memory()
+        return {
+            'tool': tool,
+            'argv': list(argv),
+            'seconds': time.perf_counter() - self.start,
+            'peak MiB': peak / 2**20,
+            # Linux reports the maximum resident set size in KiB
+            'max RSS MiB': resource.getrusage(
+                resource.RUSAGE_SELF).ru_maxrss / 2**10,
+            'stages': self.stages,
+        }
+
+
+def stage(name: str):
+    """ A context manager that records the enclosed code as a stage. """
+    if _active is None:
+        return _NULL_STAGE
+    return _active.stage(name)
+
+
+def timed(name: str):
+    """ Records every call of the decorated function as a stage. """
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _active is None:
+                return function(*args, **kwargs)
+            with _active.stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def top_functions(profiler: cProfile.Profile, count: int = TOP_FUNCTIONS):
+    """ The functions with the longest cumulative time. """
+    statistics = pstats.Stats(profiler).stats
+    rows = sorted(statistics.items(), key=lambda item: item[1][3],
+                  reverse=True)[:count]
+    return [
+        {
+            'function': f"{file_name}:{line}({function})",
+            'calls': calls,
+            'seconds': total,
+            'cumulative seconds': cumulative,
+        }
+        for (file_name, line, function), (_, calls, total, cumulative, _)
+        in rows
+    ]
+
+
+def write_report(report, file_name):
+    if file_name == '-':
+        sys.stderr.write(json.dumps(report, indent=2) + "\n")
+        return
+    with open(file_name, 'w') as report_json:
+        json.dump(report, report_json, indent=2)
+
+
+def profiled(tool: str):
+    """
+    Decorates the tool's `main`: with --profile or --cprofile in the
+    command line the main runs under the profile and the report is saved
+    when it returns or fails.
+    """
+    def decorate(main):
+        @functools.wraps(main)
+        def wrapper():
+            options = _options(sys.argv[1:])
+            if options.profile is None and options.cprofile is None:
+                return main()
+
+            global _active
+            argv = sys.argv[1:]
+            tracing = tracemalloc.is_tracing()
+            if not tracing:
+                tracemalloc.start()
+            _active = Profile()
+            profiler = None
+            if options.cprofile is not None:
+                profiler = cProfile.Profile()
+                profiler.enable()
+            try:
+                return main()
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+                    profiler.dump_stats(options.cprofile)
+                report = _active.report(tool, argv)
+                _active = None
+                if not tracing:
+                    tracemalloc.stop()
+                if profiler is not None:
+                    report['cprofile'] = top_functions(profiler)
+                if options.profile is not None:
+                    write_report(report, options.profile)
+        return wrapper
+    return decorate
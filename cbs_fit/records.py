@@ -0,0 +1,134 @@
+"""
+Reading and writing the JSON documents as streams of records.
+
+Every tool accepts either a regular JSON document or NDJSON, i.e., one JSON
+record per line; the format is detected from the first line. The NDJSON
+layouts are:
+    - ab initio data set: one basis-set record per line,
+    - CBS result or a single-basis ab initio file: a header line without
+      the 'EOM' list followed by one line per EOM state,
+    - xsim's 'better energies': one state per line.
+A document that contains the 'EOM' list is read as its header followed by
+the states, so both formats look the same to the tools. The binary
+containers of `container.py` are recognized by their first bytes and read
+the same way, and so are the queries of the SQLite store, e.g.,
+'results.db#system=water&calclevel=CCSD' (see `store.py`).
+"""
+
+import itertools
+import json
+import sys
+
+CONTAINER_MAGIC = b'AMBCNT\x00\x01'
+
+
+def is_container(file_name):
+    """ Tells whether the file is a binary container (`container.py`). """
+    if file_name == '-':
+        return False
+    try:
+        with open(file_name, 'rb') as stream:
+            return stream.read(len(CONTAINER_MAGIC)) == CONTAINER_MAGIC
+    except OSError:
+        return False
+
+
+def _open(file_name):
+    if file_name == '-':
+        return sys.stdin
+    return open(file_name)
+
+
+def iter_records(file_name):
+    """
+    Yields the records of a JSON or NDJSON file. The elements of a JSON
+    list are yielded one by one. Use '-' for the standard input.
+    """
+    if is_container(file_name):
+        import container
+        yield from container.load(file_name).iter_records()
+        return
+
+    if '#' in file_name:
+        import store
+        if store.is_store(file_name.partition('#')[0]):
+            yield from store.iter_query(file_name)
+            return
+
+    with _open(file_name) as stream:
+        first_line = stream.readline()
+        try:
+            first = json.loads(first_line)
+        except json.JSONDecodeError:
+            # A multi-line JSON document
+            document = json.loads(first_line + stream.read())
+            if isinstance(document, list):
+                yield from document
+            else:
+                yield document
+            return
+
+        for record in itertools.chain(
+                [first], (json.loads(line) for line in stream
+                          if line.strip() != "")):
+            if isinstance(record, list):
+                yield from record
+            else:
+                yield record
+
+
+def read_group(file_name):
+    """
+    Returns a tuple `(header, states)` where `states` is an iterator over
+    the EOM states and `header` holds the remaining fields, or is None for a
+    bare list of states, e.g., the xsim's 'better energies'.
+    """
+    records = iter_records(file_name)
+    first = next(records, None)
+    if first is None:
+        return None, iter(())
+
+    if 'irrep' in first:
+        return None, itertools.chain([first], records)
+
+    header = dict(first)
+    eom = header.pop('EOM', [])
+    return header, itertools.chain(eom, records)
+
+
+def write_list(items, ndjson: bool = False, file=None):
+    """
+    Writes the items as NDJSON or as a JSON list. The list is written item
+    by item and looks the same as `json.dumps(list(items))`. The file
+    defaults to the current `sys.stdout`.
+    """
+    if file is None:
+        file = sys.stdout
+    if ndjson is True:
+        for item in items:
+            file.write(json.dumps(item) + "\n")
+        return
+
+    separator = "["
+    for item in items:
+        file.write(separator + json.dumps(item))
+        separator = ", "
+    file.write("[]\n" if separator == "[" else "]\n")
+
+
+def write_group(header, states, ndjson: bool = False, file=None):
+    """
+    Writes the header and the EOM states in the NDJSON layout or as a
+    single JSON document with the states in the 'EOM' list. The file
+    defaults to the current `sys.stdout`.
+    """
+    if file is None:
+        file = sys.stdout
+    if ndjson is True:
+        file.write(json.dumps(header) + "\n")
+        write_list(states, ndjson=True, file=file)
+        return
+
+    document = dict(header)
+    document['EOM'] = list(states)
+    file.write(json.dumps(document) + "\n")
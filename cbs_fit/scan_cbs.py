@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+CBS extrapolation of a geometry scan.
+
+The same CBS recipe applied to many displaced geometries. Every geometry has
+its own ab initio data set, e.g., `scan/q01/ccsd+pwCVnZ.json`; all of them
+need the same basis sets and the same EOM states. The energies are stacked
+into arrays
+    SCF                 geometry × basis
+    CC correlation      geometry × basis
+    EOM correlation     geometry × basis × state
+and every kind of series is extrapolated in a single vectorized pass over
+all geometries.
+
+The results are saved as NumPy arrays (.npy) in the output directory,
+described by `scan.json`; `load_scan` maps them back without reading them
+into memory. The xsim's 'better energies' of every geometry are saved in
+`xsim/`, named after the geometry's position in the scan. The geometries
+whose SCF extrapolation failed have no xsim file; `scan.json` lists them
+under 'failures'.
+"""
+
+import argparse
+import json
+import os
+import sys
+import numpy as np
+from batch_cbs import find_datasets
+from columnar import load_dataset, to_xsim
+import fit_correlation as fc
+import fit_scf as fscf
+import profiling
+import records
+import state_index as si
+
+MANIFEST = 'scan.json'
+XSIM_DIRECTORY = 'xsim'
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument(
+        'geometries', nargs='*', default=[],
+        help="Ab initio data sets, one per geometry, or directory trees"
+        " searched for them."
+    )
+    parser.add_argument(
+        '-m', '--manifest', default=None,
+        help="Text file listing the data sets in the scan order, one path per"
+        " line. Empty lines and lines starting with # are skipped."
+    )
+    parser.add_argument(
+        '-p', '--pattern', default='*.json',
+        help="File name pattern of the data sets in the directories."
+        " Default: %(default)s."
+    )
+    parser.add_argument(
+        "-a", "--use_all", default=False, action="store_true",
+        help="Fit using all data points. Default: Fit using minimal number of"
+        " points, i.e., only the largest basis sets."
+    )
+    parser.add_argument(
+        '-o', '--output', default='cbs_scan',
+        help="Output directory. Default: %(default)s."
+    )
+    parser.add_argument(
+        '--ndjson', default=False, action='store_true',
+        help="Save the xsim files with one state per line (NDJSON)."
+    )
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    return args
+
+
+def stack_scan(datasets, names):
+    """
+    Stacks the `columnar.ColumnarDataset`s of the geometries. The states are
+    the ones of the first geometry at its smallest CC basis set. Returns a
+    dict of the arrays and the metadata.
+    """
+    first = datasets[0]
+    cc_rows = first.has_cc
+    cc_first = first.rows(cc_rows)
+    present = ~np.isnan(cc_first.eom[0])
+    states = first.states.take(present)
+    keys = states.keys()
+    if len(states.models) > 1:
+        raise RuntimeError(f"Warning! Varying EOM models:"
+                           f"{states.models[0]} and {states.models[1]}")
+
+    ngeometries = len(datasets)
+    scf = np.empty((ngeometries, len(first.basis)))
+    cc_correlation = np.empty((ngeometries, np.count_nonzero(cc_rows)))
+    eom_correlation = np.empty(cc_correlation.shape + (len(keys),))
+    for geometry, (dataset, name) in enumerate(zip(datasets, names)):
+        if dataset.basis != first.basis or \
+                np.any(dataset.has_cc != cc_rows):
+            raise RuntimeError(
+                f"{name} has the basis sets {dataset.basis}, expected the"
+                f" ones of {names[0]}: {first.basis}.")
+        columns = {key: column
+                   for column, key in enumerate(dataset.states.keys())}
+        absent = [key for key in keys if key not in columns]
+        correlation = dataset.rows(cc_rows).eom_correlation[
+            :, [columns.get(key, 0) for key in keys]]
+        absent += [keys[column] for column in np.flatnonzero(
+            np.any(np.isnan(correlation), axis=0))]
+        if len(absent) != 0:
+            raise RuntimeError(
+                f"{name} is missing states: "
+                f"{[si.key_to_str(key) for key in absent]}.")
+
+        scf[geometry] = dataset.scf
+        cc_correlation[geometry] = dataset.rows(cc_rows).cc_correlation
+        eom_correlation[geometry] = correlation
+
+    return {
+        'geometries': list(names),
+        'basis': first.basis,
+        'zetas': first.zetas,
+        'cc rows': cc_rows,
+        'calclevel': first.calclevel,
+        'states': states,
+        'scf': scf,
+        'cc_correlation': cc_correlation,
+        'eom_correlation': eom_correlation,
+    }
+
+
+def extrapolate_scan(scan, use_best: bool = True):
+    """
+    Extrapolates all geometries at once. Returns a dict with the CBS arrays
+    (geometry, or geometry × state) and the SCF failures per geometry.
+    """
+    zetas = scan['zetas']
+    scf_parameters, scf_failures = fscf.fit_many_scf_to_exp_model(
+        zetas, scan['scf'].T, use_best=use_best)
+
+    # The CC correlation is the state 0 of every geometry
+    correlation = np.concatenate(
+        [scan['cc_correlation'][:, :, np.newaxis], scan['eom_correlation']],
+        axis=2)
+    ngeometries, nbasis, nseries = correlation.shape
+    parameters = fc.fit_many_to_cubic_model(
+        zetas[scan['cc rows']],
+        np.moveaxis(correlation, 1, 0).reshape(nbasis, -1),
+        use_best=use_best)
+    correlation_cbs = parameters[0].reshape(ngeometries, nseries)
+    error_est = 0.5 * np.abs(correlation_cbs - correlation[:, -1, :])
+
+    return {
+        'scf': scf_parameters[0],
+        'cc_correlation': correlation_cbs[:, 0],
+        'cc_correlation_error_est': error_est[:, 0],
+        'eom_correlation': correlation_cbs[:, 1:],
+        'eom_correlation_error_est': error_est[:, 1:],
+        'transition': correlation_cbs[:, 1:] - correlation_cbs[:, :1],
+        'failures': scf_failures,
+    }
+
+
+def save_array(directory, name, array):
+    """ Writes the array to a .npy file through a memory map. """
+    file_name = name + '.npy'
+    mapped = np.lib.format.open_memmap(
+        os.path.join(directory, file_name), mode='w+', dtype=float,
+        shape=array.shape)
+    mapped[...] = array
+    mapped.flush()
+    return file_name
+
+
+def save_scan(directory, scan, cbs, use_best: bool, ndjson: bool = False):
+    """ Saves the arrays, `scan.json`, and the xsim files. """
+    os.makedirs(os.path.join(directory, XSIM_DIRECTORY), exist_ok=True)
+    arrays = {
+        'scf ab initio': scan['scf'],
+        'cc_correlation ab initio': scan['cc_correlation'],
+        'eom_correlation ab initio': scan['eom_correlation'],
+    }
+    arrays.update({name: values for name, values in cbs.items()
+                   if name != 'failures'})
+    files = {name: save_array(directory, name.replace(' ', '_'), values)
+             for name, values in arrays.items()}
+
+    extension = '.ndjson' if ndjson else '.json'
+    width = len(str(len(scan['geometries'])))
+    xsim_files = list()
+    for geometry, transition in enumerate(cbs['transition']):
+        if geometry in cbs['failures']:
+            continue
+        file_name = os.path.join(
+            XSIM_DIRECTORY, f"{geometry:0{width}d}{extension}")
+        xsim_files += [file_name]
+        with open(os.path.join(directory, file_name), 'w') as xsim:
+            records.write_list(to_xsim(scan['states'], transition),
+                               ndjson=ndjson, file=xsim)
+
+    manifest = {
+        'geometries': scan['geometries'],
+        'xsim': xsim_files,
+        'basis': scan['basis'],
+        'cc basis': [basis for basis, keep in
+                     zip(scan['basis'], scan['cc rows']) if keep],
+        'calclevel': scan['calclevel'],
+        'use_best': use_best,
+        'states': scan['states'].to_dicts(),
+        'failures': {scan['geometries'][geometry]: reason
+                     for geometry, reason in cbs['failures'].items()},
+        'arrays': files,
+    }
+    with open(os.path.join(directory, MANIFEST), 'w') as manifest_json:
+        json.dump(manifest, manifest_json, indent=2)
+
+
+def load_scan(directory):
+    """
+    Returns the `scan.json` manifest and the dict of its arrays, mapped
+    read-only from the .npy files.
+    """
+    with open(os.path.join(directory, MANIFEST)) as manifest_json:
+        manifest = json.load(manifest_json)
+    arrays = {name: np.load(os.path.join(directory, file_name),
+                            mmap_mode='r')
+              for name, file_name in manifest['arrays'].items()}
+    return manifest, arrays
+
+
+@profiling.profiled('scan_cbs')
+def main():
+    args = get_args()
+    names = find_datasets(args.geometries, args.pattern, args.manifest)
+    output = os.path.abspath(args.output) + os.sep
+    names = [name for name in names
+             if not os.path.abspath(name).startswith(output)]
+    if len(names) == 0:
+        print("Error! No data sets found.", file=sys.stderr)
+        return 1
+
+    datasets = [load_dataset(name) for name in names]
+    with profiling.stage('stack'):
+        scan = stack_scan(datasets, names)
+    use_best = not args.use_all
+    with profiling.stage('fit'):
+        cbs = extrapolate_scan(scan, use_best=use_best)
+    for geometry, reason in cbs['failures'].items():
+        print(f"Warning! SCF extrapolation failed for {names[geometry]}:"
+              f" {reason}", file=sys.stderr)
+
+    with profiling.stage('serialize'):
+        save_scan(args.output, scan, cbs, use_best, ndjson=args.ndjson)
+    print(f"Extrapolated {len(names)} geometries and {len(scan['states'])}"
+          f" states. Results saved in {args.output}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
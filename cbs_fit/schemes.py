@@ -0,0 +1,150 @@
+r"""
+Registry of the CBS extrapolation schemes.
+
+Correlation energy
+    helgaker        E = E _\infty - b / n ** 3
+    power           E = E _\infty - b / n ** alpha, alpha chosen freely
+    martin          E = E _\infty - b / (n + 1/2) ** 4
+    schwenke        E _\infty = E _X + F (E _Y - E _X), the two largest
+                    basis sets X < Y
+SCF energy
+    exponential     E = E _\infty - b e ^{-c n} (`fit_scf.py`)
+    karton-martin   E = E _\infty - b (n + 1) e ^{-9 \sqrt{n}}
+
+The Schwenke factors F are fitted to reference data for a given basis set
+family and method and are not included here. Pass the factor that matches
+your data; without it F = Y^3 / (Y^3 - X^3), the value that makes the
+scheme identical to the two-point `helgaker` one.
+
+All schemes but the exponential one are linear in (E _\infty, b). The linear
+schemes that use the same points are fitted together: their decays are
+stacked side by side and a single least-squares pass of
+`extrapolation.fit_linear_decay` covers all the schemes and all the series,
+e.g., all the EOM states. The zetas are the `core.basis2n` values.
+"""
+
+from dataclasses import dataclass
+from typing import Callable
+import numpy as np
+import extrapolation
+import fit_scf as fscf
+
+SCF = 'scf'
+CORRELATION = 'correlation'
+
+
+@dataclass(frozen=True)
+class Scheme:
+    name: str
+    component: str
+    formula: str
+    # f(n) of E = E _\infty - b f(n) evaluated at the zetas of the points
+    decay: Callable | None = None
+    # Number of the largest basis sets used, the minimum for the
+    # exponential; None: two or, with use_all, every basis set
+    points: int | None = None
+
+
+def power_scheme(alpha: float):
+    return Scheme(f'power {alpha:g}', CORRELATION, f'n^-{alpha:g}',
+                  lambda n: n ** -alpha)
+
+
+def schwenke_scheme(factor: float | None = None):
+    def decay(n):
+        x, y = n
+        f = y**3 / (y**3 - x**3) if factor is None else factor
+        # E _\infty = E _Y + (F - 1) (E _Y - E _X) is the exact two-point
+        # line through f(X) = F and f(Y) = F - 1
+        return np.array([f, f - 1.0])
+
+    label = 'n^-3 equivalent' if factor is None else f'{factor:g}'
+    return Scheme('schwenke', CORRELATION, f'E_X + F (E_Y - E_X), F {label}',
+                  decay, points=2)
+
+
+SCHEMES = {
+    scheme.name: scheme for scheme in (
+        Scheme('helgaker', CORRELATION, 'n^-3', lambda n: n ** -3.0),
+        Scheme('martin', CORRELATION, '(n + 1/2)^-4',
+               lambda n: (n + 0.5) ** -4.0),
+        schwenke_scheme(),
+        Scheme('exponential', SCF, 'exp(-c n)', points=3),
+        Scheme('karton-martin', SCF, '(n + 1) exp(-9 sqrt(n))',
+               lambda n: (n + 1.0) * np.exp(-9.0 * np.sqrt(n)), points=2),
+    )
+}
+# `power` is a family; see `power_scheme`
+SCHEME_NAMES = {
+    SCF: [name for name, scheme in SCHEMES.items()
+          if scheme.component == SCF],
+    CORRELATION: ['helgaker', 'power', 'martin', 'schwenke'],
+}
+
+
+def select(names, alphas=(), schwenke_factor: float | None = None):
+    """ Schemes of the names; 'power' gives one scheme per alpha. """
+    schemes = list()
+    for name in names:
+        if name == 'power':
+            schemes += [power_scheme(alpha) for alpha in alphas]
+        elif name == 'schwenke':
+            schemes += [schwenke_scheme(schwenke_factor)]
+        elif name in SCHEMES:
+            schemes += [SCHEMES[name]]
+        else:
+            raise RuntimeError(f"Unknown extrapolation scheme {name}.")
+    return schemes
+
+
+def number_of_points(scheme: Scheme, nbasis: int, use_best: bool):
+    if scheme.points is not None:
+        return scheme.points
+    return 2 if use_best else nbasis
+
+
+def evaluate(schemes, zetas, energies, use_best: bool = True):
+    r"""
+    Extrapolates every column of the (basis × series) `energies` with every
+    scheme. Returns a dict scheme name → (series) array of E _\infty and a
+    dict of the skipped schemes with the reasons.
+    """
+    zetas = np.asarray(zetas, dtype=float)
+    energies = np.asarray(energies, dtype=float)
+    nbasis, nseries = energies.shape
+    results = dict()
+    skipped = dict()
+
+    groups = dict()
+    for scheme in schemes:
+        npoints = number_of_points(scheme, nbasis, use_best)
+        if npoints > nbasis:
+            skipped[scheme.name] = f"needs {npoints} basis sets"
+        elif scheme.decay is None:
+            groups.setdefault('nonlinear', []).append(scheme)
+        else:
+            groups.setdefault(npoints, []).append(scheme)
+
+    for scheme in groups.pop('nonlinear', []):
+        if scheme.name != 'exponential':
+            raise RuntimeError(f"No solver for the scheme {scheme.name}.")
+        parameters, failures = fscf.fit_many_scf_to_exp_model(
+            zetas, energies, use_best=use_best)
+        results[scheme.name] = parameters[0]
+        if len(failures) != 0:
+            skipped[scheme.name] = f"failed for {len(failures)} series"
+
+    for npoints, group in groups.items():
+        n = zetas[-npoints:]
+        decay = np.repeat(np.column_stack([scheme.decay(n)
+                                           for scheme in group]),
+                          nseries, axis=1)
+        parameters, _ = extrapolation.fit_linear_decay(
+            decay, np.tile(energies[-npoints:], len(group)))
+        for position, scheme in enumerate(group):
+            results[scheme.name] = \
+                parameters[0, position * nseries:(position + 1) * nseries]
+
+    ordered = {scheme.name: results[scheme.name] for scheme in schemes
+               if scheme.name in results}
+    return ordered, skipped
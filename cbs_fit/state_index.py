@@ -0,0 +1,50 @@
+"""
+Hash-based lookup of EOM states.
+
+A state is identified by the key
+    (energy #, irrep name, model)
+built from the usual state dictionary
+    {'irrep': {'energy #': int(), 'name': str()}, 'model': str(), ...}
+
+Some tools compare states computed with different models, e.g., EOM-CCSD
+and EOM-CCSDT states for the ΔT correction. Those tools build the keys with
+`model_key=None`, which puts None in place of the model.
+"""
+
+
+def state_key(state, model_key: str | None = 'model'):
+    irrep = state['irrep']
+    model = None if model_key is None else state[model_key]
+    return (irrep['energy #'], irrep['name'], model)
+
+
+def key_to_str(key):
+    """ Short label of the state, e.g. `2B1`. """
+    return f"{key[0]}{key[1]}"
+
+
+def index_states(states, model_key: str | None = 'model'):
+    """
+    Returns a tuple `(index, duplicates)` where `index` maps the state key to
+    the state and `duplicates` lists keys that appear more than once. For
+    duplicated keys the index keeps the first state.
+    """
+    index = dict()
+    duplicates = list()
+    for state in states:
+        key = state_key(state, model_key)
+        if key in index:
+            duplicates += [key]
+            continue
+        index[key] = state
+
+    return index, duplicates
+
+
+def missing_keys(wanted, index):
+    """
+    Returns the keys from `wanted` that are absent from `index`; a single
+    set difference, ordered as in `wanted`.
+    """
+    missing = set(wanted).difference(index)
+    return [key for key in wanted if key in missing]
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""
+Local SQLite store of the ab initio and CBS energies.
+
+Every basis-set record, i.e., an entry of the ab initio data set or a CBS
+result (basis 'CBS'), is a row of `calculations` identified by
+    (system, basis, calclevel)
+and its EOM states are rows of `states` identified by
+    (calculation, model, energy #, irrep).
+Both tables are indexed, so a query such as all CCSDT states of a molecule
+across the basis sets reads only the matching rows.
+
+The tools read the store through a query appended to its path after '#':
+    ./find_cbs.py 'results.db#system=water&calclevel=CCSD'
+    ../dT/pprint_dT.py 'results.db#system=water&calclevel=CCSDT&basis=ANO1' \
+        'results.db#system=water&calclevel=CCSD&basis=ANO1'
+The keys are system, calclevel, basis, model (of the EOM states), and kind:
+'abinitio' (the default), 'cbs', or 'all'. Unless a basis is given, the
+queries read only the ab initio calculations, so the CBS results of the same
+level do not end up in the data set of `find_cbs.py`. The matching
+calculations come out in the JSON shapes of the files they were imported
+from.
+"""
+
+import argparse
+import sqlite3
+import sys
+from urllib.parse import parse_qsl
+import profiling
+import records
+
+SQLITE_MAGIC = b'SQLite format 3\x00'
+QUERY_KEYS = ('system', 'calclevel', 'basis', 'model', 'kind')
+KINDS = ('abinitio', 'cbs', 'all')
+CBS_BASIS = 'CBS'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS calculations (
+    id INTEGER PRIMARY KEY,
+    system TEXT NOT NULL,
+    basis TEXT NOT NULL,
+    calclevel TEXT NOT NULL,
+    scf REAL,
+    cc_energy REAL,
+    cc_correlation REAL,
+    UNIQUE (system, calclevel, basis)
+);
+CREATE TABLE IF NOT EXISTS states (
+    calculation INTEGER NOT NULL
+        REFERENCES calculations (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    model TEXT NOT NULL,
+    number INTEGER NOT NULL,
+    irrep TEXT NOT NULL,
+    energy REAL,
+    correlation REAL,
+    correlation_error_est REAL,
+    PRIMARY KEY (calculation, model, number, irrep)
+);
+CREATE INDEX IF NOT EXISTS states_by_state
+    ON states (model, irrep, number);
+CREATE INDEX IF NOT EXISTS calculations_by_basis
+    ON calculations (system, basis);
+"""
+
+# (column, key in the JSON record)
+HEADER_COLUMNS = (
+    ('scf', 'scf'),
+    ('cc_energy', 'cc_energy'),
+    ('cc_correlation', 'cc_correlation'),
+)
+STATE_COLUMNS = (
+    ('energy', 'energy'),
+    ('correlation', 'correlation'),
+    ('correlation_error_est', 'correlation error est'),
+)
+
+
+def is_store(file_name):
+    """ Tells whether the file is an SQLite database. """
+    try:
+        with open(file_name, 'rb') as stream:
+            return stream.read(len(SQLITE_MAGIC)) == SQLITE_MAGIC
+    except OSError:
+        return False
+
+
+def split_query(file_name):
+    """ Splits 'store.db#key=value&...' into the path and the query. """
+    path, _, query = file_name.partition('#')
+    query = dict(parse_qsl(query))
+    unknown = set(query).difference(QUERY_KEYS)
+    if len(unknown) != 0:
+        raise RuntimeError(f"Unknown query keys {sorted(unknown)}. Choose"
+                           f" from: {QUERY_KEYS}.")
+    return path, query
+
+
+def iter_calculations(file_name):
+    """
+    Yields the basis-set records of any of the JSON layouts, with the EOM
+    states in the 'EOM' list.
+    """
+    current = None
+    for record in records.iter_records(file_name):
+        if 'irrep' in record:
+            if current is None:
+                raise RuntimeError(
+                    f"{file_name} has states but no basis-set header.")
+            current['EOM'].append(record)
+            continue
+        if current is not None:
+            yield current
+        current = dict(record)
+        current['EOM'] = list(current.get('EOM', []))
+    if current is not None:
+        yield current
+
+
+class Store:
+    def __init__(self, path: str):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def import_records(self, system: str, calculations):
+        """
+        Inserts the basis-set records in a single transaction. A record of
+        the same system, basis, and level replaces the stored one. The
+        SCF-only basis sets take the level of the rest of the data set.
+        """
+        calculations = list(calculations)
+        levels = {data['calclevel'] for data in calculations
+                  if 'calclevel' in data}
+        default_level = levels.pop() if len(levels) == 1 else ''
+
+        with self.connection:
+            for data in calculations:
+                calclevel = data.get('calclevel', default_level)
+                self.connection.execute(
+                    "DELETE FROM calculations WHERE system = ? AND"
+                    " calclevel = ? AND basis = ?",
+                    (system, calclevel, data['basis']))
+                cursor = self.connection.execute(
+                    "INSERT INTO calculations (system, basis, calclevel, scf,"
+                    " cc_energy, cc_correlation) VALUES (?, ?, ?, ?, ?, ?)",
+                    (system, data['basis'], calclevel) + tuple(
+                        data.get(key) for _, key in HEADER_COLUMNS))
+                calculation = cursor.lastrowid
+                self.connection.executemany(
+                    "INSERT INTO states (calculation, position, model,"
+                    " number, irrep, energy, correlation,"
+                    " correlation_error_est) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(calculation, position, state['model'],
+                      state['irrep']['energy #'], state['irrep']['name'])
+                     + tuple(state.get(key) for _, key in STATE_COLUMNS)
+                     for position, state in enumerate(data['EOM'])])
+        return len(calculations)
+
+    def import_file(self, system: str, file_name: str):
+        return self.import_records(system, iter_calculations(file_name))
+
+    def query(self, system=None, calclevel=None, basis=None, model=None,
+              kind=None):
+        """
+        Yields the matching calculations as basis-set records. A `model`
+        keeps only the EOM states of that model. The `kind` picks the ab
+        initio calculations ('abinitio'), the CBS results ('cbs'), or both
+        ('all'); by default only the ab initio ones unless a basis is given.
+        """
+        if kind is None:
+            kind = 'abinitio' if basis is None else 'all'
+        if kind not in KINDS:
+            raise RuntimeError(f"Unknown kind {kind}. Choose from: {KINDS}.")
+        filters = [(f"{column} = ?", value) for column, value in (
+            ('system', system), ('calclevel', calclevel), ('basis', basis))
+            if value is not None]
+        if kind == 'abinitio':
+            filters += [("basis != ?", CBS_BASIS)]
+        elif kind == 'cbs':
+            filters += [("basis = ?", CBS_BASIS)]
+        where = " AND ".join(condition for condition, _ in filters)
+        calculations = self.connection.execute(
+            "SELECT id, basis, calclevel, "
+            + ", ".join(column for column, _ in HEADER_COLUMNS)
+            + " FROM calculations"
+            + ("" if where == "" else " WHERE " + where)
+            + " ORDER BY system, calclevel, id",
+            [value for _, value in filters]).fetchall()
+
+        state_sql = (
+            "SELECT model, number, irrep, "
+            + ", ".join(column for column, _ in STATE_COLUMNS)
+            + " FROM states WHERE calculation = ?"
+            + ("" if model is None else " AND model = ?")
+            + " ORDER BY position")
+        for calculation, basis_name, level, *values in calculations:
+            data = {'basis': basis_name}
+            if level != '':
+                data['calclevel'] = level
+            for (_, key), value in zip(HEADER_COLUMNS, values):
+                if value is not None:
+                    data[key] = value
+
+            parameters = [calculation] + ([] if model is None else [model])
+            eom_states = list()
+            for state_model, number, irrep, *energies in \
+                    self.connection.execute(state_sql, parameters):
+                state = {
+                    'irrep': {'energy #': number, 'name': irrep},
+                    'model': state_model,
+                }
+                for (_, key), value in zip(STATE_COLUMNS, energies):
+                    if value is not None:
+                        state[key] = value
+                eom_states += [state]
+            data['EOM'] = eom_states
+            yield data
+
+    def systems(self):
+        """ Lists (system, calclevel, basis) of all calculations. """
+        return self.connection.execute(
+            "SELECT system, calclevel, basis FROM calculations"
+            " ORDER BY system, calclevel, id").fetchall()
+
+
+def iter_query(file_name):
+    """ The records of 'store.db#key=value&...'; see `records`. """
+    path, query = split_query(file_name)
+    store = Store(path)
+    try:
+        yield from store.query(**query)
+    finally:
+        store.close()
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="Keeps the ab initio and CBS energies in an SQLite"
+        " database.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    add = subparsers.add_parser(
+        'import', help="Insert JSON or NDJSON files: ab initio data sets,"
+        " single-basis calculations, or CBS results.")
+    add.add_argument('store', help="SQLite database; created if needed.")
+    add.add_argument('files', nargs='+', help="Files to import.")
+    add.add_argument('-s', '--system', required=True,
+                     help="Name of the system, e.g., the molecule.")
+
+    query = subparsers.add_parser(
+        'query', help="Print the matching calculations as an ab initio data"
+        " set.")
+    query.add_argument('store', help="SQLite database.")
+    query.add_argument('-s', '--system', default=None)
+    query.add_argument('-l', '--calclevel', default=None)
+    query.add_argument('-b', '--basis', default=None)
+    query.add_argument('-m', '--model', default=None,
+                       help="Keep only the EOM states of this model.")
+    query.add_argument('-k', '--kind', default=None, choices=KINDS,
+                       help="Ab initio calculations, CBS results, or both."
+                       " Default: abinitio unless a basis is given.")
+    query.add_argument('--ndjson', default=False, action='store_true',
+                       help="Print one basis set per line (NDJSON).")
+
+    listing = subparsers.add_parser(
+        'list', help="List the stored calculations.")
+    listing.add_argument('store', help="SQLite database.")
+
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    return args
+
+
+@profiling.profiled('store')
+def main():
+    args = get_args()
+    store = Store(args.store)
+
+    if args.command == 'import':
+        for file_name in args.files:
+            with profiling.stage('import'):
+                count = store.import_file(args.system, file_name)
+            print(f"Imported {count} calculations from {file_name}.",
+                  file=sys.stderr)
+    elif args.command == 'query':
+        # The rows are read as they are written
+        with profiling.stage('query'):
+            records.write_list(
+                store.query(args.system, args.calclevel, args.basis,
+                            args.model, args.kind),
+                ndjson=args.ndjson)
+    elif args.command == 'list':
+        for system, calclevel, basis in store.systems():
+            print(f"{system:20} {calclevel:10} {basis}")
+
+    store.close()
+    return 0
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,17 @@
 #!/usr/bin/env python3
 
 import argparse
-import json
-
-ha2eV = 27.211386245988
-eV2cm = 8065.543937
-ha2cm = ha2eV * eV2cm
+import worker_client
+if __name__ == "__main__":
+    # Forward to the warm server before the heavy imports
+    worker_client.forward('turn_cbs_into_xsim_input')
+import numpy as np  # noqa: E402
+from columnar import States, to_xsim  # noqa: E402
+import container  # noqa: E402
+import profiling  # noqa: E402
+from core import ha2eV  # noqa: E402
+import records  # noqa: E402
+import uncertainty  # noqa: E402
 
 
 def prepare_xsim_input(cbs):
@@ -16,10 +22,28 @@ def prepare_xsim_input(cbs):
          'model': str(),
          'energy': {'transition': {'eV': float(), 'au': float(), } } }
         ```
+    The 'energy' gets the 'ci' of the transition energies too if the CBS
+    file has the Monte Carlo intervals; see `uncertainty.py`.
+    """
+    states = States.from_dicts(cbs['EOM'])
+    correlation = np.array([state['correlation'] for state in cbs['EOM']],
+                           dtype=float)
+    xsim = to_xsim(states, correlation - cbs['cc_correlation'])
+    for xsim_state, eom_state in zip(xsim, cbs['EOM']):
+        if 'transition ci' in eom_state:
+            xsim_state['energy']['ci'] = uncertainty.xsim_interval(
+                eom_state['transition ci'])
+    return xsim
+
+
+def iter_xsim_states(cbs_header, eom_states):
+    """
+    Yields the states of `prepare_xsim_input` one by one, without holding
+    the whole list in memory. Only 'cc_correlation' is read from
+    `cbs_header`.
     """
-    out_pack = []
-    for eom_state in cbs['EOM']:
-        eom_ex_cbs_au = eom_state['correlation'] - cbs['cc_correlation']
+    for eom_state in eom_states:
+        eom_ex_cbs_au = eom_state['correlation'] - cbs_header['cc_correlation']
         out_state = {
             'irrep': eom_state['irrep'],
             'model': eom_state['model'],
@@ -30,20 +54,53 @@ def prepare_xsim_input(cbs):
                 }
             }
         }
-        out_pack += [out_state]
-    return out_pack
+        if 'transition ci' in eom_state:
+            out_state['energy']['ci'] = uncertainty.xsim_interval(
+                eom_state['transition ci'])
+        yield out_state
 
 
+@profiling.profiled('turn_cbs_into_xsim_input')
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument('cbs')
+    parser.add_argument('cbs', help="JSON or NDJSON file with CBS energies.")
+    parser.add_argument(
+        '--ndjson', default=False, action='store_true',
+        help="Print one state per line (NDJSON) instead of a JSON list.")
+    parser.add_argument(
+        '-o', '--binary', default=None, metavar='FILE',
+        help="Save the states to FILE in the binary container format (see"
+        " container.py) instead of printing them.")
+    profiling.add_arguments(parser)
     args = parser.parse_args()
 
-    with open(args.cbs) as cbs_json:
-        cbs = json.load(cbs_json)
+    with profiling.stage('load'):
+        if records.is_container(args.cbs):
+            # Array to array: the energies are never formatted nor parsed
+            cbs = container.load(args.cbs)
+            transition = cbs.fields['correlation'] - \
+                cbs.header['cc_correlation']
+            fields = container.transition_fields(transition)
+            if 'transition ci/low' in cbs.fields:
+                fields.update(uncertainty.interval_fields(
+                    cbs.fields['transition ci/low'],
+                    cbs.fields['transition ci/high']))
+            xsim = container.Container(None, cbs.states, fields,
+                                       cbs.model_key)
+            xsim_states = xsim.iter_states()
+        else:
+            cbs_header, eom_states = records.read_group(args.cbs)
+            xsim_states = iter_xsim_states(cbs_header, eom_states)
+            xsim = None
 
-    out_pack = prepare_xsim_input(cbs)
-    print(json.dumps(out_pack))
+    # The JSON states are read and converted as they are written
+    with profiling.stage('serialize'):
+        if args.binary is None:
+            records.write_list(xsim_states, ndjson=args.ndjson)
+        elif xsim is not None:
+            container.save(args.binary, xsim)
+        else:
+            container.save_group(args.binary, None, xsim_states)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,215 @@
+r"""
+Monte Carlo confidence intervals of the CBS limits and the additive models.
+
+CBS limits (`find_cbs.py --mc SAMPLES`)
+    Every sample perturbs the ab initio energies with normal noise (the
+    convergence of the energies) and draws the exponent of
+        E = E _\infty - b / n ** alpha
+    uniformly from a range around 3 (the uncertainty of the extrapolation
+    model). The model is linear in (E _\infty, b) for a given alpha, so all
+    the samples of all the states are solved in closed form at once: the
+    least-squares sums run over the basis axis of a (sample × state × basis)
+    array, in chunks of samples to bound the memory. The CC correlation goes
+    through the same samples as the EOM states, so the intervals of the
+    transition energies keep their correlation. The SCF energies get the
+    noise only and go through the vectorized exponential solver.
+
+Additive models (`merge.py --mc SAMPLES`)
+    Every file contributes, per state, a sample of a split normal
+    distribution matching its interval ('energy/ci'), or a normal one with
+    the 'error est', or half of the correction as the standard deviation.
+    The sum over the files gives the interval of the corrected energy.
+
+The intervals are the quantiles of the samples for the central `level`
+and are saved next to the values as {'low': ..., 'high': ...}:
+    CBS header      'scf ci', 'cc_correlation ci', and 'ci' with the settings,
+    CBS EOM states  'correlation ci' and 'transition ci' in a.u.,
+    xsim states     'energy': {'ci': {'eV': ..., 'au': ...}}.
+"""
+
+from statistics import NormalDist
+import numpy as np
+from core import ha2eV
+import fit_scf as fscf
+
+DEFAULT_LEVEL = 0.95
+DEFAULT_ALPHA = (2.5, 3.5)
+DEFAULT_NOISE = 1e-6
+# Upper bound on the size of the (sample × state × basis) chunks
+CHUNK_ELEMENTS = 2**22
+UNITS = {'eV': ha2eV, 'au': 1.0}
+
+
+def add_arguments(parser, cbs: bool = False):
+    group = parser.add_argument_group('uncertainty')
+    group.add_argument(
+        '--mc', default=0, type=int, metavar='SAMPLES',
+        help="Add Monte Carlo confidence intervals computed from SAMPLES"
+        " samples, e.g., 10000. Default: no intervals.")
+    group.add_argument(
+        '--ci', default=DEFAULT_LEVEL, type=float, metavar='LEVEL',
+        help="Level of the confidence intervals. Default: %(default)s.")
+    group.add_argument(
+        '--seed', default=None, type=int,
+        help="Seed of the random numbers. Default: a fresh one, saved in the"
+        " output.")
+    if cbs is True:
+        group.add_argument(
+            '--mc-alpha', default=DEFAULT_ALPHA, type=float, nargs=2,
+            metavar=('LOW', 'HIGH'),
+            help="Range of the exponents of the n^-alpha model. Default:"
+            " %(default)s.")
+        group.add_argument(
+            '--mc-noise', default=DEFAULT_NOISE, type=float,
+            help="Standard deviation of the noise of the ab initio energies"
+            " in a.u. Default: %(default)s.")
+
+
+def new_seed(seed: int | None = None):
+    """ The given seed, or a fresh one that can be saved. """
+    if seed is not None:
+        return seed
+    return int(np.random.SeedSequence().generate_state(1)[0])
+
+
+def interval(samples, level: float = DEFAULT_LEVEL):
+    """ The (low, high) quantiles of every column of the samples. """
+    low, high = np.nanquantile(
+        samples, [(1.0 - level) / 2, (1.0 + level) / 2], axis=0)
+    return low, high
+
+
+def as_dict(low, high):
+    return {'low': float(low), 'high': float(high)}
+
+
+def sample_inverse_power(zetas, energies, rng, samples: int,
+                         alpha=DEFAULT_ALPHA, noise: float = DEFAULT_NOISE,
+                         use_best: bool = True):
+    r"""
+    Returns the (sample × series) E _\infty of the columns of the
+    (basis × series) `energies`; see the module's docstring.
+    """
+    zetas = np.asarray(zetas, dtype=float)
+    energies = np.asarray(energies, dtype=float)
+    if use_best is True:
+        zetas = zetas[-2:]
+        energies = energies[-2:]
+    nbasis, nseries = energies.shape
+
+    exponents = rng.uniform(alpha[0], alpha[1], samples)
+    x = zetas[np.newaxis, :] ** -exponents[:, np.newaxis]
+    sx = np.sum(x, axis=1)[:, np.newaxis]
+    det = nbasis * np.sum(x * x, axis=1)[:, np.newaxis] - sx**2
+
+    cbs = np.empty((samples, nseries))
+    chunk = max(1, CHUNK_ELEMENTS // max(1, nseries * nbasis))
+    for start in range(0, samples, chunk):
+        rows = slice(start, min(start + chunk, samples))
+        if noise == 0.0:
+            sy = np.broadcast_to(np.sum(energies, axis=0), (rows.stop - start,
+                                                            nseries))
+            sxy = x[rows] @ energies
+        else:
+            perturbed = energies.T[np.newaxis] + noise * rng.standard_normal(
+                (rows.stop - start, nseries, nbasis))
+            sy = np.sum(perturbed, axis=2)
+            sxy = np.einsum('sb,sjb->sj', x[rows], perturbed)
+        slope = (nbasis * sxy - sx[rows] * sy) / det[rows]
+        cbs[rows] = (sy - slope * sx[rows]) / nbasis
+    return cbs
+
+
+def sample_exponential(zetas, energies, rng, samples: int,
+                       noise: float = DEFAULT_NOISE, use_best: bool = True):
+    """ The (sample) SCF limits of the perturbed (basis) energies. """
+    energies = np.asarray(energies, dtype=float)
+    perturbed = energies[:, np.newaxis] + noise * rng.standard_normal(
+        (energies.shape[0], samples))
+    parameters, _ = fscf.fit_many_scf_to_exp_model(
+        zetas, perturbed, use_best=use_best)
+    return parameters[0]
+
+
+def cbs_intervals(scf_zetas, scf, zetas, correlation, samples: int,
+                  level: float = DEFAULT_LEVEL, alpha=DEFAULT_ALPHA,
+                  noise: float = DEFAULT_NOISE, use_best: bool = True,
+                  seed: int | None = None):
+    """
+    The intervals of the CBS limits. `correlation` is the (basis × series)
+    matrix with the CC correlation in the column 0 and the EOM states in
+    the rest. Returns a dict of the (low, high) pairs: 'scf',
+    'cc_correlation', and the per state arrays 'correlation' and
+    'transition', and the 'settings'.
+    """
+    seed = new_seed(seed)
+    rng = np.random.default_rng(seed)
+    scf_samples = sample_exponential(scf_zetas, scf, rng, samples, noise,
+                                     use_best)
+    correlation_samples = sample_inverse_power(
+        zetas, correlation, rng, samples, alpha, noise, use_best)
+    transition_samples = correlation_samples[:, 1:] - \
+        correlation_samples[:, :1]
+
+    correlation_low, correlation_high = interval(correlation_samples, level)
+    return {
+        'scf': interval(scf_samples, level),
+        'cc_correlation': (correlation_low[0], correlation_high[0]),
+        'correlation': (correlation_low[1:], correlation_high[1:]),
+        'transition': interval(transition_samples, level),
+        'settings': {
+            'level': level,
+            'samples': samples,
+            'alpha': list(alpha),
+            'noise': noise,
+            'seed': seed,
+            'failed SCF samples': int(np.count_nonzero(
+                np.isnan(scf_samples))),
+        },
+    }
+
+
+def attach_cbs_intervals(cbs_header, cbs_eom, intervals):
+    """ Saves the `cbs_intervals` in the CBS header and states. """
+    cbs_header['scf ci'] = as_dict(*intervals['scf'])
+    cbs_header['cc_correlation ci'] = as_dict(*intervals['cc_correlation'])
+    cbs_header['ci'] = intervals['settings']
+    for state, correlation_low, correlation_high, low, high in zip(
+            cbs_eom, *intervals['correlation'], *intervals['transition']):
+        state['correlation ci'] = as_dict(correlation_low, correlation_high)
+        state['transition ci'] = as_dict(low, high)
+
+
+def xsim_interval(transition_ci):
+    """ The 'energy/ci' of an xsim state from the CBS 'transition ci'. """
+    return {unit: {bound: value * factor
+                   for bound, value in transition_ci.items()}
+            for unit, factor in UNITS.items()}
+
+
+def interval_fields(low_au, high_au):
+    """ The 'energy/ci' fields of a container of xsim states. """
+    fields = dict()
+    for unit, factor in UNITS.items():
+        fields[f'energy/ci/{unit}/low'] = np.asarray(low_au) * factor
+        fields[f'energy/ci/{unit}/high'] = np.asarray(high_au) * factor
+    return fields
+
+
+def sample_sum(total, spreads, samples: int, rng):
+    """
+    The (sample × state) samples of the sum of the files. `total` is the
+    (state) sum of the energies and `spreads` lists the (low, high)
+    standard deviations of every file below and above its value.
+    """
+    total = np.tile(np.asarray(total, dtype=float), (samples, 1))
+    for low, high in spreads:
+        draws = rng.standard_normal(total.shape)
+        total += np.where(draws < 0, draws * low, draws * high)
+    return total
+
+
+def spread_from_interval(value, low, high, level: float = DEFAULT_LEVEL):
+    """ The standard deviations of the split normal of the interval. """
+    z = NormalDist().inv_cdf((1.0 + level) / 2)
+    return (np.asarray(value) - low) / z, (high - np.asarray(value)) / z
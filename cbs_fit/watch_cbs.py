@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+"""
+Keeps the CBS results of running CFOUR campaigns up to date.
+
+Every watched directory holds the CFOUR outputs of one system, e.g.,
+    water/ccsd-aug-pwCVDZ/output.c4
+    water/ccsd-aug-pwCVTZ/output.c4
+    water/ccsdt-ANO1/output.c4
+    ...
+The directories are polled for new or changed outputs. A burst of changes
+is debounced: the results are recomputed once the outputs stay unchanged
+for the debounce time. Only the changed outputs are read again (see
+`cfour_ingest.py`).
+
+The outputs are grouped by the CC level and the basis set family (see
+`core.basis_family`), e.g., aug-pwCVnZ or ANOn. The level and family with the
+most basis sets, together with the SCF-only outputs of that family, are
+extrapolated to the CBS limit; a family needs at least three SCF and two CC
+basis sets, and `--family` picks it explicitly. Every higher level gives a
+correction, e.g., ΔT/ANO1, computed at the largest basis set that it shares
+with the level just below it, preferably from outside the CBS family (see
+`dT/pprint_dT.py`). The extrapolations and corrections whose outputs did not
+change are reused, and the CBS results are kept in the fit cache across
+restarts. Two files are rewritten atomically in each directory:
+    <directory>+cbs.json    the CBS result (`find_cbs.py`),
+    <directory>+xsim.json   the CBS energies with all the corrections
+                            (`merge.py`), ready for xsim.
+"""
+
+import argparse
+import math
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'dT'))
+sys.path.insert(0, ROOT)
+import cfour_ingest  # noqa: E402
+from columnar import ColumnarDataset, States, StringTable  # noqa: E402
+import container  # noqa: E402
+import events  # noqa: E402
+from core import basis2n, basis_family  # noqa: E402
+from fit_cache import FitCache, DEFAULT_DIRECTORY  # noqa: E402
+import profiling  # noqa: E402
+import records  # noqa: E402
+import state_index as si  # noqa: E402
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="Watches directories of CFOUR outputs and keeps their CBS"
+        " and xsim files up to date.")
+    parser.add_argument(
+        'directories', nargs='+',
+        help="Directories with the CFOUR outputs of one system each.")
+    parser.add_argument(
+        '-n', '--name', default=cfour_ingest.DEFAULT_OUTPUT_NAME,
+        help="File name of the CFOUR outputs. Default: %(default)s.")
+    parser.add_argument(
+        "-a", "--use_all", default=False, action="store_true",
+        help="Fit using all data points. Default: Fit using minimal number of"
+        " points, i.e., only the largest basis sets.")
+    parser.add_argument(
+        '-f', '--family', default=None,
+        help="Basis set family to extrapolate, e.g., aug-pwCVnZ. Default: the"
+        " family with the most basis sets.")
+    parser.add_argument(
+        '-i', '--interval', default=5.0, type=float,
+        help="Seconds between the scans of the directories. Default:"
+        " %(default)s.")
+    parser.add_argument(
+        '-d', '--debounce', default=30.0, type=float,
+        help="Seconds without any change before the results are recomputed."
+        " Default: %(default)s.")
+    parser.add_argument(
+        '--once', default=False, action='store_true',
+        help="Update the results once and exit.")
+    parser.add_argument(
+        '--cache-dir', default=DEFAULT_DIRECTORY,
+        help="Fit cache directory. Default: %(default)s.")
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    return args
+
+
+def write_atomically(file_name, write):
+    """ Calls `write(file)` on a temporary file that then replaces the
+    `file_name`, so readers never see a partial file. """
+    temporary = f'{file_name}.{os.getpid()}.tmp'
+    with open(temporary, 'w') as output:
+        write(output)
+    os.replace(temporary, file_name)
+
+
+def zeta(basis: str):
+    return basis2n.get(basis, 0)
+
+
+def split_levels(outputs):
+    """
+    Groups the records by the CC level. Returns a dict level → {basis:
+    (path, record)} and the SCF-only records by basis.
+    """
+    levels = dict()
+    scf_only = dict()
+    for path, record in sorted(outputs.items()):
+        if 'cc_energy' not in record:
+            scf_only[record['basis']] = (path, record)
+            continue
+        bases = levels.setdefault(record['calclevel'], dict())
+        if record['basis'] in bases:
+            print(f"Warning! {path} repeats the {record['calclevel']}/"
+                  f"{record['basis']} of {bases[record['basis']][0]}.",
+                  file=sys.stderr)
+        bases[record['basis']] = (path, record)
+    return levels, scf_only
+
+
+def choose_cbs(levels, scf_only, family=None):
+    """
+    Picks the CC level and the basis set family to extrapolate: the pair
+    with the most CC basis sets among those with at least three SCF and two
+    CC basis sets. Returns (level, family), or None if there is no such
+    pair.
+    """
+    candidates = list()
+    for level, bases in levels.items():
+        for level_family in {basis_family(basis) for basis in bases}:
+            if family is not None and level_family != family:
+                continue
+            cc_bases = {basis for basis in bases
+                        if basis_family(basis) == level_family}
+            scf_bases = cc_bases.union(
+                basis for basis in scf_only
+                if basis_family(basis) == level_family)
+            if len(scf_bases) < 3 or len(cc_bases) < 2:
+                continue
+            candidates += [((len(cc_bases), len(scf_bases), -len(level)),
+                            level, level_family)]
+    if len(candidates) == 0:
+        return None
+    _, level, level_family = max(candidates)
+    return level, level_family
+
+
+def plan_corrections(levels, main_level, cbs_family=None):
+    """
+    Pairs every level above the main one with the level just below it,
+    i.e., the longest level name that starts its name. The shared basis set
+    comes from outside the `cbs_family` when possible. Returns the list of
+    (better level, worse level, basis).
+    """
+    corrections = list()
+    for better in sorted(levels, key=len):
+        if better == main_level or not better.startswith(main_level):
+            continue
+        lower = [level for level in levels
+                 if better.startswith(level) and level != better]
+        for worse in sorted(lower, key=len, reverse=True):
+            shared = set(levels[better]).intersection(levels[worse])
+            if len(shared) != 0:
+                basis = max(shared, key=lambda basis: (
+                    basis_family(basis) != cbs_family, zeta(basis), basis))
+                corrections += [(better, worse, basis)]
+                break
+        else:
+            print(f"Warning! No lower level shares a basis set with"
+                  f" {better}.", file=sys.stderr)
+    return corrections
+
+
+class SystemWatch:
+    """ The outputs and the memoized results of one directory. """
+
+    def __init__(self, directory: str, name: str, use_best: bool,
+                 cache: FitCache | None = None, family: str | None = None):
+        self.directory = os.path.normpath(directory)
+        self.name = name
+        self.use_best = use_best
+        self.family = family
+        self.cache = cache
+        self.stamps = dict()
+        self.outputs = dict()
+        self.results = dict()
+        self.recomputed = False
+        self.last_used = None
+        self.last_snapshot = None
+
+    def snapshot(self):
+        """ Maps the output paths to their modification time and size. """
+        stamps = dict()
+        for path in cfour_ingest.find_outputs([self.directory], self.name):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            stamps[path] = (stat.st_mtime_ns, stat.st_size)
+        return stamps
+
+    def ingest(self, snapshot):
+        """ Reads the new and changed outputs. Returns True on changes. """
+        changed = False
+        for path in set(self.stamps).difference(snapshot):
+            del self.stamps[path]
+            self.outputs.pop(path, None)
+            changed = True
+
+        for path, stamp in snapshot.items():
+            if self.stamps.get(path) == stamp:
+                continue
+            self.stamps[path] = stamp
+            changed = True
+            try:
+                self.outputs[path] = cfour_ingest.ingest_file(path)
+            except (OSError, RuntimeError) as error:
+                # Most likely a job that is still running
+                self.outputs.pop(path, None)
+                print(f"Warning! Skipping {error}", file=sys.stderr)
+        return changed
+
+    def _memoized(self, name, inputs, compute):
+        """ Recomputes the result only if the stamps of its inputs changed. """
+        signature = tuple(sorted((path, self.stamps[path])
+                                 for path in inputs))
+        if name not in self.results or self.results[name][0] != signature:
+            self.results[name] = (signature, compute())
+            self.recomputed = True
+        self.used += [name]
+        return self.results[name][1]
+
+    def _cbs(self, cbs_records):
+        from find_cbs import find_cbs
+
+        dataset = ColumnarDataset.from_records(cbs_records)
+        with events.threshold(events.WARNING):
+            return find_cbs(dataset, use_best=self.use_best, plot_jobs=False,
+                            cache=self.cache)
+
+    @staticmethod
+    def _correction(better, worse):
+        from pprint_dT import name_correction, find_correction
+
+        correction_name = name_correction(better, worse)
+        states, _, _, correction = find_correction(
+            better, better['EOM'], worse, worse['EOM'])
+        table = states.table.copy()
+        table['model'] = 0
+        states = States(table, states.irreps, StringTable([correction_name]))
+        return container.Container(
+            None, states, container.transition_fields(correction))
+
+    def update(self):
+        """
+        Recomputes the affected results and rewrites the files. Returns the
+        names of the rewritten files.
+        """
+        from merge import compose
+        from turn_cbs_into_xsim_input import prepare_xsim_input
+
+        levels, scf_only = split_levels(self.outputs)
+        if len(levels) == 0:
+            return []
+        chosen = choose_cbs(levels, scf_only, self.family)
+        if chosen is None:
+            family = 'any family' if self.family is None else self.family
+            print(f"Warning! {self.directory}: {family} has not enough basis"
+                  " sets for the CBS extrapolation yet.", file=sys.stderr)
+            return []
+        main_level, cbs_family = chosen
+        cbs_inputs = {basis: output for basis, output in scf_only.items()
+                      if basis_family(basis) == cbs_family}
+        cbs_inputs.update(
+            (basis, output) for basis, output in levels[main_level].items()
+            if basis_family(basis) == cbs_family)
+        cbs_records = list()
+        for path, record in cbs_inputs.values():
+            record = dict(record)
+            if 'cc_energy' not in record:
+                record.pop('calclevel', None)
+            cbs_records += [record]
+
+        self.recomputed = False
+        self.used = list()
+        cbs_header, cbs_eom = self._memoized(
+            'cbs', [path for path, _ in cbs_inputs.values()],
+            lambda: self._cbs(cbs_records))
+
+        corrections = list()
+        names = list()
+        for better, worse, basis in plan_corrections(levels, main_level,
+                                                     cbs_family):
+            better_path, better_record = levels[better][basis]
+            worse_path, worse_record = levels[worse][basis]
+            corrections += [self._memoized(
+                f'{better}-{worse}/{basis}', [better_path, worse_path],
+                lambda: self._correction(better_record, worse_record))]
+            names += [f"{better}/{basis}"]
+
+        unchanged = not self.recomputed and self.used == self.last_used
+        self.last_used = self.used
+        if unchanged and os.path.exists(self.output('+xsim')):
+            return []
+
+        cbs = dict(cbs_header)
+        cbs['EOM'] = cbs_eom
+        first = container.Container.from_dicts(None, prepare_xsim_input(cbs))
+        composed, missing = compose(first, corrections, names)
+        for key, files in missing.items():
+            print(f"Warning! {self.directory}: no {', '.join(files)}"
+                  f" correction for the state {si.key_to_str(key)}.",
+                  file=sys.stderr)
+
+        write_atomically(self.output('+cbs'), lambda output:
+                         records.write_group(cbs_header, cbs_eom, file=output))
+        write_atomically(self.output('+xsim'), lambda output:
+                         records.write_list(composed.iter_states(),
+                                            file=output))
+        return [self.output('+cbs'), self.output('+xsim')]
+
+    def output(self, suffix: str):
+        return os.path.join(
+            self.directory, os.path.basename(self.directory) + suffix
+            + '.json')
+
+
+def refresh(watch: SystemWatch):
+    try:
+        written = watch.update()
+    except Exception as error:
+        print(f"Warning! {watch.directory}: {type(error).__name__}:"
+              f" {error}", file=sys.stderr)
+        return
+    for file_name in written:
+        print(f"Updated {file_name}", flush=True)
+
+
+@profiling.profiled('watch_cbs')
+def main():
+    args = get_args()
+    cache = FitCache(args.cache_dir)
+    watches = [SystemWatch(directory, args.name, not args.use_all, cache,
+                           args.family)
+               for directory in args.directories]
+
+    dirty = set()
+    last_change = -math.inf
+    while True:
+        for watch in watches:
+            snapshot = watch.snapshot()
+            if snapshot != watch.last_snapshot:
+                watch.last_snapshot = snapshot
+                dirty.add(watch)
+                last_change = time.monotonic()
+
+        if len(dirty) != 0 and \
+                (args.once or time.monotonic() - last_change >= args.debounce):
+            for watch in watches:
+                if watch not in dirty:
+                    continue
+                with profiling.stage('ingest'):
+                    changed = watch.ingest(watch.last_snapshot)
+                if changed:
+                    with profiling.stage('update'):
+                        refresh(watch)
+            dirty.clear()
+
+        if args.once:
+            break
+        time.sleep(args.interval)
+
+    return 0
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Thin client of `worker_server.py`.
+
+When the environment variable ADDITIVE_MODELS_SERVER holds the path of the
+server's socket, the command line tools forward their arguments to the warm
+server instead of importing numpy and the fitting modules themselves. The
+standard input, output, and error of the tool are passed to the server, so
+the output looks the same as from a local run. Without a reachable server
+the tools run locally.
+
+Only the standard library is imported here.
+"""
+
+import json
+import os
+import socket
+import sys
+
+ENVIRONMENT_VARIABLE = 'ADDITIVE_MODELS_SERVER'
+LENGTH_BYTES = 8
+
+
+def send_message(connection, message: dict, fds=()):
+    """ Sends a length-prefixed JSON message, optionally with descriptors. """
+    data = json.dumps(message).encode()
+    data = len(data).to_bytes(LENGTH_BYTES, 'little') + data
+    if len(fds) != 0:
+        sent = socket.send_fds(connection, [data], list(fds))
+        data = data[sent:]
+    connection.sendall(data)
+
+
+def receive_message(connection, max_fds: int = 0):
+    """ Returns the message and the file descriptors that came with it. """
+    data, fds, _, _ = socket.recv_fds(connection, 2**16, max_fds)
+    while len(data) < LENGTH_BYTES or \
+            len(data) < LENGTH_BYTES + int.from_bytes(
+                data[:LENGTH_BYTES], 'little'):
+        chunk = connection.recv(2**16)
+        if chunk == b'':
+            raise ConnectionError("The connection closed mid-message.")
+        data += chunk
+    return json.loads(data[LENGTH_BYTES:]), fds
+
+
+def forward(tool: str):
+    """
+    Runs the tool on the server and exits with its return code. Returns
+    without doing anything if no server is configured or reachable.
+    """
+    path = os.environ.get(ENVIRONMENT_VARIABLE)
+    if path is None or path == "":
+        return
+
+    request = {
+        'tool': tool,
+        'argv': sys.argv[1:],
+        'cwd': os.getcwd(),
+        'env': dict(os.environ),
+    }
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(path)
+    except OSError as error:
+        connection.close()
+        print(f"Warning! The server at {path} is not available ({error});"
+              " running locally.", file=sys.stderr)
+        return
+
+    with connection:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        try:
+            send_message(connection, request, fds=(0, 1, 2))
+            reply, _ = receive_message(connection)
+        except (OSError, ValueError) as error:
+            # The tool may have run already; do not repeat it locally
+            print(f"Error! Lost the server at {path}: {error}",
+                  file=sys.stderr)
+            sys.exit(1)
+
+    sys.exit(reply['code'])
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Warm worker server for the command line tools.
+
+The server imports numpy, matplotlib, and the fitting modules once and
+listens on a Unix socket. Every request is served by a forked copy of the
+warm process, which runs the tool's `main` with the client's arguments,
+working directory, environment, and standard streams. Start the server and
+point the tools at it:
+
+    ./worker_server.py &
+    socket=$XDG_RUNTIME_DIR/additive_models-$(id -u).sock
+    export ADDITIVE_MODELS_SERVER=$socket
+    ./find_cbs.py --no-plots ccsd+pwCVnZ.json
+
+The plots are drawn with the non-interactive Agg backend; use
+`--plots png`, `pdf`, or `multipage` instead of the windows.
+"""
+
+import argparse
+import importlib
+import os
+import signal
+import socket
+import socketserver
+import sys
+import traceback
+import events
+from worker_client import ENVIRONMENT_VARIABLE, send_message, receive_message
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOOL_DIRECTORIES = [
+    os.path.join(ROOT, 'cbs_fit'),
+    os.path.join(ROOT, 'dT'),
+    ROOT,
+]
+TOOLS = (
+    'find_cbs',
+    'turn_cbs_into_xsim_input',
+    'pprint_final_energies',
+    'pprint_dT',
+    'merge',
+)
+DEFAULT_SOCKET = os.path.join(
+    os.environ.get('XDG_RUNTIME_DIR', '/tmp'),
+    f'additive_models-{os.getuid()}.sock')
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="Serves the CBS and correction tools from a warm"
+        " process.")
+    parser.add_argument(
+        '-s', '--socket', default=DEFAULT_SOCKET,
+        help="Path of the Unix socket. Default: %(default)s.")
+    parser.add_argument(
+        '-j', '--workers', default=40, type=int,
+        help="Maximum number of requests served at the same time. Default:"
+        " %(default)s.")
+    args = parser.parse_args()
+    return args
+
+
+def preload():
+    """ Imports the tools and the libraries they use. """
+    for directory in reversed(TOOL_DIRECTORIES):
+        if directory not in sys.path:
+            sys.path.insert(0, directory)
+
+    os.environ['MPLBACKEND'] = 'Agg'
+    try:
+        import matplotlib.pyplot  # noqa: F401
+    except ImportError:
+        pass
+
+    return {tool: importlib.import_module(tool) for tool in TOOLS}
+
+
+def run_tool(module, tool: str, argv):
+    """ Runs the tool's main; returns its exit code. """
+    sys.argv = [tool] + list(argv)
+    try:
+        code = module.main()
+    except SystemExit as exit_request:
+        code = exit_request.code
+    except Exception:
+        traceback.print_exc()
+        code = 1
+
+    if code is None:
+        return 0
+    if not isinstance(code, int):
+        print(code, file=sys.stderr)
+        return 1
+    return code
+
+
+class RequestHandler(socketserver.BaseRequestHandler):
+    # Runs in the forked child: the changes below do not leak
+    def handle(self):
+        request, fds = receive_message(self.request, max_fds=3)
+        tool = request['tool']
+        if tool not in self.server.modules or len(fds) != 3:
+            for fd in fds:
+                os.close(fd)
+            send_message(self.request, {'code': 1})
+            return
+
+        os.chdir(request['cwd'])
+        os.environ.clear()
+        os.environ.update(request['env'])
+        os.environ['MPLBACKEND'] = 'Agg'
+        sys.stdout.flush()
+        sys.stderr.flush()
+        for target, fd in enumerate(fds):
+            os.dup2(fd, target)
+            os.close(fd)
+
+        code = run_tool(self.server.modules[tool], tool, request['argv'])
+        # The child exits through os._exit: no atexit flush of the events
+        events.close()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        send_message(self.request, {'code': code})
+
+
+class WorkerServer(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+    def __init__(self, path, modules, workers: int = 40):
+        self.modules = modules
+        self.max_children = workers
+        super().__init__(path, RequestHandler)
+
+
+def remove_stale_socket(path):
+    """ Removes a socket left by a server that is no longer running. """
+    if not os.path.exists(path):
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(path)
+        except OSError:
+            os.remove(path)
+            return
+    raise RuntimeError(f"A server is already listening on {path}.")
+
+
+def main():
+    args = get_args()
+    modules = preload()
+    remove_stale_socket(args.socket)
+
+    # Only the user may connect
+    os.umask(0o077)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    with WorkerServer(args.socket, modules, args.workers) as server:
+        print(f"Serving {', '.join(TOOLS)}. Use:\n"
+              f"export {ENVIRONMENT_VARIABLE}={args.socket}", file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.remove(args.socket)
+
+    return 0
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,24 @@
 #!/usr/bin/env python3
 
 import argparse
-import json
+import os
 import sys
 
-ha2eV = 27.211386245988
-eV2cm = 8065.543937
-ha2cm = ha2eV * eV2cm
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cbs_fit'))
+import worker_client  # noqa: E402
+if __name__ == "__main__":
+    # Forward to the warm server before the heavy imports
+    worker_client.forward('pprint_dT')
+import numpy as np  # noqa: E402
+from columnar import ColumnarDataset, States, to_xsim  # noqa: E402
+import container  # noqa: E402
+import profiling  # noqa: E402
+from core import (  # noqa: E402
+    basis2n, basis_family, conversion_factors, iter_dataset_records,
+)
+import records  # noqa: E402
+import state_index as si  # noqa: E402
 
 
 def get_args():
@@ -19,13 +31,30 @@ def get_args():
     )
 
     parser.add_argument(
-        'better',
-        help="JSON file with ab initio energies at a higher level of theory."
+        'better', nargs='?',
+        help="JSON or NDJSON file with ab initio energies at a higher level"
+        " of theory."
+    )
+
+    parser.add_argument(
+        'worse', nargs='?',
+        help="JSON or NDJSON file with ab initio energies at a lower level"
+        " of theory."
     )
 
     parser.add_argument(
-        'worse',
-        help="JSON file with ab initio energies at a lower level of theory."
+        '-b', '--batch', nargs='+', default=None, metavar='FILE',
+        help="Instead of the better and worse files, read the calculations"
+        " of any levels and basis sets from the FILEs (JSON, NDJSON, or"
+        " directories of CFOUR outputs) and print every correction between"
+        " the adjacent levels, e.g., ΔT and ΔQ, at every basis set."
+    )
+
+    parser.add_argument(
+        '-d', '--xsim-dir', default=None, metavar='DIR',
+        help="With --batch, save the sum of the corrections of every basis"
+        " set in the xsim's 'better energies' format to"
+        " DIR/<basis>+corrections.json."
     )
 
     parser.add_argument(
@@ -38,123 +67,335 @@ def get_args():
         help="Print correction in the xsim's 'better energies' format."
     )
 
+    parser.add_argument(
+        '--ndjson', default=False, action="store_true",
+        help="With -x, print one state per line (NDJSON)."
+    )
+
+    parser.add_argument(
+        '-o', '--binary', default=None, metavar='FILE',
+        help="Save the correction in the xsim's format to FILE in the binary"
+        " container format (see container.py)."
+    )
+
+    profiling.add_arguments(parser)
     args = parser.parse_args()
+    if args.batch is not None and (args.xsim is True or
+                                   args.binary is not None):
+        parser.error("-x/--xsim and -o/--binary do not work with --batch;"
+                     " save the corrections with -d/--xsim-dir.")
+    if args.batch is None and args.xsim_dir is not None:
+        parser.error("-d/--xsim-dir needs --batch.")
     return args
 
 
-def states_match(foo, bar):
+def name_level_correction(better_level: str, worse_level: str):
     """
-    Compares if the two dictionaries talk about the same state.
+    Returns the name of the correction of `worse_level` by `better_level`,
+    e.g., ΔT for CCSDT and CCSD.
     """
-    if foo['irrep'] != bar['irrep']:
-        return False
+    worse_len = len(worse_level)
+    if worse_len >= len(better_level):
+        raise RuntimeError(
+            f"The better level of theory, {better_level}, is expeted"
+            f" to have a longer name than the worse one, {worse_level}.")
 
-    return True
+    core = better_level[:worse_len]
 
+    if core != worse_level:
+        print(f"Warning! Correcting {worse_level} with the seemingly"
+              f" incompatibile {better_level}.", file=sys.stderr)
 
-def main():
-    args = get_args()
-    with open(args.better) as better_json:
-        better = json.load(better_json)
+    return "Δ" + better_level[worse_len:]
 
-    with open(args.worse) as worse_json:
-        worse = json.load(worse_json)
 
+def name_correction(better, worse):
+    """
+    Checks that the two calculations can be compared and returns the name of
+    the correction, e.g., ΔT/ANO1.
+    """
     basis = better['basis']
     if worse['basis'] != basis:
-        print(
-            "Error! Both calculations need to use the same basis set!",
-            file=sys.stderr
-        )
+        raise RuntimeError(
+            "Both calculations need to use the same basis set!")
+
+    correction = name_level_correction(better['calclevel'],
+                                       worse['calclevel'])
+    return correction + "/" + basis
+
+
+def find_correction(better, better_states, worse, worse_states):
+    """
+    Matches the states of the two calculations by irreps. Returns a tuple
+    `(states, worse_eom_energy, better_eom_energy, correction)` with the
+    matched states of the better calculation and the arrays of their
+    excitation energies and corrections in a.u.
+    """
+    # ΔT compares states computed with different models: match irreps only
+    worse_index, duplicates = si.index_states(worse_states, model_key=None)
+    for key in duplicates:
+        print(f"Warning! Duplicated state {si.key_to_str(key)} in the lower"
+              " level calculation.", file=sys.stderr)
+
+    matched = list()
+    worse_energies = list()
+    for better_state in better_states:
+        key = si.state_key(better_state, model_key=None)
+        if key not in worse_index:
+            print("Warning! No match in the lower level calculation for the"
+                  f" state {si.key_to_str(key)}.", file=sys.stderr)
+            continue
+        matched += [better_state]
+        worse_energies += [worse_index[key]['energy']]
+
+    states = States.from_dicts(matched)
+    worse_eom_energy = np.array(worse_energies, dtype=float) - \
+        worse['cc_energy']
+    better_eom_energy = np.array(
+        [state['energy'] for state in matched], dtype=float) - \
+        better['cc_energy']
+    correction = better_eom_energy - worse_eom_energy
+    return states, worse_eom_energy, better_eom_energy, correction
+
+
+def iter_calculations(file_name):
+    """
+    Yields the records of every calculation in the file, a directory of
+    CFOUR outputs, or a data set. The states of the single-basis NDJSON
+    layout, which follow their header, are put back in its 'EOM' list.
+    """
+    calculation = None
+    for record in iter_dataset_records(file_name):
+        if 'irrep' in record and calculation is not None:
+            calculation['EOM'] += [record]
+            continue
+        if calculation is not None:
+            yield calculation
+        calculation = dict(record)
+        calculation.setdefault('EOM', [])
+    if calculation is not None:
+        yield calculation
+
+
+def collect_hierarchy(file_names):
+    """
+    Reads the calculations of the files into a (level × basis × state)
+    array of the EOM excitation energies (a.u.), NaN where missing. The
+    levels are sorted from the lowest, i.e., the shortest name, the basis
+    sets by family and zeta, and the states, matched by irreps only, as they
+    first appear. Returns `(levels, bases, keys, energies)`.
+    """
+    by_level = dict()
+    for file_name in file_names:
+        for record in iter_calculations(file_name):
+            level_records = by_level.setdefault(record['calclevel'], dict())
+            if record['basis'] in level_records:
+                print(f"Warning! Duplicated {record['calclevel']}/"
+                      f"{record['basis']} calculation in {file_name}.",
+                      file=sys.stderr)
+                continue
+            level_records[record['basis']] = record
+
+    levels = sorted(by_level, key=lambda level: (len(level), level))
+    bases = sorted({basis for level_records in by_level.values()
+                    for basis in level_records},
+                   key=lambda basis: (basis_family(basis), basis2n[basis],
+                                      basis))
+    basis_rows = {basis: row for row, basis in enumerate(bases)}
+
+    datasets = [ColumnarDataset.from_records(by_level[level].values())
+                for level in levels]
+    columns = dict()
+    for dataset in datasets:
+        for key in dataset.states.keys(with_model=False):
+            columns.setdefault(key, len(columns))
+
+    energies = np.full((len(levels), len(bases), len(columns)), np.nan)
+    for position, dataset in enumerate(datasets):
+        keys = dataset.states.keys(with_model=False)
+        # Different models of the same irrep: the first one is used
+        first = {key: column for column, key in reversed(list(
+            enumerate(keys)))}
+        if len(first) != len(keys):
+            print(f"Warning! Several EOM models of the same states at the"
+                  f" {levels[position]} level; using the first one.",
+                  file=sys.stderr)
+        state_columns = list(first.values())
+        rows = [basis_rows[basis] for basis in dataset.basis]
+        energies[position][np.ix_(rows, [columns[key] for key in first])] = \
+            dataset.transition[:, state_columns]
+
+    return levels, bases, list(columns), energies
+
+
+def format_columns(titles, keys, values, float_fmt: str = "6.3f"):
+    """
+    Lines of a table with the state `keys` in the first column and the
+    columns of the (state × title) `values`; NaN is left blank. The cells
+    are formatted for whole arrays at once.
+    """
+    cells = np.char.mod(f"%{float_fmt}", values)
+    cells = np.where(np.isnan(values), "", cells)
+    widths = [max([len(title)] + [len(cell) for cell in column])
+              for title, column in zip(titles, cells.T.tolist())]
+    key_width = max([5] + [len(key) for key in keys])
+    lines = [f"{'State':{key_width}} " + " ".join(
+        f"{title:>{width}}" for title, width in zip(titles, widths))]
+    lines += [(f"{key:{key_width}} " + " ".join(
+        f"{cell:>{width}}" for cell, width in zip(row, widths))).rstrip()
+        for key, row in zip(keys, cells.tolist())]
+    return lines
+
+
+def batch_main(args):
+    if args.units not in conversion_factors:
+        print(f"Error! Unknown units choose from: {conversion_factors.keys()}",
+              file=sys.stderr)
         return 1
 
-    better_level = better['calclevel']
-    worse_level = worse['calclevel']
+    with profiling.stage('load'):
+        levels, bases, keys, energies = collect_hierarchy(args.batch)
+    if len(levels) < 2:
+        print(f"Error! The batch needs at least two levels of theory, got:"
+              f" {levels}.", file=sys.stderr)
+        return 1
 
-    worse_len = len(worse_level)
-    if worse_len >= len(better_level):
-        print(
-            f"Error! The better level of theory, {better_level}, is expeted"
-            f" to have a longer name than the worse one, {worse_level}.",
-            file=sys.stderr
-        )
+    try:
+        names = [name_level_correction(better, worse)
+                 for worse, better in zip(levels[:-1], levels[1:])]
+    except RuntimeError as error:
+        print(f"Error! {error}", file=sys.stderr)
         return 1
 
-    core = better_level[:worse_len]
+    with profiling.stage('match'):
+        # (correction × basis × state) of all the adjacent levels at once
+        corrections = energies[1:] - energies[:-1]
+        # The convergence only within a basis set family
+        steps = [row for row in range(1, len(bases))
+                 if basis_family(bases[row]) == basis_family(bases[row - 1])]
+        previous = [row - 1 for row in steps]
+        convergence = corrections[:, steps] - corrections[:, previous]
+        available = np.any(~np.isnan(corrections), axis=2)
 
-    if core != worse_level:
-        print(f"Warning! Correcting {worse_level} with the seemingly"
-              f" incompatibile {better_level}.", file=sys.stderr)
+    conversion = conversion_factors[args.units]
+    labels = [si.key_to_str(key) for key in keys]
+    lines = list()
+    for position, name in enumerate(names):
+        lines += [
+            f"The {name} correction: {levels[position + 1]} -"
+            f" {levels[position]}.",
+            f"Energies in {args.units}.",
+            "",
+        ]
+        lines += format_columns(bases, labels,
+                                corrections[position].T * conversion)
+        if len(steps) != 0:
+            lines += ["", f"Change of {name} from the previous basis set."]
+            lines += format_columns([bases[row] for row in steps], labels,
+                                    convergence[position].T * conversion)
+        lines += ["", ""]
+
+    with profiling.stage('serialize'):
+        sys.stdout.write("\n".join(lines))
+        sys.stdout.flush()
+        if args.xsim_dir is None:
+            return 0
+
+        os.makedirs(args.xsim_dir, exist_ok=True)
+        for row, basis in enumerate(bases):
+            used = available[:, row]
+            if not np.any(used):
+                continue
+            # A state needs all the corrections available at the basis set
+            total = np.sum(corrections[used, row], axis=0)
+            present = ~np.isnan(total)
+            model = "+".join(f"{name}/{basis}" for name, keep in
+                             zip(names, used.tolist()) if keep)
+            states = States.from_dicts([
+                {'irrep': {'energy #': key[0], 'name': key[1]},
+                 'model': model}
+                for key, keep in zip(keys, present.tolist()) if keep])
+            extension = 'ndjson' if args.ndjson is True else 'json'
+            file_name = os.path.join(args.xsim_dir,
+                                     f"{basis}+corrections.{extension}")
+            with open(file_name, 'w') as output:
+                records.write_list(to_xsim(states, total[present]),
+                                   ndjson=args.ndjson, file=output)
 
-    better_cc_energy = better['cc_energy']
-    worse_cc_energy = worse['cc_energy']
+    return 0
+
+
+@profiling.profiled('pprint_dT')
+def main():
+    args = get_args()
+    if args.batch is not None:
+        if args.better is not None:
+            print("Error! Use either the better and worse files or --batch.",
+                  file=sys.stderr)
+            return 1
+        return batch_main(args)
+    if args.worse is None:
+        print("Error! Both the better and the worse files are needed.",
+              file=sys.stderr)
+        return 1
 
-    conversion_factors = {
-        "au": 1.0,
-        "eV": ha2eV,
-        "cm": ha2cm,
-    }
+    with profiling.stage('load'):
+        better, better_states = records.read_group(args.better)
+        worse, worse_states = records.read_group(args.worse)
+
+    try:
+        correction_name = name_correction(better, worse)
+    except RuntimeError as error:
+        print(f"Error! {error}", file=sys.stderr)
+        return 1
 
     if args.units not in conversion_factors:
         print(f"Error! Unknown units choose from: {conversion_factors.keys()}",
               file=sys.stderr)
         return 1
 
-    correction_name = "Δ" + better_level[worse_len:] + "/" + basis
     conversion = conversion_factors[args.units]
+    better_level = better['calclevel']
+    worse_level = worse['calclevel']
 
-    message = ""
-    message += f"The {correction_name} correction.\n"
-    message += f"Energies in {args.units}.\n\n"
-    message += f"{'State':5} {worse_level:>6} {better_level:>6}"
-    message += f" {correction_name} Err. est.\n"
+    header = [
+        f"The {correction_name} correction.",
+        f"Energies in {args.units}.",
+        "",
+        f"{'State':5} {worse_level:>6} {better_level:>6}"
+        f" {correction_name} Err. est.",
+    ]
+
+    # The states are read as they are matched
+    with profiling.stage('match'):
+        states, worse_eom_energy, better_eom_energy, eom_energy_correction = \
+            find_correction(better, better_states, worse, worse_states)
+    error_est = 0.5 * np.abs(eom_energy_correction)
 
-    # container for xsim's output
-    better_energies = []
     float_fmt = "6.3f"
-    for better_state in better['EOM']:
-        state_str = str(better_state['irrep']['energy #'])
-        state_str += better_state['irrep']['name']
-        found_it = False
-
-        for worse_state in worse['EOM']:
-            if states_match(better_state, worse_state):
-                worse_eom_energy = worse_state['energy'] - worse_cc_energy
-                better_eom_energy = better_state['energy'] - better_cc_energy
-                eom_energy_correction = better_eom_energy - worse_eom_energy
-                error_est = 0.5 * abs(eom_energy_correction)
-                message += f"{state_str:5}"
-                message += f" {worse_eom_energy*conversion:{float_fmt}}"
-                message += f" {better_eom_energy*conversion:{float_fmt}}"
-                message += f" {eom_energy_correction*conversion:{float_fmt}}"
-                message += f" {error_est*conversion:{float_fmt}}"
-                message += "\n"
-
-                state = {
-                    "irrep": better_state['irrep'],
-                    "model": correction_name,
-                    "energy": {
-                        "transition": {
-                            "eV": eom_energy_correction *
-                            conversion_factors['eV'],
-                            "au": eom_energy_correction *
-                            conversion_factors['au'],
-                        },
-                    },
-                }
-                better_energies += [state]
-
-                found_it = True
-                break
-
-        if found_it is False:
-            print("Warning! No match in the lower level calculation for the"
-                  f" state {state_str}.", file=sys.stderr)
+    table = np.column_stack(
+        [worse_eom_energy, better_eom_energy, eom_energy_correction,
+         error_est]) * conversion
+    lines = [
+        f"{si.key_to_str(key):5} " +
+        " ".join(f"{value:{float_fmt}}" for value in row)
+        for key, row in zip(states.keys(), table.tolist())
+    ]
+    message = "\n".join(header + lines) + "\n"
 
-    if args.xsim is True:
-        print(json.dumps(better_energies))
-    else:
-        print(message)
+    # container for xsim's output
+    better_energies = to_xsim(states, eom_energy_correction)
+    for state in better_energies:
+        state['model'] = correction_name
+
+    with profiling.stage('serialize'):
+        if args.binary is not None:
+            container.save_group(args.binary, None, better_energies)
+
+        if args.xsim is True:
+            records.write_list(better_energies, ndjson=args.ndjson)
+        else:
+            print(message)
 
     return 0
 
@@ -0,0 +1,312 @@
+#!/usr/bin/env python
+"""
+Evaluates a focal-point (additive model) recipe.
+
+A recipe is a JSON file that declares the nodes of a DAG, e.g., for
+CCSD/CBS(pwCVnZ) + ΔT/ANO1 + ΔQ/ANO0:
+    {
+        "nodes": {
+            "cbs": {"kind": "cbs", "ab_initio": "ccsd+pwCVnZ.json"},
+            "dT": {"kind": "delta", "better": "ccsdt+ano1.json",
+                   "worse": "ccsd+ano1.json"},
+            "dQ": {"kind": "delta", "better": "ccsdtq+ano0.json",
+                   "worse": "ccsdt+ano0.json"},
+            "total": {"kind": "sum", "inputs": ["cbs", "dT", "dQ"]}
+        },
+        "target": "total"
+    }
+The kinds of nodes are
+    - cbs: the CBS extrapolation of an ab initio data set (`find_cbs.py`);
+      optional "use_all": true fits all points,
+    - delta: the higher level correction from two single-basis ab initio
+      files (`dT/pprint_dT.py`),
+    - xsim: a ready xsim's 'better energies' file, e.g., a core correction,
+    - sum: the sum of the other nodes (`merge.py`); optional "errors": true
+      propagates the error estimates.
+Every node results in the xsim's 'better energies' of its states. File
+paths are relative to the recipe.
+
+Each result is memoized in a binary container named after the hash of the
+node, its input files, and the hashes of the nodes it depends on. Changing
+one input file recomputes only the nodes downstream of it. Independent
+nodes run in parallel.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import (
+    ProcessPoolExecutor, wait, FIRST_COMPLETED,
+)
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(ROOT, 'cbs_fit'))
+sys.path.insert(0, os.path.join(ROOT, 'dT'))
+from columnar import States, StringTable  # noqa: E402
+import container  # noqa: E402
+import events  # noqa: E402
+import profiling  # noqa: E402
+import records  # noqa: E402
+import state_index as si  # noqa: E402
+
+NODE_FILES = {
+    'cbs': ('ab_initio',),
+    'delta': ('better', 'worse'),
+    'xsim': ('file',),
+    'sum': (),
+}
+MEMO_DIRECTORY = '.focal_point'
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="Evaluates a focal-point recipe: a DAG of CBS"
+        " extrapolations, higher level corrections, and their sums.")
+    parser.add_argument('recipe', help="JSON file with the recipe.")
+    parser.add_argument(
+        '-t', '--target', default=None,
+        help="Node to evaluate. Default: the recipe's 'target'.")
+    parser.add_argument(
+        '-j', '--workers', default=None, type=int,
+        help="Number of nodes evaluated at the same time. Default: the"
+        " number of CPUs.")
+    parser.add_argument(
+        '-m', '--memo-dir', default=None,
+        help="Directory of the memoized node results. Default:"
+        f" {MEMO_DIRECTORY} next to the recipe.")
+    parser.add_argument(
+        '--ndjson', default=False, action='store_true',
+        help="Print one state per line (NDJSON).")
+    parser.add_argument(
+        '-o', '--binary', default=None, metavar='FILE',
+        help="Save the result to FILE in the binary container format (see"
+        " cbs_fit/container.py) instead of printing it.")
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    return args
+
+
+def read_recipe(file_name):
+    """
+    Reads the recipe and checks the nodes. Returns `(nodes, target)` with
+    the file paths made absolute.
+    """
+    with open(file_name) as recipe_json:
+        recipe = json.load(recipe_json)
+
+    base = os.path.dirname(os.path.abspath(file_name))
+    nodes = dict()
+    for name, node in recipe['nodes'].items():
+        kind = node.get('kind')
+        if kind not in NODE_FILES:
+            raise RuntimeError(f"Node {name} has unknown kind {kind}. Choose"
+                               f" from: {list(NODE_FILES)}.")
+        node = dict(node)
+        for key in NODE_FILES[kind]:
+            if key not in node:
+                raise RuntimeError(f"Node {name} needs the '{key}' file.")
+            node[key] = os.path.join(base, node[key])
+        for dependency in node.get('inputs', []):
+            if dependency not in recipe['nodes']:
+                raise RuntimeError(
+                    f"Node {name} depends on the unknown node {dependency}.")
+        nodes[name] = node
+
+    return nodes, recipe.get('target')
+
+
+def upstream(nodes, target):
+    """
+    Returns the nodes needed for the `target`, each after all the nodes it
+    depends on.
+    """
+    order = list()
+    visiting = set()
+
+    def visit(name):
+        if name in order:
+            return
+        if name in visiting:
+            raise RuntimeError(f"The recipe has a cycle through {name}.")
+        visiting.add(name)
+        for dependency in nodes[name].get('inputs', []):
+            visit(dependency)
+        visiting.remove(name)
+        order.append(name)
+
+    if target not in nodes:
+        raise RuntimeError(f"Unknown target node {target}.")
+    visit(target)
+    return order
+
+
+def digest_file(path):
+    """ The sha256 of a file, or of all files in a directory tree. """
+    digest = hashlib.sha256()
+    paths = [path]
+    if os.path.isdir(path):
+        paths = sorted(os.path.join(root, name)
+                       for root, _, files in os.walk(path) for name in files)
+    for one in paths:
+        digest.update(os.path.relpath(one, path).encode())
+        with open(one, 'rb') as data:
+            for chunk in iter(lambda: data.read(2**20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def node_keys(nodes, order):
+    """ Hashes every node together with its inputs and dependencies. """
+    keys = dict()
+    for name in order:
+        node = nodes[name]
+        normalized = {
+            'node': {key: value for key, value in node.items()
+                     if key not in NODE_FILES[node['kind']]},
+            'files': [digest_file(node[key])
+                      for key in NODE_FILES[node['kind']]],
+            'inputs': [keys[dependency]
+                       for dependency in node.get('inputs', [])],
+        }
+        keys[name] = hashlib.sha256(
+            json.dumps(normalized, sort_keys=True).encode()).hexdigest()
+    return keys
+
+
+def evaluate_cbs(node):
+    from find_cbs import find_cbs
+    from columnar import load_dataset
+    from turn_cbs_into_xsim_input import prepare_xsim_input
+
+    # The fitting messages would mix with the other nodes
+    with events.threshold(events.WARNING):
+        dataset = load_dataset(node['ab_initio'])
+        cbs_header, cbs_eom = find_cbs(
+            dataset, use_best=not node.get('use_all', False), plot_jobs=False)
+    cbs = dict(cbs_header)
+    cbs['EOM'] = cbs_eom
+    return container.Container.from_dicts(None, prepare_xsim_input(cbs))
+
+
+def evaluate_delta(node):
+    from pprint_dT import name_correction, find_correction
+
+    better, better_states = records.read_group(node['better'])
+    worse, worse_states = records.read_group(node['worse'])
+    correction_name = name_correction(better, worse)
+    states, _, _, correction = find_correction(
+        better, better_states, worse, worse_states)
+    table = states.table.copy()
+    table['model'] = 0
+    states = States(table, states.irreps, StringTable([correction_name]))
+    return container.Container(
+        None, states, container.transition_fields(correction))
+
+
+def evaluate_sum(node, inputs):
+    from merge import compose
+
+    first, *corrections = [container.load(path) for path in inputs]
+    composed, missing = compose(
+        first, corrections, node['inputs'][1:],
+        errors=node.get('errors', False))
+    for key, names in missing.items():
+        print(f"Warning! Missing data about {si.key_to_str(key)} in: "
+              f"{', '.join(names)}", file=sys.stderr)
+    return composed
+
+
+def evaluate(node, inputs, output):
+    """
+    Computes a single node from the memoized results of its `inputs` and
+    saves it to `output`. Runs in a worker process.
+    """
+    kind = node['kind']
+    if kind == 'cbs':
+        result = evaluate_cbs(node)
+    elif kind == 'delta':
+        result = evaluate_delta(node)
+    elif kind == 'xsim':
+        _, states = records.read_group(node['file'])
+        result = container.Container.from_dicts(None, states)
+    elif kind == 'sum':
+        result = evaluate_sum(node, inputs)
+    container.save(output, result)
+    return output
+
+
+def run(nodes, target, memo_directory, workers=None):
+    """
+    Evaluates the `target` node, reusing the memoized results. Returns the
+    path of its container and the lists of the computed and reused nodes.
+    """
+    order = upstream(nodes, target)
+    keys = node_keys(nodes, order)
+    os.makedirs(memo_directory, exist_ok=True)
+    paths = {
+        name: os.path.join(memo_directory, keys[name] + container.EXTENSION)
+        for name in order
+    }
+
+    done = {name for name in order if os.path.exists(paths[name])}
+    reused = [name for name in order if name in done]
+    computed = list()
+    running = dict()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        while len(done) < len(order):
+            for name in order:
+                ready = all(dependency in done
+                            for dependency in nodes[name].get('inputs', []))
+                if name in done or name in running.values() or not ready:
+                    continue
+                inputs = [paths[dependency]
+                          for dependency in nodes[name].get('inputs', [])]
+                future = executor.submit(
+                    evaluate, nodes[name], inputs, paths[name])
+                running[future] = name
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    future.result()
+                except Exception as error:
+                    raise RuntimeError(
+                        f"Node {name} failed: {error}") from error
+                done.add(name)
+                computed += [name]
+
+    return paths[target], computed, reused
+
+
+@profiling.profiled('focal_point')
+def main():
+    args = get_args()
+    nodes, target = read_recipe(args.recipe)
+    if args.target is not None:
+        target = args.target
+    memo_directory = args.memo_dir
+    if memo_directory is None:
+        memo_directory = os.path.join(
+            os.path.dirname(os.path.abspath(args.recipe)), MEMO_DIRECTORY)
+
+    with profiling.stage('evaluate'):
+        result, computed, reused = run(nodes, target, memo_directory,
+                                       args.workers)
+    print(f"Computed: {', '.join(computed) or 'none'}. Reused:"
+          f" {', '.join(reused) or 'none'}.", file=sys.stderr)
+
+    with profiling.stage('serialize'):
+        result = container.load(result)
+        if args.binary is not None:
+            container.save(args.binary, result)
+        else:
+            records.write_list(result.iter_states(), ndjson=args.ndjson)
+
+    return 0
+
+
+if __name__ == "__main__":
+    main()
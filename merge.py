@@ -1,50 +1,228 @@
 #!/usr/bin/env python
 
 import argparse
-import json
+import copy
+import os
 import sys
 
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'cbs_fit'))
+import worker_client  # noqa: E402
+if __name__ == "__main__":
+    # Forward to the warm server before the heavy imports
+    worker_client.forward('merge')
+import numpy as np  # noqa: E402
+from columnar import States, StringTable  # noqa: E402
+import container  # noqa: E402
+import profiling  # noqa: E402
+import records  # noqa: E402
+import state_index as si  # noqa: E402
+import uncertainty  # noqa: E402
+
+TRANSITION = 'energy/transition/'
+ERROR = 'energy/error est/'
+CI = 'energy/ci/'
+UNITS = ('eV', 'au')
+
 
 def get_args():
     parser = argparse.ArgumentParser(
-        description="Take two files prepared to be inputs for xsim's 'better "
-        "energies' file and add them togher: energies and 'model' names.")
+        description="Take files prepared to be inputs for xsim's 'better "
+        "energies' file and add them togher: energies and 'model' names. The"
+        " corrections from all the other files are added to the states of"
+        " the first one.")
     parser.add_argument('first',
-                        help="file in the xsim's 'better energies' format.")
-    parser.add_argument('second',
-                        help="file in the xsim's 'better energies' format.")
+                        help="file in the xsim's 'better energies' format"
+                        " (JSON, NDJSON, or a binary container).")
+    parser.add_argument('corrections', nargs='+',
+                        help="files in the xsim's 'better energies' format"
+                        " (JSON, NDJSON, or a binary container), e.g., the"
+                        " ΔT, ΔQ, and core corrections.")
+    parser.add_argument('-e', '--errors', default=False, action='store_true',
+                        help="Add the error estimates of all files in"
+                        " quadrature and save them as 'error est' next to"
+                        " the 'transition' energy. A file without error"
+                        " estimates contributes half of its correction, or"
+                        " nothing for the first file.")
+    parser.add_argument('--ndjson', default=False, action='store_true',
+                        help="Print one state per line (NDJSON).")
+    parser.add_argument('-o', '--binary', default=None, metavar='FILE',
+                        help="Save the result to FILE in the binary"
+                        " container format (see cbs_fit/container.py)"
+                        " instead of printing it.")
+    uncertainty.add_arguments(parser)
+    profiling.add_arguments(parser)
     args = parser.parse_args()
     return args
 
 
-def main():
-    args = get_args()
-    with open(args.first) as first_json:
-        first = json.load(first_json)
+def load_states(file_name):
+    """
+    Reads the xsim's 'better energies' file into a container. Returns the
+    container and, for the JSON files, the list of the states as read: the
+    container holds only the numeric fields that all the states have.
+    """
+    if records.is_container(file_name):
+        return container.load(file_name), None
+    _, states = records.read_group(file_name)
+    states = list(states)
+    return container.Container.from_dicts(None, states, common=True), states
+
+
+def _update(target: dict, source: dict):
+    for key, value in source.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _update(target[key], value)
+        else:
+            target[key] = value
+
+
+def carry_fields(first_states, composed: container.Container):
+    """
+    Yields the composed states with the other fields of the first file's
+    states, e.g., notes or fields that only some states have, kept.
+    """
+    for original, state in zip(first_states, composed.iter_states()):
+        merged = copy.deepcopy(original)
+        _update(merged, state)
+        yield merged
+
+
+def match_rows(keys, other: container.Container, name: str):
+    """
+    Returns the rows of `other` matching the state `keys`, -1 if missing.
+    The states of `other` are hashed once.
+    """
+    index = dict()
+    for row, key in enumerate(other.states.keys(with_model=False)):
+        if key in index:
+            print(f"Warning! {name} has duplicated data about "
+                  f"{si.key_to_str(key)}", file=sys.stderr)
+            continue
+        index[key] = row
+    return np.array([index.get(key, -1) for key in keys], dtype=int)
+
 
-    with open(args.second) as second_json:
-        second = json.load(second_json)
+def transition(states: container.Container, unit: str):
+    # An empty file has no fields at all
+    return states.fields.get(TRANSITION + unit, np.zeros(len(states.states)))
 
-    for state in first:
-        found_it = False
-        for addition in second:
-            if addition['irrep'] != state['irrep']:
+
+def error_estimates(states: container.Container, is_correction: bool):
+    """ The stored error estimates, or the defaults of `--errors`. """
+    if all(ERROR + unit in states.fields for unit in UNITS):
+        return [np.asarray(states.fields[ERROR + unit]) for unit in UNITS]
+    if is_correction is False:
+        return [np.zeros(len(states.states)) for _ in UNITS]
+    return [0.5 * np.abs(transition(states, unit)) for unit in UNITS]
+
+
+def spreads(states: container.Container, is_correction: bool,
+            level: float):
+    """
+    The standard deviations (a.u.) below and above the energies of the
+    states for `--mc`: from the 'ci' of the file, taken at the `level`, or
+    the `error_estimates`.
+    """
+    if CI + 'au/low' in states.fields:
+        return uncertainty.spread_from_interval(
+            transition(states, 'au'), states.fields[CI + 'au/low'],
+            states.fields[CI + 'au/high'], level)
+    error = error_estimates(states, is_correction)[UNITS.index('au')]
+    return error, error
+
+
+def compose(first: container.Container, corrections, names,
+            errors: bool = False, samples: int = 0,
+            level: float = uncertainty.DEFAULT_LEVEL,
+            seed: int | None = None):
+    """
+    Adds the `corrections` (containers) to the states of `first`, matching
+    the states by irreps only. Returns the composed container and a dict
+    that maps the key of every state lacking some correction to the names
+    of the files without it.
+
+    With `samples`, the confidence intervals of the sums are estimated from
+    as many Monte Carlo samples of all the files at once; see
+    `uncertainty.py`.
+    """
+    # The files hold different models, e.g., CBS and ΔT: match irreps
+    keys = first.states.keys(with_model=False)
+    energies = [np.array(transition(first, unit)) for unit in UNITS]
+    if errors is True:
+        variances = [error**2 for error in error_estimates(first, False)]
+    if samples > 0:
+        deviations = [spreads(first, False, level)]
+    labels = [[first.states.models[model]]
+              for model in first.states.table['model'].tolist()]
+
+    missing = dict()
+    for other, name in zip(corrections, names):
+        rows = match_rows(keys, other, name)
+        found = rows >= 0
+        for energy, unit in zip(energies, UNITS):
+            energy[found] += transition(other, unit)[rows[found]]
+        if errors is True:
+            for variance, error in zip(variances,
+                                       error_estimates(other, True)):
+                variance[found] += error[rows[found]]**2
+        if samples > 0:
+            deviations += [tuple(
+                np.where(found, deviation[np.maximum(rows, 0)], 0.0)
+                for deviation in spreads(other, True, level))]
+
+        other_models = other.states.table['model']
+        for position, row in enumerate(rows.tolist()):
+            if row < 0:
+                missing.setdefault(keys[position], []).append(name)
                 continue
+            labels[position] += [other.states.models[other_models[row]]]
+
+    models = StringTable()
+    table = first.states.table.copy()
+    table['model'] = [models.intern('+'.join(label)) for label in labels]
 
-            energy_corr = addition['energy']['transition']
-            state['energy']['transition']['eV'] += energy_corr['eV']
-            state['energy']['transition']['au'] += energy_corr['au']
+    fields = {TRANSITION + unit: energy
+              for energy, unit in zip(energies, UNITS)}
+    if errors is True:
+        fields.update({ERROR + unit: np.sqrt(variance)
+                       for variance, unit in zip(variances, UNITS)})
+    if samples > 0:
+        rng = np.random.default_rng(uncertainty.new_seed(seed))
+        total = uncertainty.sample_sum(
+            energies[UNITS.index('au')], deviations, samples, rng)
+        fields.update(uncertainty.interval_fields(
+            *uncertainty.interval(total, level)))
 
-            state['model'] += '+' + addition['model']
+    composed = container.Container(
+        None, States(table, first.states.irreps, models), fields,
+        first.model_key)
+    return composed, missing
 
-            found_it = True
-            break
 
-        if found_it is False:
-            print("Warning! Second file is missing data about "
-                  f"{state['irrep']}", file=sys.stderr)
+@profiling.profiled('merge')
+def main():
+    args = get_args()
+    with profiling.stage('load'):
+        first, first_states = load_states(args.first)
+        corrections = [load_states(name)[0] for name in args.corrections]
+
+    with profiling.stage('compose'):
+        composed, missing = compose(first, corrections, args.corrections,
+                                    errors=args.errors, samples=args.mc,
+                                    level=args.ci, seed=args.seed)
+    with profiling.stage('serialize'):
+        if args.binary is not None:
+            container.save(args.binary, composed)
+        elif first_states is not None:
+            records.write_list(carry_fields(first_states, composed),
+                               ndjson=args.ndjson)
+        else:
+            records.write_list(composed.iter_states(), ndjson=args.ndjson)
 
-    print(json.dumps(first))
+    for key, names in missing.items():
+        print(f"Warning! Missing data about {si.key_to_str(key)} in: "
+              f"{', '.join(names)}", file=sys.stderr)
 
     return 0
 
@@ -0,0 +1,11 @@
+import os
+import sys
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA = os.path.join(REPO, 'tests', 'data')
+
+# The tools are scripts that import each other from their directories
+for directory in (REPO, os.path.join(REPO, 'cbs_fit'),
+                  os.path.join(REPO, 'dT')):
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
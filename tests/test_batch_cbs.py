@@ -0,0 +1,29 @@
+import os
+import subprocess
+import sys
+import pytest
+from conftest import REPO
+from batch_cbs import find_datasets
+
+
+def test_find_datasets_takes_files_and_directories(tmp_path):
+    tree = tmp_path / 'tree'
+    (tree / 'b').mkdir(parents=True)
+    (tree / 'a.json').write_text('[]')
+    (tree / 'a+cbs.json').write_text('[]')
+    (tree / 'b' / 'c.json').write_text('[]')
+    single = tmp_path / 'single.ndjson'
+    single.write_text('')
+
+    assert find_datasets([str(single), str(tree)], '*.json') == [
+        str(single), str(tree / 'a.json'), str(tree / 'b' / 'c.json')]
+
+
+@pytest.mark.parametrize('tool', ['batch_cbs.py', 'scan_cbs.py'])
+def test_no_data_sets_is_an_error(tmp_path, tool):
+    result = subprocess.run(
+        [sys.executable, os.path.join(REPO, 'cbs_fit', tool), str(tmp_path)],
+        capture_output=True, text=True, cwd=tmp_path)
+
+    assert result.returncode == 1
+    assert "Error! No data sets found." in result.stderr
@@ -0,0 +1,48 @@
+import os
+import shutil
+import pytest
+from conftest import DATA
+import cfour_ingest
+
+OUTPUT = os.path.join(DATA, 'cfour', 'output.c4')
+
+
+def test_scan_output_reads_the_record():
+    record = cfour_ingest.ingest_file(OUTPUT)
+
+    assert record['basis'] == 'aug-pwCVTZ'
+    assert record['calclevel'] == 'CCSD'
+    assert record['scf'] == pytest.approx(-76.0571234567890)
+    assert record['cc_energy'] == pytest.approx(-76.3412345678901)
+    states = [(state['irrep']['energy #'], state['irrep']['name'],
+               state['model']) for state in record['EOM']]
+    # The roots are numbered within their symmetry blocks; the block 2
+    # (A2) has none
+    assert states == [
+        (1, 'A1', 'EOMEE-CCSD'),
+        (2, 'A1', 'EOMEE-CCSD'),
+        (1, 'B1', 'EOMEE-CCSD'),
+        (1, 'B2', 'EOMEE-CCSD'),
+    ]
+    assert [state['energy'] for state in record['EOM']] == pytest.approx(
+        [-76.0123456789012, -75.9876543210987, -76.0234567890123,
+         -76.0011223344556])
+
+
+def test_ingest_skips_unreadable_outputs(tmp_path, capsys):
+    good = tmp_path / 'good'
+    good.mkdir()
+    shutil.copy(OUTPUT, good / 'output.c4')
+    dangling = tmp_path / 'dangling'
+    dangling.mkdir()
+    os.symlink(tmp_path / 'missing.c4', dangling / 'output.c4')
+    empty = tmp_path / 'empty'
+    empty.mkdir()
+    (empty / 'output.c4').write_bytes(b'')
+
+    dataset = cfour_ingest.ingest([str(tmp_path)], workers=1)
+
+    assert [record['basis'] for record in dataset] == ['aug-pwCVTZ']
+    warnings = capsys.readouterr().err
+    assert str(dangling / 'output.c4') in warnings
+    assert str(empty / 'output.c4') in warnings
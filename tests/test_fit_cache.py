@@ -0,0 +1,49 @@
+import math
+import pytest
+from columnar import ColumnarDataset
+from fit_cache import FitCache
+import find_cbs
+
+
+def make_dataset(shift=0.0):
+    records = list()
+    for basis, n in [('aug-pwCVDZ', 2), ('aug-pwCVTZ', 3),
+                     ('aug-pwCVQZ', 4)]:
+        scf = -76.06 + 0.2 * math.exp(-1.6 * n)
+        cc_energy = scf - 0.30 + 0.4 * n ** -3
+        records += [{
+            'basis': basis,
+            'calclevel': 'CCSD',
+            'scf': scf,
+            'cc_energy': cc_energy,
+            'EOM': [{'irrep': {'energy #': 1, 'name': 'A1'},
+                     'model': 'EOMEE-CCSD',
+                     'energy': scf - 0.25 + 0.3 * n ** -3 + shift}],
+        }]
+    return ColumnarDataset.from_records(records)
+
+
+def test_find_cbs_reuses_the_result_of_an_unchanged_data_set(tmp_path,
+                                                             monkeypatch):
+    cache = FitCache(str(tmp_path))
+    fitted = find_cbs.find_cbs(make_dataset(), plot_jobs=False, cache=cache)
+    assert len(cache.entries()) == 1
+
+    def refit(*args, **kwargs):
+        raise AssertionError("The cached data set was fitted again.")
+
+    monkeypatch.setattr(find_cbs, 'fit_scf', refit)
+    assert find_cbs.find_cbs(make_dataset(), plot_jobs=False,
+                             cache=cache) == fitted
+    with pytest.raises(AssertionError):
+        find_cbs.find_cbs(make_dataset(shift=0.001), plot_jobs=False,
+                          cache=cache)
+
+
+def test_the_key_depends_on_the_energies_and_the_fit_mode():
+    dataset = make_dataset()
+
+    assert FitCache.key(dataset, True) == FitCache.key(make_dataset(), True)
+    assert FitCache.key(dataset, True) != FitCache.key(dataset, False)
+    assert FitCache.key(dataset, True) != FitCache.key(
+        make_dataset(shift=1e-9), True)
@@ -0,0 +1,76 @@
+import json
+import os
+import subprocess
+import sys
+import pytest
+from conftest import REPO
+
+
+def xsim_state(number, irrep, model, au, **extra):
+    state = {
+        'irrep': {'energy #': number, 'name': irrep},
+        'model': model,
+        'energy': {'transition': {'eV': au * 27.211386245988, 'au': au}},
+    }
+    state.update(extra)
+    return state
+
+
+def run_merge(tmp_path, first, *corrections):
+    names = list()
+    for position, states in enumerate((first,) + corrections):
+        path = tmp_path / f'{position}.json'
+        path.write_text(json.dumps(states))
+        names += [str(path)]
+    environment = dict(os.environ)
+    environment.pop('ADDITIVE_MODELS_SERVER', None)
+    result = subprocess.run(
+        [sys.executable, os.path.join(REPO, 'merge.py')] + names,
+        capture_output=True, text=True, check=True, env=environment)
+    return json.loads(result.stdout)
+
+
+def test_merge_keeps_extra_and_ragged_fields(tmp_path):
+    first = [
+        xsim_state(1, 'A1', 'CBS', 0.20, note="bright state"),
+        xsim_state(1, 'B1', 'CBS', 0.21),
+    ]
+    first[1]['energy']['error est'] = {'eV': 0.01, 'au': 0.0004}
+    correction = [
+        xsim_state(1, 'B1', 'ΔT', -0.002, note="from the TZ basis"),
+        xsim_state(1, 'A1', 'ΔT', -0.001),
+    ]
+
+    merged = run_merge(tmp_path, first, correction)
+
+    assert [state['model'] for state in merged] == ['CBS+ΔT', 'CBS+ΔT']
+    assert [state['energy']['transition']['au'] for state in merged] == \
+        pytest.approx([0.199, 0.208])
+    assert merged[0]['note'] == "bright state"
+    assert 'note' not in merged[1]
+    assert merged[1]['energy']['error est'] == {'eV': 0.01, 'au': 0.0004}
+
+
+def test_merge_finds_the_model_after_other_string_fields(tmp_path):
+    first = [{'irrep': {'energy #': 1, 'name': 'A1'}, 'comment': "bright",
+              'model': 'CBS',
+              'energy': {'transition': {'eV': 0.2 * 27.211386245988,
+                                        'au': 0.2}}}]
+    correction = [xsim_state(1, 'A1', 'ΔT', -0.001)]
+
+    merged = run_merge(tmp_path, first, correction)
+
+    assert merged[0]['model'] == 'CBS+ΔT'
+    assert merged[0]['comment'] == "bright"
+    assert merged[0]['energy']['transition']['au'] == pytest.approx(0.199)
+
+
+def test_merge_needs_a_model_name(tmp_path):
+    first = [{'irrep': {'energy #': 1, 'name': 'A1'}, 'comment': "bright",
+              'energy': {'transition': {'eV': 0.2 * 27.211386245988,
+                                        'au': 0.2}}}]
+    correction = [xsim_state(1, 'A1', 'ΔT', -0.001)]
+
+    with pytest.raises(subprocess.CalledProcessError) as failure:
+        run_merge(tmp_path, first, correction)
+    assert "No model name" in failure.value.stderr
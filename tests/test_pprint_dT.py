@@ -0,0 +1,72 @@
+import json
+import os
+import subprocess
+import sys
+import pytest
+from conftest import REPO
+import pprint_dT
+
+# The bases of three families, two of them with the same zeta as ANO1
+BASES = ['aug-pwCVTZ', 'ANO1', 'PWCVDZ', 'aug-pwCVDZ']
+
+
+def write_level(tmp_path, level, excitation):
+    calculations = [{
+        'basis': basis,
+        'calclevel': level,
+        'scf': -76.0,
+        'cc_energy': -76.3,
+        'EOM': [{'irrep': {'energy #': 1, 'name': 'A1'},
+                 'model': f'EOMEE-{level}',
+                 'energy': -76.3 + excitation + 0.001 * position}],
+    } for position, basis in enumerate(BASES)]
+    path = tmp_path / f'{level.lower()}.json'
+    path.write_text(json.dumps(calculations))
+    return str(path)
+
+
+def test_collect_hierarchy_groups_the_bases_by_family(tmp_path):
+    files = [write_level(tmp_path, 'CCSDT', 0.198),
+             write_level(tmp_path, 'CCSD', 0.2)]
+
+    levels, bases, keys, energies = pprint_dT.collect_hierarchy(files)
+
+    assert levels == ['CCSD', 'CCSDT']
+    assert bases == ['ANO1', 'PWCVDZ', 'aug-pwCVDZ', 'aug-pwCVTZ']
+    assert keys == [(1, 'A1', None)]
+    assert energies[1, :, 0] - energies[0, :, 0] == pytest.approx(
+        [-0.002] * 4)
+
+
+def test_batch_prints_the_convergence_within_a_family(tmp_path):
+    files = [write_level(tmp_path, 'CCSD', 0.2),
+             write_level(tmp_path, 'CCSDT', 0.198)]
+    environment = dict(os.environ)
+    environment.pop('ADDITIVE_MODELS_SERVER', None)
+
+    result = subprocess.run(
+        [sys.executable, os.path.join(REPO, 'dT', 'pprint_dT.py'),
+         '--batch'] + files,
+        capture_output=True, text=True, check=True, env=environment)
+
+    lines = result.stdout.splitlines()
+    change = lines.index("Change of ΔT from the previous basis set.")
+    assert lines[change + 1].split() == ['State', 'aug-pwCVTZ']
+
+
+@pytest.mark.parametrize('option', [['-x'], ['-o', 'dT.amb']])
+def test_batch_rejects_the_single_correction_outputs(tmp_path, option):
+    files = [write_level(tmp_path, 'CCSD', 0.2),
+             write_level(tmp_path, 'CCSDT', 0.198)]
+    environment = dict(os.environ)
+    environment.pop('ADDITIVE_MODELS_SERVER', None)
+
+    result = subprocess.run(
+        [sys.executable, os.path.join(REPO, 'dT', 'pprint_dT.py')]
+        + option + ['--batch'] + files,
+        capture_output=True, text=True, cwd=tmp_path, env=environment)
+
+    assert result.returncode == 2
+    assert "do not work with --batch" in result.stderr
+    assert result.stdout == ""
+    assert not (tmp_path / 'dT.amb').exists()
@@ -0,0 +1,52 @@
+import json
+import math
+import pytest
+from columnar import load_dataset
+import find_cbs
+import store
+
+
+def write_dataset(path):
+    calculations = list()
+    for basis, n in [('aug-pwCVDZ', 2), ('aug-pwCVTZ', 3),
+                     ('aug-pwCVQZ', 4)]:
+        scf = -76.06 + 0.2 * math.exp(-1.6 * n)
+        calculations += [{
+            'basis': basis,
+            'calclevel': 'CCSD',
+            'scf': scf,
+            'cc_energy': scf - 0.30 + 0.4 * n ** -3,
+            'EOM': [{'irrep': {'energy #': 1, 'name': 'A1'},
+                     'model': 'EOMEE-CCSD',
+                     'energy': scf - 0.25 + 0.3 * n ** -3}],
+        }]
+    path.write_text(json.dumps(calculations))
+    return str(path)
+
+
+def test_queries_keep_the_ab_initio_and_cbs_records_apart(tmp_path):
+    ab_initio = write_dataset(tmp_path / 'ccsd+pwCVnZ.json')
+    cbs_header, cbs_eom = find_cbs.find_cbs(load_dataset(ab_initio),
+                                            plot_jobs=False)
+    cbs = tmp_path / 'ccsd+pwCVnZ+cbs.json'
+    cbs.write_text(json.dumps(dict(cbs_header, EOM=cbs_eom)))
+    database = str(tmp_path / 'results.db')
+    results = store.Store(database)
+    results.import_file('water', ab_initio)
+    results.import_file('water', str(cbs))
+    results.close()
+
+    query = f'{database}#system=water&calclevel=CCSD'
+    dataset = load_dataset(query)
+    assert dataset.basis == ['aug-pwCVDZ', 'aug-pwCVTZ', 'aug-pwCVQZ']
+    header, _ = find_cbs.find_cbs(dataset, plot_jobs=False)
+    assert header['scf'] == pytest.approx(cbs_header['scf'])
+
+    [stored_cbs] = store.iter_query(query + '&kind=cbs')
+    assert stored_cbs['basis'] == 'CBS'
+    assert stored_cbs['EOM'][0]['correlation'] == pytest.approx(-0.25)
+    assert [data['basis'] for data in store.iter_query(
+        query + '&basis=CBS')] == ['CBS']
+    assert len(list(store.iter_query(query + '&kind=all'))) == 4
+    with pytest.raises(RuntimeError):
+        list(store.iter_query(query + '&kind=other'))
@@ -0,0 +1,71 @@
+import json
+import math
+import pytest
+import watch_cbs
+
+OUTPUT = """\
+       BASIS            IBASIS          {basis}
+       CALCLEVEL        ICLLVL          {level}     [  2]
+  Computational point group: C2v
+     E(SCF)=       {scf:.12f}              0.4321D-08
+  The final electronic energy is       {cc:.12f} a.u.
+  Beginning symmetry block   1.    1 roots requested.
+     Total EOMEE-{level} electronic energy        {eom:.12f} a.u.
+"""
+
+SCF_CBS = -76.06
+CC_CORRELATION_CBS = -0.30
+EOM_CORRELATION_CBS = -0.25
+
+
+def write_output(directory, level, basis, n, offset=0.0, excitation=0.0):
+    """ Writes an output whose energies follow the extrapolation models
+    exactly, shifted by `offset`. """
+    scf = SCF_CBS + 0.2 * math.exp(-1.6 * n) + offset
+    cc = scf + CC_CORRELATION_CBS + 0.4 * n ** -3
+    eom = scf + EOM_CORRELATION_CBS + 0.3 * n ** -3 + excitation
+    job = directory / f'{level.lower()}-{basis}'
+    job.mkdir(parents=True)
+    (job / 'output.c4').write_text(OUTPUT.format(
+        basis=basis.upper(), level=level, scf=scf, cc=cc, eom=eom))
+
+
+@pytest.mark.parametrize('use_best', [True, False])
+def test_update_extrapolates_a_single_basis_family(tmp_path, use_best):
+    system = tmp_path / 'water'
+    for n, basis in enumerate(['aug-pwCVDZ', 'aug-pwCVTZ', 'aug-pwCVQZ'], 2):
+        write_output(system, 'CCSD', basis, n)
+    # The ANO1 energies are off the aug-pwCVnZ curves and must only enter
+    # the ΔT correction
+    write_output(system, 'CCSD', 'ANO1', 2, offset=0.05)
+    write_output(system, 'CCSDT', 'ANO1', 2, offset=0.05, excitation=-0.002)
+    watch = watch_cbs.SystemWatch(str(system), 'output.c4', use_best)
+
+    watch.ingest(watch.snapshot())
+    written = watch.update()
+
+    assert written == [str(system / 'water+cbs.json'),
+                       str(system / 'water+xsim.json')]
+    cbs = json.loads((system / 'water+cbs.json').read_text())
+    assert cbs['calclevel'] == 'CCSD'
+    assert cbs['scf'] == pytest.approx(SCF_CBS)
+    assert cbs['cc_correlation'] == pytest.approx(CC_CORRELATION_CBS)
+    assert cbs['EOM'][0]['correlation'] == pytest.approx(EOM_CORRELATION_CBS)
+    xsim = json.loads((system / 'water+xsim.json').read_text())
+    assert [state['model'] for state in xsim] == ['EOMEE-CCSD+ΔT/ANO1']
+    assert xsim[0]['energy']['transition']['au'] == pytest.approx(
+        EOM_CORRELATION_CBS - CC_CORRELATION_CBS - 0.002)
+
+
+def test_update_waits_for_enough_basis_sets(tmp_path, capsys):
+    system = tmp_path / 'water'
+    write_output(system, 'CCSD', 'aug-pwCVDZ', 2)
+    write_output(system, 'CCSD', 'aug-pwCVTZ', 3)
+    write_output(system, 'CCSD', 'ANO1', 2, offset=0.05)
+    watch = watch_cbs.SystemWatch(str(system), 'output.c4', True)
+
+    watch.ingest(watch.snapshot())
+
+    assert watch.update() == []
+    assert not (system / 'water+cbs.json').exists()
+    assert 'not enough basis sets' in capsys.readouterr().err
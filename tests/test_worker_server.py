@@ -0,0 +1,67 @@
+import json
+import math
+import os
+import subprocess
+import sys
+import time
+import pytest
+from conftest import REPO
+
+
+@pytest.fixture
+def server(tmp_path):
+    socket_path = str(tmp_path / 'server.sock')
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(REPO, 'cbs_fit', 'worker_server.py'),
+         '-s', socket_path], stderr=subprocess.DEVNULL)
+    for _ in range(300):
+        if os.path.exists(socket_path):
+            break
+        time.sleep(0.1)
+    else:
+        process.kill()
+        pytest.fail("The worker server did not start.")
+    yield socket_path
+    process.terminate()
+    process.wait()
+
+
+def write_dataset(path):
+    calculations = list()
+    for basis, n in [('aug-pwCVDZ', 2), ('aug-pwCVTZ', 3),
+                     ('aug-pwCVQZ', 4)]:
+        scf = -76.06 + 0.2 * math.exp(-1.6 * n)
+        calculations += [{
+            'basis': basis,
+            'calclevel': 'CCSD',
+            'scf': scf,
+            'cc_energy': scf - 0.30 + 0.4 * n ** -3,
+            'EOM': [{'irrep': {'energy #': 1, 'name': 'A1'},
+                     'model': 'EOMEE-CCSD',
+                     'energy': scf - 0.25 + 0.3 * n ** -3}],
+        }]
+    path.write_text(json.dumps(calculations))
+    return str(path)
+
+
+def test_served_tools_keep_their_messages(tmp_path, server):
+    dataset = write_dataset(tmp_path / 'ccsd+pwCVnZ.json')
+    find_cbs = [sys.executable, os.path.join(REPO, 'cbs_fit', 'find_cbs.py'),
+                '--no-plots', dataset]
+    environment = dict(os.environ)
+    environment.pop('ADDITIVE_MODELS_SERVER', None)
+    local = subprocess.run(find_cbs, capture_output=True, text=True,
+                           check=True, env=environment)
+    environment['ADDITIVE_MODELS_SERVER'] = server
+
+    served = subprocess.run(find_cbs, capture_output=True, text=True,
+                            check=True, env=environment)
+    log = tmp_path / 'fits.log'
+    subprocess.run(find_cbs + ['--log', str(log)], capture_output=True,
+                   check=True, env=environment)
+
+    assert "Warning! The server" not in served.stderr
+    assert served.stdout == local.stdout
+    assert "Fitting SCF energy" in served.stderr
+    assert served.stderr == local.stderr
+    assert log.read_text() == local.stderr